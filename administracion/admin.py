@@ -1,9 +1,10 @@
 from django.contrib import admin
 
-from administracion.models import Producto, Categoria, EmpresaNombre, HistorialProducto
+from administracion.models import Producto, Categoria, EmpresaNombre, HistorialProducto, SegmentoArchivo
 
 # Register your models here.
 admin.site.register(Producto)
 admin.site.register(Categoria)
 admin.site.register(EmpresaNombre)
-admin.site.register(HistorialProducto)
\ No newline at end of file
+admin.site.register(HistorialProducto)
+admin.site.register(SegmentoArchivo)
@@ -0,0 +1,188 @@
+"""
+Almacenamiento por contenido para las imágenes del historial.
+
+Cada evento del historial (Creado, Vendido, Devolución, Eliminado...) guarda
+la imagen que tenía el producto. En lugar de una copia por evento, los
+archivos se nombran por el SHA-256 de su contenido
+(`historial/ab/ab12...ef.jpg`): la misma imagen se escribe una sola vez y
+todas las filas la comparten. Las referencias son las propias filas de
+HistorialProducto; `limpiar_historial_imagenes` borra los archivos que ya
+ninguna fila usa.
+"""
+import hashlib
+import posixpath
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from .imagenes import FORMATOS, nombre_variante, tamanos
+
+DIRECTORIO = 'historial'
+_almacen = None
+
+
+def hash_contenido(contenido):
+    """SHA-256 de un File de Django, leído por bloques."""
+    sha = hashlib.sha256()
+    for bloque in contenido.chunks():
+        sha.update(bloque)
+    return sha.hexdigest()
+
+
+def nombre_por_contenido(digest, nombre):
+    """`historial/ab/ab12...ef.jpg`: el hash y la extensión del nombre original."""
+    extension = posixpath.splitext(nombre)[1].lower()
+    return f"{DIRECTORIO}/{digest[:2]}/{digest}{extension}"
+
+
+def en_directorio_contenido(nombre):
+    """True si `nombre` está en una carpeta `historial/ab/` (original o variante)."""
+    partes = (nombre or '').split('/')
+    return len(partes) == 3 and partes[0] == DIRECTORIO and len(partes[1]) == 2
+
+
+def es_nombre_por_contenido(nombre):
+    return en_directorio_contenido(nombre) and len(posixpath.splitext(nombre.split('/')[2])[0]) == 64
+
+
+def variantes(nombre):
+    """Nombres de las variantes WebP/JPEG de `nombre` (ver imagenes.py)."""
+    return [nombre_variante(nombre, tamano, extension) for tamano in tamanos() for extension in FORMATOS]
+
+
+class AlmacenContenido(FileSystemStorage):
+    """
+    FileSystemStorage (en MEDIA_ROOT) que ignora el nombre propuesto y
+    guarda cada archivo bajo el hash de su contenido. Si ya existe no lo
+    vuelve a escribir.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre definitivo lo decide _save; nunca se agregan sufijos.
+        # Dentro de _save, FileSystemStorage lo llama cuando el archivo ya
+        # existe: se corta su reintento para que _save devuelva ese nombre
+        if getattr(self._local, 'guardando', False):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        if en_directorio_contenido(name):
+            # Variantes de una imagen ya guardada: van junto a ella con su nombre
+            nombre = name
+        else:
+            nombre = nombre_por_contenido(hash_contenido(content), name)
+            if self.exists(nombre):
+                return nombre
+        self._local.guardando = True
+        try:
+            return super()._save(nombre, content)
+        except FileExistsError:
+            # Otro proceso lo escribió entre exists() y la escritura: por el
+            # nombre, el contenido es el mismo
+            return nombre
+        finally:
+            self._local.guardando = False
+
+
+def almacen_historial():
+    """Storage de HistorialProducto.imagen_producto (callable para las migraciones)."""
+    global _almacen
+    if _almacen is None:
+        _almacen = AlmacenContenido()
+    return _almacen
+
+
+def imagenes_para_historial(imagenes):
+    """
+    {nombre original: nombre por contenido} para las imágenes de producto
+    dadas (FieldFile o nombres). El hash de cada imagen se calcula una sola
+    vez y se recuerda en la caché, así que registrar ventas no vuelve a leer
+    las imágenes.
+    """
+    nombres = {getattr(imagen, 'name', imagen) for imagen in imagenes if imagen}
+    nombres.discard(None)
+    claves = {f'historial:imagen:{nombre}': nombre for nombre in nombres}
+    almacen = almacen_historial()
+    # Lo recordado solo vale si el archivo sigue ahí (la limpieza pudo borrarlo)
+    resultado = {
+        claves[clave]: valor for clave, valor in cache.get_many(list(claves)).items()
+        if almacen.exists(valor)
+    }
+
+    nuevos = {}
+    for nombre in nombres - resultado.keys():
+        if es_nombre_por_contenido(nombre):
+            resultado[nombre] = nombre
+            continue
+        try:
+            with almacen.open(nombre, 'rb') as archivo:
+                resultado[nombre] = almacen.save(nombre, archivo)
+        except FileNotFoundError:
+            continue
+        copiar_variantes(almacen, nombre, resultado[nombre])
+        nuevos[f'historial:imagen:{nombre}'] = resultado[nombre]
+    if nuevos:
+        cache.set_many(nuevos, getattr(settings, 'HISTORIAL_IMAGENES_CACHE_TIMEOUT', 86400))
+    return resultado
+
+
+def copiar_variantes(almacen, origen, destino):
+    """
+    Copia junto a `destino` las variantes que ya tenga la imagen `origen`,
+    sin volver a decodificarla.
+    """
+    for variante_origen, variante_destino in zip(variantes(origen), variantes(destino)):
+        if almacen.exists(variante_destino) or not almacen.exists(variante_origen):
+            continue
+        with almacen.open(variante_origen, 'rb') as archivo:
+            almacen.save(variante_destino, archivo)
+
+
+def imagen_para_historial(imagen):
+    """Nombre por contenido de una imagen de producto, o None si no tiene."""
+    nombre = getattr(imagen, 'name', imagen)
+    if not nombre:
+        return None
+    return imagenes_para_historial([nombre]).get(nombre)
+
+
+def archivos_historial(almacen=None, directorio=DIRECTORIO):
+    """Todos los archivos bajo `directorio` (por contenido y copias antiguas)."""
+    almacen = almacen or almacen_historial()
+    try:
+        carpetas, archivos = almacen.listdir(directorio)
+    except FileNotFoundError:
+        return
+    for archivo in archivos:
+        yield f"{directorio}/{archivo}"
+    for carpeta in carpetas:
+        yield from archivos_historial(almacen, f"{directorio}/{carpeta}")
+
+
+def limpiar_sin_referencias(referenciados, gracia=3600, simular=False):
+    """
+    Borra los archivos del historial que no están en `referenciados` (ni son
+    variantes de uno que lo esté) y tienen más de `gracia` segundos, para no
+    tocar los de una venta que aún no confirma su transacción. Devuelve los
+    nombres borrados.
+    """
+    referenciados = set(referenciados)
+    referenciados.update(variante for nombre in list(referenciados) for variante in variantes(nombre))
+    almacen = almacen_historial()
+    limite = timezone.now() - timedelta(seconds=gracia)
+    borrados = []
+    for nombre in list(archivos_historial(almacen)):
+        if nombre in referenciados or almacen.get_modified_time(nombre) > limite:
+            continue
+        if not simular:
+            almacen.delete(nombre)
+        borrados.append(nombre)
+    return borrados
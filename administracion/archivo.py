@@ -0,0 +1,261 @@
+"""
+Archivo por meses de los registros viejos.
+
+El historial (y, si se pide, las ventas cerradas) con más de
+ARCHIVO_MESES meses se pasa a segmentos mensuales JSONL comprimidos con
+gzip en el storage (`ARCHIVO_DIR/historial/2024-03.jsonl.gz`) y se borra de
+la tabla, que así se mantiene pequeña. SegmentoArchivo es el índice de los
+segmentos: mes, archivo, filas y las imágenes que usan (para que la limpieza
+de imágenes no las borre).
+
+Cada segmento guarda sus filas de la más nueva a la más vieja, el mismo
+orden del listado, así que una página se lee descomprimiendo solo el inicio
+del archivo.
+
+Volver a archivar un mes escribe un archivo nuevo con las filas anteriores
+y las nuevas; el índice pasa a él en la misma transacción que borra las
+filas de la tabla y el archivo viejo se borra al confirmar. Si algo falla a
+medio camino, el segmento registrado y la tabla siguen completos.
+"""
+import functools
+import gzip
+import heapq
+import io
+import itertools
+import json
+from collections.abc import Sequence
+from datetime import date
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.functions import TruncMonth
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import localdate, localtime
+
+from trabajadores.filtros import rango_fechas
+from .models import HistorialProducto, SegmentoArchivo
+
+
+def nombre_segmento(tipo, mes):
+    return f"{getattr(settings, 'ARCHIVO_DIR', 'archivo')}/{tipo}/{mes:%Y-%m}.jsonl.gz"
+
+
+def fin_de_mes(mes):
+    siguiente = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+    return date.fromordinal(siguiente.toordinal() - 1)
+
+
+def horizonte(meses=None, hoy=None):
+    """Primer día del mes más viejo que se conserva en la tabla."""
+    if meses is None:
+        meses = getattr(settings, 'ARCHIVO_MESES', 12)
+    hoy = hoy or localdate()
+    total = hoy.year * 12 + hoy.month - 1 - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def meses_anteriores(queryset, campo, limite):
+    """Meses (primer día, hora local) con filas de `queryset` anteriores a `limite`."""
+    return sorted(
+        localdate(mes)
+        for mes in queryset.filter(rango_fechas(campo, hasta=date.fromordinal(limite.toordinal() - 1)))
+        .annotate(mes=TruncMonth(campo)).order_by().values_list('mes', flat=True).distinct()
+    )
+
+
+def leer_segmento(nombre):
+    """Filas de un segmento, descomprimidas a medida que se leen."""
+    with default_storage.open(nombre, 'rb') as archivo:
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=archivo), encoding='utf-8') as texto:
+            for linea in texto:
+                yield json.loads(linea)
+
+
+def clave_fila(fila):
+    return fila['fecha'], fila['id']
+
+
+def escribir_segmento(tipo, mes, filas, anterior=None):
+    """
+    Guarda `filas` (diccionarios, ya en orden) como un segmento nuevo de
+    `mes`, junto con las del segmento `anterior` si lo hay. Las dos fuentes
+    se unen por orden mientras se leen y una fila que esté en ambas se
+    escribe una sola vez. Nunca sobrescribe: si el nombre está ocupado el
+    storage elige otro. Devuelve (nombre, cantidad de filas).
+    """
+    if anterior:
+        filas = heapq.merge(filas, leer_segmento(anterior), key=clave_fila, reverse=True)
+    cantidad = 0
+    ultimo = None
+    temporal = SpooledTemporaryFile(max_size=getattr(settings, 'REPORTE_MEMORIA_MAXIMA', 5 * 1024 * 1024))
+    with temporal:
+        with gzip.GzipFile(fileobj=temporal, mode='wb') as comprimido:
+            for fila in filas:
+                # Las copias de una fila tienen la misma clave: quedan juntas
+                if fila['id'] == ultimo:
+                    continue
+                ultimo = fila['id']
+                comprimido.write(json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False).encode() + b'\n')
+                cantidad += 1
+        temporal.seek(0)
+        nombre = default_storage.save(nombre_segmento(tipo, mes), File(temporal))
+    return nombre, cantidad
+
+
+def guardar_segmento(tipo, mes, filas, borrar_filas, imagenes=()):
+    """
+    Archiva `filas` en el segmento de `mes` y, en una sola transacción, lo
+    registra en SegmentoArchivo y llama a `borrar_filas()` para quitarlas de
+    la tabla. El archivo anterior del mes se borra solo al confirmar, y el
+    nuevo si la transacción falla. Devuelve el SegmentoArchivo.
+    """
+    previo = SegmentoArchivo.objects.filter(tipo=tipo, mes=mes).first()
+    anterior = previo.archivo if previo else None
+    nombre, total = escribir_segmento(tipo, mes, filas, anterior)
+    try:
+        with transaction.atomic():
+            segmento, _ = SegmentoArchivo.objects.update_or_create(tipo=tipo, mes=mes, defaults={
+                'archivo': nombre,
+                'filas': total,
+                'imagenes': sorted(set(imagenes).union(previo.imagenes if previo else ())),
+            })
+            borrar_filas()
+            if anterior and anterior != nombre:
+                transaction.on_commit(functools.partial(default_storage.delete, anterior))
+    except Exception:
+        default_storage.delete(nombre)
+        raise
+    return segmento
+
+
+def fila_historial(evento):
+    return {
+        'id': evento.pk,
+        'fecha': localtime(evento.fecha_cambio).isoformat(),
+        'producto_id': evento.producto_id,
+        'nombre_producto': evento.nombre_producto,
+        'usuario_id': evento.usuario_id,
+        'usuario': evento.usuario.username,
+        'tipo_cambio': evento.tipo_cambio,
+        'detalle_cambio': evento.detalle_cambio,
+        'cambios': evento.cambios,
+        'imagen_producto': evento.imagen_producto.name or None,
+    }
+
+
+def evento_archivado(fila):
+    """HistorialProducto (sin guardar) para mostrar una fila archivada."""
+    evento = HistorialProducto(
+        id=fila['id'],
+        producto_id=fila['producto_id'],
+        nombre_producto=fila['nombre_producto'],
+        usuario=User(pk=fila['usuario_id'], username=fila['usuario']),
+        tipo_cambio=fila['tipo_cambio'],
+        detalle_cambio=fila['detalle_cambio'],
+        cambios=fila['cambios'],
+        fecha_cambio=parse_datetime(fila['fecha']),
+        imagen_producto=fila['imagen_producto'],
+    )
+    evento._state.adding = False
+    return evento
+
+
+def archivar_historial(meses=None):
+    """
+    Pasa a segmentos el historial anterior al horizonte, un mes a la vez.
+    Devuelve {mes: filas archivadas}.
+    """
+    limite = horizonte(meses)
+    archivados = {}
+    for mes in meses_anteriores(HistorialProducto.objects.all(), 'fecha_cambio', limite):
+        eventos = (
+            HistorialProducto.objects.filter(rango_fechas('fecha_cambio', mes, fin_de_mes(mes)))
+            .select_related('usuario').order_by('-fecha_cambio', '-id')
+        )
+        ids = []
+        imagenes = set()
+
+        def filas():
+            for evento in eventos.iterator(chunk_size=2000):
+                ids.append(evento.pk)
+                if evento.imagen_producto:
+                    imagenes.add(evento.imagen_producto.name)
+                yield fila_historial(evento)
+
+        def borrar():
+            for lote in range(0, len(ids), 500):
+                HistorialProducto.objects.filter(pk__in=ids[lote:lote + 500]).delete()
+
+        # `imagenes` se llena mientras se escriben las filas
+        guardar_segmento(SegmentoArchivo.HISTORIAL, mes, filas(), borrar, imagenes)
+        archivados[mes] = len(ids)
+    return archivados
+
+
+def imagenes_archivadas():
+    """Imágenes del historial que solo siguen referenciadas desde el archivo."""
+    imagenes = set()
+    for lista in SegmentoArchivo.objects.filter(tipo=SegmentoArchivo.HISTORIAL).values_list('imagenes', flat=True):
+        imagenes.update(lista)
+    return imagenes
+
+
+def mes_parametro(valor):
+    """'2024-03' -> date(2024, 3, 1), o None si no es un mes válido."""
+    if not valor or len(valor) != 7:
+        return None
+    try:
+        return parse_date(f"{valor}-01")
+    except ValueError:
+        return None
+
+
+class HistorialArchivado(Sequence):
+    """
+    Historial de un mes archivado, paginable como una lista: cada página
+    descomprime el segmento solo hasta sus filas. Los filtros se aplican
+    mientras se lee; sin filtros el total sale del índice.
+    """
+
+    def __init__(self, segmento, producto_id=None, tipo=None, usuario_id=None, consulta=None, desde=None, hasta=None):
+        self.segmento = segmento
+        self.filtros = [
+            filtro for filtro in (
+                producto_id and (lambda fila: str(fila['producto_id']) == str(producto_id)),
+                tipo and (lambda fila: fila['tipo_cambio'] == tipo),
+                usuario_id and (lambda fila: str(fila['usuario_id']) == str(usuario_id)),
+                consulta and (lambda fila: consulta.casefold() in fila['nombre_producto'].casefold()),
+                desde and (lambda fila: fila['fecha'][:10] >= desde.isoformat()),
+                hasta and (lambda fila: fila['fecha'][:10] <= hasta.isoformat()),
+            ) if filtro
+        ]
+        self._total = None if self.filtros else segmento.filas
+
+    def filas(self):
+        for fila in leer_segmento(self.segmento.archivo):
+            if all(filtro(fila) for filtro in self.filtros):
+                yield fila
+
+    def __len__(self):
+        if self._total is None:
+            self._total = sum(1 for _ in self.filas())
+        return self._total
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return next(self.filas(), None) is not None
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [evento_archivado(fila) for fila in itertools.islice(self.filas(), indice.start, indice.stop)]
+        fila = next(itertools.islice(self.filas(), indice, None), None)
+        if fila is None:
+            raise IndexError(indice)
+        return evento_archivado(fila)
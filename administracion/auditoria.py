@@ -0,0 +1,143 @@
+"""
+Escritura del historial de productos por lotes.
+
+En lugar de un INSERT por evento, `registrar()` junta los eventos de la
+transacción en curso y los guarda con un solo bulk_create cuando la
+transacción se confirma (transaction.on_commit). Si la transacción se
+deshace, los eventos se descartan con ella. Fuera de una transacción el
+evento se guarda en el momento.
+
+Los eventos marcados `segundo_plano` pueden escribirse en un pool de hilos
+(HISTORIAL_HILOS) para no alargar la respuesta; con HISTORIAL_HILOS = 0 se
+guardan junto con los demás. El pool solo registra los errores, así que es
+solo para eventos prescindibles: los de ventas y devoluciones van siempre
+en el lote de la transacción.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from core import sugerencias
+from core.bloqueos import reintentar_si_bloqueada
+from .almacen import imagenes_para_historial
+from .models import HistorialProducto
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'HISTORIAL_HILOS', 0) or 1, thread_name_prefix='historial'
+            )
+        return _executor
+
+
+class Lote:
+    """Eventos pendientes de un nivel de la transacción (un savepoint)."""
+
+    def __init__(self, clave):
+        self.clave = clave
+        self.eventos = []
+        self.segundo_plano = []
+        # Se guarda la función una sola vez para reconocerla en run_on_commit
+        self.vaciar = self._vaciar
+
+    def _vaciar(self):
+        lotes().pop(self.clave, None)
+        # La transacción ya se confirmó: un error aquí no debe deshacer la
+        # operación ni hacer que se reintente, solo se registra
+        try:
+            if self.eventos:
+                guardar(self.eventos)
+            if self.segundo_plano:
+                enviar(self.segundo_plano)
+        except Exception:
+            logger.exception("Error guardando el historial")
+
+
+def lotes():
+    if not hasattr(_local, 'lotes'):
+        _local.lotes = {}
+    return _local.lotes
+
+
+def pendiente(lote):
+    """True si el lote sigue en la cola de on_commit (su transacción no se deshizo)."""
+    return any(funcion is lote.vaciar for _, funcion, _ in connection.run_on_commit)
+
+
+def lote_actual():
+    """
+    Lote de la transacción (y savepoint) en curso. Los lotes que ya no están
+    en la cola de on_commit se deshicieron con su transacción: se descartan.
+    """
+    clave = tuple(connection.savepoint_ids)
+    lote = lotes().get(clave)
+    if lote is None or not pendiente(lote):
+        for otra, anterior in list(lotes().items()):
+            if not pendiente(anterior):
+                del lotes()[otra]
+        lote = lotes()[clave] = Lote(clave)
+        transaction.on_commit(lote.vaciar)
+    return lote
+
+
+def registrar(producto, usuario, tipo_cambio, cambios=None, nombre_producto=None, imagen=None, segundo_plano=False):
+    """
+    Agrega un evento al historial. `cambios` son los datos del evento (ver
+    detalles.py). `imagen` es la imagen del producto (FieldFile o nombre); al
+    guardar se reemplaza por su copia por contenido.
+    """
+    evento = HistorialProducto(
+        producto=producto,
+        nombre_producto=nombre_producto if nombre_producto is not None else producto.nombre,
+        usuario=usuario,
+        tipo_cambio=tipo_cambio,
+        cambios=cambios or {},
+    )
+    evento.imagen_original = getattr(imagen, 'name', imagen) or None
+    if not connection.in_atomic_block:
+        guardar([evento])
+        return evento
+    lote = lote_actual()
+    (lote.segundo_plano if segundo_plano else lote.eventos).append(evento)
+    return evento
+
+
+@reintentar_si_bloqueada
+def guardar(eventos):
+    """Inserta `eventos` con un solo bulk_create."""
+    imagenes = imagenes_para_historial(evento.imagen_original for evento in eventos)
+    for evento in eventos:
+        evento.imagen_producto = imagenes.get(evento.imagen_original)
+    HistorialProducto.objects.bulk_create(eventos)
+    # bulk_create no dispara señales: se avisa al vocabulario del historial
+    sugerencias.vocabulario('historial').agregar(*(evento.nombre_producto for evento in eventos))
+
+
+def guardar_en_hilo(eventos):
+    close_old_connections()
+    try:
+        guardar(eventos)
+    except Exception:
+        logger.exception("Error guardando %s evento(s) del historial", len(eventos))
+    finally:
+        close_old_connections()
+
+
+def enviar(eventos):
+    """Guarda `eventos` en el pool de HISTORIAL_HILOS, o en el momento si es 0."""
+    if getattr(settings, 'HISTORIAL_HILOS', 0):
+        executor().submit(guardar_en_hilo, eventos)
+    else:
+        guardar(eventos)
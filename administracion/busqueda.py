@@ -0,0 +1,218 @@
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import fts
+from .models import Producto
+
+# Peso de cada campo al ordenar resultados (mayor = más relevante)
+CAMPOS = ('nombre', 'categoria', 'descripcion', 'precio')
+PESOS = {'nombre': 8, 'categoria': 4, 'descripcion': 2, 'precio': 1}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para que 'Café' y 'cafe' coincidan."""
+    texto = unicodedata.normalize('NFKD', str(texto or '').casefold())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido en memoria (por proceso) de los productos: cada trigrama
+    apunta a los ids de productos que lo contienen en su nombre, descripción,
+    categoría o precio. Se construye la primera vez que se busca y se mantiene
+    al día con las señales de Producto y Categoria.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._construido_en = None
+        self._textos = {}
+        self._fechas = {}
+        self._postings = defaultdict(set)
+
+    def construir(self):
+        with self._lock:
+            self._textos.clear()
+            self._fechas.clear()
+            self._postings.clear()
+            filas = Producto.objects.values_list(
+                'pk', 'nombre', 'descripcion', 'precio', 'categoria__nombre', 'fecha_creacion'
+            )
+            for pk, nombre, descripcion, precio, categoria, fecha in filas.iterator(chunk_size=2000):
+                self._agregar(pk, nombre, descripcion, precio, categoria, fecha)
+            self._construido_en = time.monotonic()
+
+    def vigente(self):
+        if self._construido_en is None:
+            return False
+        ttl = getattr(settings, 'BUSQUEDA_INDICE_TTL', 300)
+        return not ttl or time.monotonic() - self._construido_en < ttl
+
+    def _agregar(self, pk, nombre, descripcion, precio, categoria, fecha):
+        textos = {
+            'nombre': normalizar(nombre),
+            'categoria': normalizar(categoria),
+            'descripcion': normalizar(descripcion),
+            'precio': normalizar(precio),
+        }
+        self._textos[pk] = textos
+        self._fechas[pk] = fecha.timestamp() if fecha else 0
+        for texto in textos.values():
+            for trigrama in trigramas(texto):
+                self._postings[trigrama].add(pk)
+
+    def _quitar(self, pk):
+        textos = self._textos.pop(pk, None)
+        self._fechas.pop(pk, None)
+        if textos is None:
+            return
+        for texto in textos.values():
+            for trigrama in trigramas(texto):
+                ids = self._postings.get(trigrama)
+                if ids is not None:
+                    ids.discard(pk)
+                    if not ids:
+                        del self._postings[trigrama]
+
+    def actualizar_producto(self, producto):
+        with self._lock:
+            if self._construido_en is None:
+                return
+            self._quitar(producto.pk)
+            self._agregar(
+                producto.pk, producto.nombre, producto.descripcion, producto.precio,
+                producto.categoria.nombre if producto.categoria_id else '', producto.fecha_creacion,
+            )
+
+    def eliminar_producto(self, pk):
+        with self._lock:
+            if self._construido_en is not None:
+                self._quitar(pk)
+
+    def actualizar_categoria(self, categoria):
+        with self._lock:
+            if self._construido_en is None:
+                return
+            for producto in categoria.categoria.all():
+                producto.categoria = categoria
+                self.actualizar_producto(producto)
+
+    def buscar(self, consulta):
+        """
+        Devuelve los ids de los productos cuyo nombre, descripción, categoría
+        o precio contienen `consulta`, ordenados por relevancia y luego por
+        fecha de creación (más recientes primero).
+        """
+        consulta = normalizar(consulta).strip()
+        if not consulta:
+            return []
+        with self._lock:
+            if not self.vigente():
+                self.construir()
+
+            claves = trigramas(consulta)
+            if claves:
+                # Intersección empezando por el trigrama menos frecuente
+                listas = sorted((self._postings.get(t, set()) for t in claves), key=len)
+                candidatos = set(listas[0])
+                for ids in listas[1:]:
+                    candidatos &= ids
+                    if not candidatos:
+                        break
+            else:
+                candidatos = self._textos.keys()
+
+            puntajes = []
+            for pk in candidatos:
+                textos = self._textos[pk]
+                puntaje = sum(PESOS[campo] for campo in CAMPOS if consulta in textos[campo])
+                if puntaje:
+                    if textos['nombre'].startswith(consulta):
+                        puntaje += PESOS['nombre']
+                    puntajes.append((-puntaje, -self._fechas[pk], pk))
+
+        puntajes.sort()
+        return [pk for _, _, pk in puntajes]
+
+
+indice_productos = IndiceTrigramas()
+
+
+def modo_busqueda():
+    """'indice' (trigramas en memoria), 'fts' (FTS5 de SQLite) u 'orm'."""
+    modo = getattr(settings, 'BUSQUEDA_MODO', 'indice')
+    if modo == 'fts' and not fts.disponible():
+        return 'orm'
+    return modo
+
+
+def filtrar_productos_orm(queryset, consulta):
+    return queryset.filter(
+        Q(nombre__icontains=consulta) |
+        Q(descripcion__icontains=consulta) |
+        Q(categoria__nombre__icontains=consulta) |
+        Q(precio__icontains=consulta)
+    )
+
+
+def buscar_productos(consulta):
+    """Ids de los productos que coinciden con `consulta`, del más relevante al menos."""
+    modo = modo_busqueda()
+    if modo == 'fts':
+        return fts.buscar_productos(consulta)
+    if modo == 'orm':
+        return list(
+            filtrar_productos_orm(Producto.objects.all(), consulta)
+            .order_by('-fecha_creacion')
+            .values_list('pk', flat=True)
+        )
+    return indice_productos.buscar(consulta)
+
+
+def filtrar_historial(queryset, consulta):
+    """Filtra el historial por el buscador, con FTS5 si está activo."""
+    if modo_busqueda() == 'fts':
+        if not fts.expresion(consulta):
+            return queryset.none()
+        sql, params = fts.subconsulta_historial(consulta)
+        return queryset.filter(pk__in=RawSQL(sql, params))
+    return queryset.filter(nombre_producto__icontains=consulta)
+
+
+class ResultadosPorIds(Sequence):
+    """
+    Secuencia paginable sobre una lista ordenada de ids: el Paginator solo
+    consulta en la BD los productos de la página que se muestra, en el
+    mismo orden del ranking.
+    """
+
+    def __init__(self, ids, queryset):
+        self.ids = ids
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def exists(self):
+        return bool(self.ids)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            ids = self.ids[indice]
+            objetos = self.queryset.in_bulk(ids)
+            return [objetos[pk] for pk in ids if pk in objetos]
+        return self.queryset.get(pk=self.ids[indice])
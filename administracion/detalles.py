@@ -0,0 +1,88 @@
+"""
+HTML del detalle de cada evento del historial.
+
+Los eventos guardan sus datos en HistorialProducto.cambios (campos con su
+valor anterior y nuevo, venta, cantidad, precio) y el HTML se arma aquí solo
+al mostrarlos. Los registros anteriores a ese cambio tienen el detalle ya
+escrito en detalle_cambio y se muestran tal cual.
+"""
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, mark_safe
+
+
+def imagen(nombre):
+    return format_html(
+        "<img src='{}' style='max-width:100px; vertical-align:middle;'>", default_storage.url(nombre)
+    )
+
+
+def linea_campo(campo):
+    """Una línea del detalle de una edición."""
+    nombre, antes, despues = campo['campo'], campo.get('antes'), campo.get('despues')
+    if nombre == 'cantidad':
+        diferencia = (despues or 0) - (antes or 0)
+        if diferencia > 0:
+            return format_html("Cantidad aumentó en {} (de {} a {})", diferencia, antes, despues)
+        return format_html("Cantidad reducida en {} (de {} a {})", abs(diferencia), antes, despues)
+    if nombre == 'imagen':
+        if antes and despues:
+            return format_html("Imagen: {} → {}", imagen(antes), imagen(despues))
+        if antes:
+            return format_html("Imagen eliminada: {}", imagen(antes))
+        if despues:
+            return format_html("Imagen agregada: {}", imagen(despues))
+        return "Sin cambios en la imagen."
+    if nombre == 'nombre':
+        return format_html("Se cambió el nombre de: <strong>{}</strong> a: <strong>{}</strong>", antes, despues)
+    return format_html("{}: {} → {}", nombre, antes, despues)
+
+
+def detalle_editado(evento, datos):
+    return mark_safe("\n".join(str(linea_campo(campo)) for campo in datos.get('campos', [])))
+
+
+def detalle_vendido(evento, datos):
+    cantidad, precio = abs(datos['cantidad']), Decimal(datos['precio'])
+    return format_html(
+        "vendido por {}<br>Vendido a: <strong>{}</strong><br>Producto: <strong>{}</strong><br>"
+        "Cantidad: <strong>{}</strong><br>Precio unitario: <strong>${}</strong><br>Total: <strong>${}</strong>",
+        evento.usuario.username, datos['cliente'], evento.nombre_producto, cantidad, precio, precio * cantidad,
+    )
+
+
+def detalle_devolucion(evento, datos):
+    cantidad, precio = abs(datos['cantidad']), Decimal(datos['precio'])
+    return format_html(
+        "DEVOLUCIÓN realizada por {}<br>Venta original ID: <strong>{}</strong><br>Cliente: <strong>{}</strong><br>"
+        "Producto: <strong>{}</strong><br>Cantidad devuelta: <strong>{}</strong><br>"
+        "Precio unitario: <strong>${}</strong><br>Total devuelto: <strong>${}</strong>",
+        evento.usuario.username, datos['venta'], datos['cliente'], evento.nombre_producto,
+        cantidad, precio, precio * cantidad,
+    )
+
+
+def detalle_creado(evento, datos):
+    return "Producto creado en el sistema."
+
+
+def detalle_eliminado(evento, datos):
+    return format_html("Producto <strong>'{}'</strong> eliminado del sistema.", evento.nombre_producto)
+
+
+DETALLES = {
+    'Creado': detalle_creado,
+    'Editado': detalle_editado,
+    'Eliminado': detalle_eliminado,
+    'Vendido': detalle_vendido,
+    'Devolución': detalle_devolucion,
+}
+
+
+def detalle_html(evento):
+    """HTML (ya escapado) con el detalle de `evento`."""
+    if evento.cambios is None:
+        # Registro anterior: el HTML se guardó armado
+        return mark_safe(evento.detalle_cambio)
+    return DETALLES[evento.tipo_cambio](evento, evento.cambios)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import EmpresaNombre
+
+CLAVE_CACHE = 'administracion:empresa'
+_SIN_VALOR = object()
+
+
+def obtener_empresa():
+    """
+    Devuelve la configuración de la empresa (el primer EmpresaNombre) desde
+    la caché; solo consulta la BD la primera vez o después de que se guarde
+    o elimine la empresa. Puede devolver None si aún no se ha creado.
+    """
+    empresa = cache.get(CLAVE_CACHE, _SIN_VALOR)
+    if empresa is _SIN_VALOR:
+        empresa = EmpresaNombre.objects.first()
+        cache.set(CLAVE_CACHE, empresa, getattr(settings, 'EMPRESA_CACHE_TIMEOUT', 300))
+    return empresa
+
+
+def invalidar_empresa():
+    cache.delete(CLAVE_CACHE)
@@ -0,0 +1,182 @@
+"""
+Búsqueda de texto completo con tablas virtuales FTS5 de SQLite.
+
+Las tablas se mantienen sincronizadas con triggers en la propia base de
+datos, así que también reflejan los bulk_create y los UPDATE masivos que no
+disparan señales de Django. Si la base no es SQLite o no tiene FTS5, las
+funciones de este módulo no hacen nada y la búsqueda vuelve a los filtros
+del ORM.
+"""
+import re
+
+from django.db import DatabaseError, connection
+
+TABLA_PRODUCTOS = 'administracion_producto_fts'
+TABLA_HISTORIAL = 'administracion_historial_fts'
+TOKENIZADOR = "unicode61 remove_diacritics 2"
+
+# Pesos BM25 por columna: nombre, descripción, categoría
+PESOS_PRODUCTOS = (10.0, 2.0, 5.0)
+
+SQL_TABLAS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_PRODUCTOS}
+        USING fts5(nombre, descripcion, categoria, tokenize="{TOKENIZADOR}")""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_HISTORIAL}
+        USING fts5(nombre_producto, detalle_cambio, tokenize="{TOKENIZADOR}")""",
+]
+
+SQL_INSERTAR_PRODUCTO = f"""
+    INSERT INTO {TABLA_PRODUCTOS}(rowid, nombre, descripcion, categoria)
+    VALUES (new.id, new.nombre, coalesce(new.descripcion, ''),
+            coalesce((SELECT nombre FROM administracion_categoria WHERE id = new.categoria_id), ''));
+"""
+# El detalle indexado es el texto de los registros anteriores más el cliente
+# de las ventas y devoluciones guardado en `cambios`
+SQL_DETALLE_HISTORIAL = "{0}detalle_cambio || ' ' || coalesce(json_extract({0}cambios, '$.cliente'), '')"
+SQL_INSERTAR_HISTORIAL = f"""
+    INSERT INTO {TABLA_HISTORIAL}(rowid, nombre_producto, detalle_cambio)
+    VALUES (new.id, new.nombre_producto, {SQL_DETALLE_HISTORIAL.format('new.')});
+"""
+
+SQL_TRIGGERS = {
+    'administracion_producto_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ai
+        AFTER INSERT ON administracion_producto BEGIN {SQL_INSERTAR_PRODUCTO} END""",
+    'administracion_producto_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ad
+        AFTER DELETE ON administracion_producto BEGIN
+            DELETE FROM {TABLA_PRODUCTOS} WHERE rowid = old.id;
+        END""",
+    # Solo cuando cambian columnas indexadas: los UPDATE de stock no tocan el índice
+    'administracion_producto_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_au
+        AFTER UPDATE OF nombre, descripcion, categoria_id ON administracion_producto BEGIN
+            DELETE FROM {TABLA_PRODUCTOS} WHERE rowid = old.id;
+            {SQL_INSERTAR_PRODUCTO}
+        END""",
+    'administracion_categoria_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_categoria_fts_au
+        AFTER UPDATE OF nombre ON administracion_categoria BEGIN
+            UPDATE {TABLA_PRODUCTOS} SET categoria = new.nombre
+            WHERE rowid IN (SELECT id FROM administracion_producto WHERE categoria_id = new.id);
+        END""",
+    'administracion_historial_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ai
+        AFTER INSERT ON administracion_historialproducto BEGIN {SQL_INSERTAR_HISTORIAL} END""",
+    'administracion_historial_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ad
+        AFTER DELETE ON administracion_historialproducto BEGIN
+            DELETE FROM {TABLA_HISTORIAL} WHERE rowid = old.id;
+        END""",
+    'administracion_historial_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_au
+        AFTER UPDATE OF nombre_producto, detalle_cambio, cambios ON administracion_historialproducto BEGIN
+            DELETE FROM {TABLA_HISTORIAL} WHERE rowid = old.id;
+            {SQL_INSERTAR_HISTORIAL}
+        END""",
+}
+
+SQL_LLENAR = [
+    f"""INSERT INTO {TABLA_PRODUCTOS}(rowid, nombre, descripcion, categoria)
+        SELECT p.id, p.nombre, coalesce(p.descripcion, ''), coalesce(c.nombre, '')
+        FROM administracion_producto p LEFT JOIN administracion_categoria c ON c.id = p.categoria_id""",
+    f"""INSERT INTO {TABLA_HISTORIAL}(rowid, nombre_producto, detalle_cambio)
+        SELECT id, nombre_producto, {SQL_DETALLE_HISTORIAL.format('')} FROM administracion_historialproducto""",
+]
+
+_disponible = {}
+
+
+def soporta_fts5(conexion=connection):
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        opciones = {fila[0] for fila in cursor.fetchall()}
+    return 'ENABLE_FTS5' in opciones
+
+
+def instalar(conexion=connection):
+    """Crea las tablas FTS5 y sus triggers. Devuelve False si no hay FTS5."""
+    if not soporta_fts5(conexion):
+        return False
+    with conexion.cursor() as cursor:
+        for sql in SQL_TABLAS + list(SQL_TRIGGERS.values()):
+            cursor.execute(sql)
+    _disponible.pop(conexion.alias, None)
+    return True
+
+
+def desinstalar(conexion=connection):
+    if conexion.vendor != 'sqlite':
+        return
+    with conexion.cursor() as cursor:
+        for nombre in SQL_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+        for tabla in (TABLA_PRODUCTOS, TABLA_HISTORIAL):
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+    _disponible.pop(conexion.alias, None)
+
+
+def reconstruir(conexion=connection):
+    """Vuelve a crear las tablas desde cero y las llena con los datos actuales."""
+    desinstalar(conexion)
+    if not instalar(conexion):
+        return False
+    with conexion.cursor() as cursor:
+        for sql in SQL_LLENAR:
+            cursor.execute(sql)
+    return True
+
+
+def disponible(conexion=connection):
+    """True si las tablas FTS5 existen en esta base de datos."""
+    if conexion.alias not in _disponible:
+        existe = False
+        if conexion.vendor == 'sqlite':
+            try:
+                with conexion.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                        [TABLA_PRODUCTOS, TABLA_HISTORIAL],
+                    )
+                    existe = cursor.fetchone()[0] == 2
+            except DatabaseError:
+                existe = False
+        _disponible[conexion.alias] = existe
+    return _disponible[conexion.alias]
+
+
+def expresion(consulta):
+    """
+    Convierte el texto del buscador en una expresión MATCH: todas las
+    palabras deben aparecer y cada una se busca como prefijo ("caf" -> café).
+    """
+    palabras = re.findall(r'\w+', consulta or '')
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def buscar_productos(consulta):
+    """Ids de productos ordenados por BM25 (más relevantes primero)."""
+    match = expresion(consulta)
+    if not match:
+        return []
+    pesos = ', '.join(str(peso) for peso in PESOS_PRODUCTOS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {TABLA_PRODUCTOS} WHERE {TABLA_PRODUCTOS} MATCH %s "
+            f"ORDER BY bm25({TABLA_PRODUCTOS}, {pesos})",
+            [match],
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def subconsulta_historial(consulta):
+    """
+    (sql, params) con los ids del historial que coinciden, para usar en
+    `pk__in=RawSQL(...)` junto con los demás filtros de la vista.
+    """
+    return (
+        f"SELECT rowid FROM {TABLA_HISTORIAL} WHERE {TABLA_HISTORIAL} MATCH %s",
+        [expresion(consulta)],
+    )
@@ -0,0 +1,112 @@
+"""
+Variantes de las imágenes subidas (productos, marcas, logo de la empresa).
+
+De cada imagen se guardan, junto al original, copias de IMAGENES_TAMANOS
+píxeles de lado máximo en WebP y en JPEG (`productos/foto_320w.webp`,
+`productos/foto_320w.jpg`...). Las plantillas las piden con srcset (ver
+custom_tags.imagen_responsive) y el navegador descarga solo la que necesita
+en lugar del original. Mientras una imagen no tenga variantes (por ejemplo
+antes de correr `generar_variantes`) se sigue mostrando el original.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+
+def tamanos():
+    return tuple(sorted(getattr(settings, 'IMAGENES_TAMANOS', (96, 320, 800))))
+
+
+def nombre_variante(nombre, tamano, extension):
+    """`productos/foto.png` -> `productos/foto_320w.webp`"""
+    base, _ = posixpath.splitext(nombre)
+    return f"{base}_{tamano}w.{extension}"
+
+
+def imagen_nueva(campo):
+    """True si `campo` (un ImageFieldFile) trae un archivo que aún no se ha guardado."""
+    return bool(campo) and not campo._committed
+
+
+def reducir(imagen, tamano):
+    """Copia de `imagen` con lado máximo `tamano`, sin agrandarla."""
+    copia = imagen.copy()
+    copia.thumbnail((tamano, tamano), Image.Resampling.LANCZOS)
+    return copia
+
+
+def para_jpeg(imagen):
+    """JPEG no admite transparencia: se aplana sobre fondo blanco."""
+    if imagen.mode in ('RGBA', 'LA', 'P'):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        return fondo
+    return imagen.convert('RGB')
+
+
+def generar_variantes(campo):
+    """
+    Crea (o reemplaza) las variantes de la imagen de `campo`. Devuelve los
+    nombres guardados; si la imagen no se puede abrir, registra el error y
+    devuelve una lista vacía.
+    """
+    if not campo:
+        return []
+    storage = campo.storage
+    try:
+        with storage.open(campo.name, 'rb') as archivo:
+            original = Image.open(archivo)
+            original.load()
+    except Exception:
+        logger.exception("No se pudo abrir la imagen %s", campo.name)
+        return []
+
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+
+    guardadas = []
+    calidad = getattr(settings, 'IMAGENES_CALIDAD', 80)
+    for tamano in tamanos():
+        reducida = reducir(original, tamano)
+        for extension, formato in FORMATOS.items():
+            buffer = BytesIO()
+            imagen = reducida if formato == 'WEBP' else para_jpeg(reducida)
+            imagen.save(buffer, format=formato, quality=calidad, optimize=True)
+            nombre = nombre_variante(campo.name, tamano, extension)
+            if storage.exists(nombre):
+                storage.delete(nombre)
+            guardadas.append(storage.save(nombre, ContentFile(buffer.getvalue())))
+    return guardadas
+
+
+def tiene_variantes(campo):
+    """
+    True si la imagen ya tiene sus variantes. Se comprueba la última que se
+    genera (la más grande en JPEG) y se recuerda en el propio campo.
+    """
+    if not campo:
+        return False
+    if getattr(campo, '_tiene_variantes', None) is None:
+        ultima = nombre_variante(campo.name, tamanos()[-1], 'jpg')
+        campo._tiene_variantes = campo.storage.exists(ultima)
+    return campo._tiene_variantes
+
+
+def srcset(campo, extension='jpg'):
+    """Valor del atributo srcset con las variantes de `campo`, o '' si no las tiene."""
+    if not tiene_variantes(campo):
+        return ''
+    return ', '.join(
+        f"{campo.storage.url(nombre_variante(campo.name, tamano, extension))} {tamano}w"
+        for tamano in tamanos()
+    )
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from administracion.archivo import archivar_historial
+from trabajadores.archivo import archivar_ventas
+
+
+class Command(BaseCommand):
+    help = "Pasa el historial (y con --ventas las ventas) más viejo que ARCHIVO_MESES a segmentos mensuales comprimidos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, help="Meses que se conservan en la tabla; por defecto ARCHIVO_MESES.")
+        parser.add_argument('--ventas', action='store_true', help="Archiva también las ventas cerradas.")
+
+    def handle(self, *args, **options):
+        meses = options['meses'] if options['meses'] is not None else getattr(settings, 'ARCHIVO_MESES', 12)
+        for mes, filas in archivar_historial(meses).items():
+            self.stdout.write(f"Historial {mes:%Y-%m}: {filas} registro(s) archivado(s).")
+        if options['ventas']:
+            for mes, filas in archivar_ventas(meses).items():
+                self.stdout.write(f"Ventas {mes:%Y-%m}: {filas} venta(s) archivada(s).")
+        self.stdout.write(self.style.SUCCESS("Archivo al día."))
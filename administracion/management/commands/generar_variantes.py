@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from administracion.imagenes import generar_variantes, tiene_variantes
+from administracion.models import Categoria, EmpresaNombre, HistorialProducto, Producto
+
+# (modelo, campo) con imágenes que se muestran con srcset
+CAMPOS = [
+    (Producto, 'imagen'),
+    (Categoria, 'imagen'),
+    (EmpresaNombre, 'logo'),
+    (HistorialProducto, 'imagen_producto'),
+]
+
+
+class Command(BaseCommand):
+    help = "Genera las variantes WebP/JPEG de las imágenes que aún no las tienen."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true', help="Vuelve a generar también las que ya existen.")
+
+    def handle(self, *args, **options):
+        vistas = set()
+        generadas = 0
+        for modelo, campo in CAMPOS:
+            nombres = (
+                modelo.objects.exclude(**{f'{campo}__isnull': True}).exclude(**{campo: ''})
+                .values_list(campo, flat=True).distinct().iterator()
+            )
+            archivo = modelo._meta.get_field(campo)
+            for nombre in nombres:
+                # El historial suele apuntar al mismo archivo que el producto
+                if nombre in vistas:
+                    continue
+                vistas.add(nombre)
+                imagen = archivo.attr_class(None, archivo, nombre)
+                if not options['forzar'] and tiene_variantes(imagen):
+                    continue
+                if not imagen.storage.exists(nombre):
+                    self.stderr.write(f"No existe el archivo {nombre}.")
+                    continue
+                if generar_variantes(imagen):
+                    generadas += 1
+        self.stdout.write(self.style.SUCCESS(f"Variantes generadas para {generadas} imagen(es)."))
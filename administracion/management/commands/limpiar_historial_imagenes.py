@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from administracion.almacen import limpiar_sin_referencias
+from administracion.archivo import imagenes_archivadas
+from administracion.models import HistorialProducto
+
+
+class Command(BaseCommand):
+    help = "Borra las imágenes del historial que ya no usa ningún registro."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=3600,
+            help="Solo borra archivos con más de estos segundos (por defecto 3600).",
+        )
+        parser.add_argument('--simular', action='store_true', help="Lista los archivos sin borrarlos.")
+
+    def handle(self, *args, **options):
+        # Las referencias de cada archivo son las filas del historial que lo
+        # nombran, en la tabla o en los meses archivados
+        referenciados = set(
+            HistorialProducto.objects.exclude(imagen_producto__isnull=True).exclude(imagen_producto='')
+            .values_list('imagen_producto', flat=True).distinct()
+        )
+        referenciados.update(imagenes_archivadas())
+        borrados = limpiar_sin_referencias(referenciados, options['gracia'], options['simular'])
+        for nombre in borrados:
+            self.stdout.write(nombre)
+        accion = "sin referencias" if options['simular'] else "borradas"
+        self.stdout.write(self.style.SUCCESS(f"{len(borrados)} imagen(es) {accion}."))
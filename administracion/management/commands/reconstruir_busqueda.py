@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from administracion import fts
+
+
+class Command(BaseCommand):
+    help = (
+        "Vuelve a crear y llenar las tablas FTS5 de búsqueda de productos e historial "
+        "con BUSQUEDA_MODO = 'fts'; con otro modo las borra junto con sus triggers."
+    )
+
+    def handle(self, *args, **options):
+        modo = getattr(settings, 'BUSQUEDA_MODO', 'indice')
+        if modo != 'fts':
+            # Sin uso, los triggers solo encarecen cada escritura de productos e historial
+            fts.desinstalar()
+            self.stdout.write(self.style.SUCCESS(
+                f"BUSQUEDA_MODO es '{modo}': se borraron las tablas FTS5 y sus triggers."
+            ))
+            return
+        if not fts.reconstruir():
+            raise CommandError(
+                "Esta base de datos no tiene FTS5; la búsqueda seguirá usando los filtros del ORM."
+            )
+        self.stdout.write(self.style.SUCCESS("Índices de búsqueda FTS5 reconstruidos."))
@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# SQL congelado tal como quedó al crear la búsqueda FTS5: los cambios
+# posteriores de administracion/fts.py van en migraciones nuevas (0018)
+SQL_TABLAS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS administracion_producto_fts
+        USING fts5(nombre, descripcion, categoria, tokenize="unicode61 remove_diacritics 2")""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS administracion_historial_fts
+        USING fts5(nombre_producto, detalle_cambio, tokenize="unicode61 remove_diacritics 2")""",
+]
+
+SQL_TRIGGERS = {
+    'administracion_producto_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ai
+        AFTER INSERT ON administracion_producto BEGIN
+            INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, coalesce(new.descripcion, ''),
+                    coalesce((SELECT nombre FROM administracion_categoria WHERE id = new.categoria_id), ''));
+        END""",
+    'administracion_producto_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ad
+        AFTER DELETE ON administracion_producto BEGIN
+            DELETE FROM administracion_producto_fts WHERE rowid = old.id;
+        END""",
+    'administracion_producto_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_au
+        AFTER UPDATE OF nombre, descripcion, categoria_id ON administracion_producto BEGIN
+            DELETE FROM administracion_producto_fts WHERE rowid = old.id;
+            INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, coalesce(new.descripcion, ''),
+                    coalesce((SELECT nombre FROM administracion_categoria WHERE id = new.categoria_id), ''));
+        END""",
+    'administracion_categoria_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_categoria_fts_au
+        AFTER UPDATE OF nombre ON administracion_categoria BEGIN
+            UPDATE administracion_producto_fts SET categoria = new.nombre
+            WHERE rowid IN (SELECT id FROM administracion_producto WHERE categoria_id = new.id);
+        END""",
+    'administracion_historial_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ai
+        AFTER INSERT ON administracion_historialproducto BEGIN
+            INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+            VALUES (new.id, new.nombre_producto, new.detalle_cambio);
+        END""",
+    'administracion_historial_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ad
+        AFTER DELETE ON administracion_historialproducto BEGIN
+            DELETE FROM administracion_historial_fts WHERE rowid = old.id;
+        END""",
+    'administracion_historial_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_au
+        AFTER UPDATE OF nombre_producto, detalle_cambio ON administracion_historialproducto BEGIN
+            DELETE FROM administracion_historial_fts WHERE rowid = old.id;
+            INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+            VALUES (new.id, new.nombre_producto, new.detalle_cambio);
+        END""",
+}
+
+SQL_LLENAR = [
+    """INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+        SELECT p.id, p.nombre, coalesce(p.descripcion, ''), coalesce(c.nombre, '')
+        FROM administracion_producto p LEFT JOIN administracion_categoria c ON c.id = p.categoria_id""",
+    """INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+        SELECT id, nombre_producto, detalle_cambio FROM administracion_historialproducto""",
+]
+
+
+def soporta_fts5(conexion):
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return 'ENABLE_FTS5' in {fila[0] for fila in cursor.fetchall()}
+
+
+def crear_tablas_fts(apps, schema_editor):
+    # Si la base no es SQLite o no tiene FTS5 no se crea nada: la búsqueda usa el ORM
+    conexion = schema_editor.connection
+    if not soporta_fts5(conexion):
+        return
+    with conexion.cursor() as cursor:
+        for sql in SQL_TABLAS + list(SQL_TRIGGERS.values()) + SQL_LLENAR:
+            cursor.execute(sql)
+
+
+def borrar_tablas_fts(apps, schema_editor):
+    conexion = schema_editor.connection
+    if conexion.vendor != 'sqlite':
+        return
+    with conexion.cursor() as cursor:
+        for nombre in SQL_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+        for tabla in ('administracion_producto_fts', 'administracion_historial_fts'):
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0013_alter_historialproducto_nombre_producto'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tablas_fts, borrar_tablas_fts),
+    ]
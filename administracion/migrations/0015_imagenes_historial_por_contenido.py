@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:48
+
+import administracion.almacen
+from django.db import migrations, models
+
+
+def migrar_imagenes(apps, schema_editor):
+    # Cada imagen distinta se guarda una vez por contenido y todas las filas
+    # que la usaban pasan a apuntar ahí. Las copias viejas quedan sin
+    # referencias y las borra `limpiar_historial_imagenes`.
+    HistorialProducto = apps.get_model('administracion', 'HistorialProducto')
+    almacen = administracion.almacen.almacen_historial()
+    nombres = list(
+        HistorialProducto.objects.exclude(imagen_producto__isnull=True).exclude(imagen_producto='')
+        .values_list('imagen_producto', flat=True).distinct()
+    )
+    for nombre in nombres:
+        if administracion.almacen.es_nombre_por_contenido(nombre):
+            continue
+        try:
+            with almacen.open(nombre, 'rb') as archivo:
+                nuevo = almacen.save(nombre, archivo)
+        except FileNotFoundError:
+            continue
+        HistorialProducto.objects.filter(imagen_producto=nombre).update(imagen_producto=nuevo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0014_busqueda_fts'),
+    ]
+
+    operations = [
+        # Solo cambia el storage: en SQLite un AlterField recrearía la tabla y
+        # borraría los triggers de la búsqueda FTS5 (0014)
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='historialproducto',
+                name='imagen_producto',
+                field=models.ImageField(blank=True, null=True, storage=administracion.almacen.almacen_historial, upload_to='historial/'),
+            ),
+        ]),
+        migrations.RunPython(migrar_imagenes, migrations.RunPython.noop),
+    ]
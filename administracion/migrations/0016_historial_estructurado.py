@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:56
+
+import django.core.serializers.json
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0015_imagenes_historial_por_contenido'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historialproducto',
+            name='cambios',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AlterField(
+            model_name='historialproducto',
+            name='detalle_cambio',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='historialproducto',
+            name='tipo_cambio',
+            field=models.CharField(choices=[('Creado', 'Creado'), ('Editado', 'Editado'), ('Eliminado', 'Eliminado'), ('Vendido', 'Vendido'), ('Devolución', 'Devolución')], max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='historialproducto',
+            index=models.Index(fields=['fecha_cambio', 'id'], name='historial_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='historialproducto',
+            index=models.Index(fields=['tipo_cambio', 'fecha_cambio'], name='historial_tipo_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='historialproducto',
+            index=models.Index(fields=['producto', 'fecha_cambio'], name='historial_producto_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='historialproducto',
+            index=models.Index(fields=['usuario', 'fecha_cambio'], name='historial_usuario_fecha'),
+        ),
+    ]
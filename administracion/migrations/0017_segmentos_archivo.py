@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0016_historial_estructurado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentoArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('historial', 'Historial de productos'), ('ventas', 'Ventas')], max_length=20)),
+                ('mes', models.DateField()),
+                ('archivo', models.CharField(max_length=255)),
+                ('filas', models.PositiveIntegerField(default=0)),
+                ('imagenes', models.JSONField(blank=True, default=list)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-mes'],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'mes'), name='segmento_archivo_tipo_mes')],
+            },
+        ),
+    ]
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.db import migrations
+
+# SQL congelado de administracion/fts.py tal como queda con el historial
+# estructurado (0016): el detalle indexado suma el cliente guardado en `cambios`
+SQL_TABLAS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS administracion_producto_fts
+        USING fts5(nombre, descripcion, categoria, tokenize="unicode61 remove_diacritics 2")""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS administracion_historial_fts
+        USING fts5(nombre_producto, detalle_cambio, tokenize="unicode61 remove_diacritics 2")""",
+]
+
+SQL_TRIGGERS = {
+    'administracion_producto_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ai
+        AFTER INSERT ON administracion_producto BEGIN
+            INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, coalesce(new.descripcion, ''),
+                    coalesce((SELECT nombre FROM administracion_categoria WHERE id = new.categoria_id), ''));
+        END""",
+    'administracion_producto_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_ad
+        AFTER DELETE ON administracion_producto BEGIN
+            DELETE FROM administracion_producto_fts WHERE rowid = old.id;
+        END""",
+    'administracion_producto_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_producto_fts_au
+        AFTER UPDATE OF nombre, descripcion, categoria_id ON administracion_producto BEGIN
+            DELETE FROM administracion_producto_fts WHERE rowid = old.id;
+            INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, coalesce(new.descripcion, ''),
+                    coalesce((SELECT nombre FROM administracion_categoria WHERE id = new.categoria_id), ''));
+        END""",
+    'administracion_categoria_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_categoria_fts_au
+        AFTER UPDATE OF nombre ON administracion_categoria BEGIN
+            UPDATE administracion_producto_fts SET categoria = new.nombre
+            WHERE rowid IN (SELECT id FROM administracion_producto WHERE categoria_id = new.id);
+        END""",
+    'administracion_historial_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ai
+        AFTER INSERT ON administracion_historialproducto BEGIN
+            INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+            VALUES (new.id, new.nombre_producto,
+                    new.detalle_cambio || ' ' || coalesce(json_extract(new.cambios, '$.cliente'), ''));
+        END""",
+    'administracion_historial_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_ad
+        AFTER DELETE ON administracion_historialproducto BEGIN
+            DELETE FROM administracion_historial_fts WHERE rowid = old.id;
+        END""",
+    'administracion_historial_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS administracion_historial_fts_au
+        AFTER UPDATE OF nombre_producto, detalle_cambio, cambios ON administracion_historialproducto BEGIN
+            DELETE FROM administracion_historial_fts WHERE rowid = old.id;
+            INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+            VALUES (new.id, new.nombre_producto,
+                    new.detalle_cambio || ' ' || coalesce(json_extract(new.cambios, '$.cliente'), ''));
+        END""",
+}
+
+SQL_LLENAR = [
+    """INSERT INTO administracion_producto_fts(rowid, nombre, descripcion, categoria)
+        SELECT p.id, p.nombre, coalesce(p.descripcion, ''), coalesce(c.nombre, '')
+        FROM administracion_producto p LEFT JOIN administracion_categoria c ON c.id = p.categoria_id""",
+    """INSERT INTO administracion_historial_fts(rowid, nombre_producto, detalle_cambio)
+        SELECT id, nombre_producto, detalle_cambio || ' ' || coalesce(json_extract(cambios, '$.cliente'), '')
+        FROM administracion_historialproducto""",
+]
+
+
+def soporta_fts5(conexion):
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return 'ENABLE_FTS5' in {fila[0] for fila in cursor.fetchall()}
+
+
+def borrar_tablas_fts(apps, schema_editor):
+    conexion = schema_editor.connection
+    if conexion.vendor != 'sqlite':
+        return
+    with conexion.cursor() as cursor:
+        for nombre in SQL_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+        for tabla in ('administracion_producto_fts', 'administracion_historial_fts'):
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+
+
+def reconstruir_tablas_fts(apps, schema_editor):
+    # Borra las tablas y triggers de 0014 y solo los vuelve a crear, con el
+    # SQL nuevo, si la búsqueda usa FTS5: con otro modo los triggers solo
+    # encarecen las escrituras. Si la base no tiene FTS5 no se crea nada
+    borrar_tablas_fts(apps, schema_editor)
+    conexion = schema_editor.connection
+    if getattr(settings, 'BUSQUEDA_MODO', 'indice') != 'fts' or not soporta_fts5(conexion):
+        return
+    with conexion.cursor() as cursor:
+        for sql in SQL_TABLAS + list(SQL_TRIGGERS.values()) + SQL_LLENAR:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0017_segmentos_archivo'),
+    ]
+
+    operations = [
+        # Al revertir quedan sin tablas FTS5 (la búsqueda usa el ORM) hasta
+        # correr reconstruir_busqueda
+        migrations.RunPython(reconstruir_tablas_fts, borrar_tablas_fts),
+    ]
@@ -2,8 +2,13 @@ from django.db import models
 from django.contrib.auth.models import User
 from PIL import Image
 from django.core.files.base import ContentFile
+from django.core.serializers.json import DjangoJSONEncoder
 from io import BytesIO
 
+from .almacen import almacen_historial
+from .detalles import detalle_html
+from .imagenes import generar_variantes, imagen_nueva
+
 class Categoria(models.Model):
     nombre = models.CharField(max_length=100)
     imagen = models.ImageField(upload_to='categorias/', blank=True, null=True)
@@ -12,13 +17,23 @@ class Categoria(models.Model):
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='marcas_creadas')
     actualizado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='marcas_actualizadas')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Nombre en la BD, para las sugerencias (core.sugerencias.vigilar)
+        instancia._nombre_guardado = instancia.__dict__.get('nombre')
+        return instancia
+
     def save(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         if not self.pk and user:
             self.creado_por = user
         if user:
             self.actualizado_por = user
+        nueva = imagen_nueva(self.imagen)
         super().save(*args, **kwargs)
+        if nueva:
+            generar_variantes(self.imagen)
     def __str__(self):
             return self.nombre
     
@@ -34,6 +49,26 @@ class Producto(models.Model):
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='productos_creados')
     actualizado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='productos_actualizados')
 
+    # Nombre de la imagen en la BD, para procesarla solo cuando cambie
+    _imagen_guardada = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._imagen_guardada = instancia.__dict__.get('imagen') or None
+        # Nombre en la BD, para las sugerencias (core.sugerencias.vigilar)
+        instancia._nombre_guardado = instancia.__dict__.get('nombre')
+        return instancia
+
+    def imagen_cambio(self, update_fields=None):
+        """
+        True si hay que procesar la imagen: se subió un archivo nuevo o se
+        cambió por otra. Guardar el stock, el precio, etc. no la toca.
+        """
+        if update_fields is not None and 'imagen' not in update_fields:
+            return False
+        return imagen_nueva(self.imagen) or (self.imagen.name or None) != self._imagen_guardada
+
     def save(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         if not self.pk and user:
@@ -41,14 +76,15 @@ class Producto(models.Model):
         if user:
             self.actualizado_por = user
 
-        # Si hay una imagen, la procesamos para reducir su tamaño
-        if self.imagen:
+        cambio = self.imagen_cambio(kwargs.get('update_fields'))
+        # Si se subió una imagen, la procesamos para reducir su tamaño
+        if cambio and imagen_nueva(self.imagen):
             try:
                 img = Image.open(self.imagen)
                 # Definimos el tamaño máximo (en píxeles)
                 max_size = (800, 800)
                 if img.height > max_size[1] or img.width > max_size[0]:
-                    img.thumbnail(max_size, Image.ANTIALIAS)
+                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
                     # Guardamos la imagen en un buffer en memoria
                     buffer = BytesIO()
                     # Determinar el formato: JPEG o PNG
@@ -61,6 +97,10 @@ class Producto(models.Model):
                 print(f"Error al procesar la imagen: {e}")
 
         super().save(*args, **kwargs)
+        self._imagen_guardada = self.imagen.name or None
+        # Variantes para srcset, solo cuando cambió la imagen
+        if cambio and self.imagen:
+            generar_variantes(self.imagen)
 
     def __str__(self):
         return self.nombre
@@ -70,8 +110,27 @@ class EmpresaNombre(models.Model):
     nit = models.IntegerField( null=True,blank=True,default='123456789')
     correo = models.EmailField(max_length=50,blank=True, null=True)
     logo = models.ImageField(upload_to='empresa/', blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        nuevo = imagen_nueva(self.logo)
+        super().save(*args, **kwargs)
+        if nuevo:
+            generar_variantes(self.logo)
     
 class HistorialProducto(models.Model):
+    CREADO = 'Creado'
+    EDITADO = 'Editado'
+    ELIMINADO = 'Eliminado'
+    VENDIDO = 'Vendido'
+    DEVOLUCION = 'Devolución'
+    TIPO_CHOICES = [
+        (CREADO, 'Creado'),
+        (EDITADO, 'Editado'),
+        (ELIMINADO, 'Eliminado'),
+        (VENDIDO, 'Vendido'),
+        (DEVOLUCION, 'Devolución'),
+    ]
+
     producto = models.ForeignKey(
         Producto, 
         on_delete=models.SET_NULL,
@@ -80,7 +139,62 @@ class HistorialProducto(models.Model):
     )
     nombre_producto = models.CharField(max_length=255)
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
-    tipo_cambio = models.CharField(max_length=50)
-    detalle_cambio = models.TextField()
+    tipo_cambio = models.CharField(max_length=50, choices=TIPO_CHOICES)
+    # HTML ya armado de los registros anteriores a `cambios`
+    detalle_cambio = models.TextField(blank=True)
+    # Datos del cambio (campos antes/después, venta, cantidad, precio); el
+    # HTML se arma al mostrarlo (ver detalles.py)
+    cambios = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
     fecha_cambio = models.DateTimeField(auto_now_add=True)
-    imagen_producto = models.ImageField(upload_to='historial/', null=True, blank=True)
\ No newline at end of file
+    # Por contenido: la misma imagen se guarda una vez para todos los eventos
+    imagen_producto = models.ImageField(upload_to='historial/', storage=almacen_historial, null=True, blank=True)
+
+    class Meta:
+        # El listado ordena por fecha y filtra por tipo, producto o usuario
+        # junto con un rango de fechas
+        indexes = [
+            models.Index(fields=['fecha_cambio', 'id'], name='historial_fecha'),
+            models.Index(fields=['tipo_cambio', 'fecha_cambio'], name='historial_tipo_fecha'),
+            models.Index(fields=['producto', 'fecha_cambio'], name='historial_producto_fecha'),
+            models.Index(fields=['usuario', 'fecha_cambio'], name='historial_usuario_fecha'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Nombre en la BD, para las sugerencias (core.sugerencias.vigilar)
+        instancia._nombre_producto_guardado = instancia.__dict__.get('nombre_producto')
+        return instancia
+
+    def detalle(self):
+        """HTML del detalle del cambio."""
+        return detalle_html(self)
+
+
+
+class SegmentoArchivo(models.Model):
+    """Índice de los segmentos mensuales archivados (ver archivo.py)."""
+    HISTORIAL = 'historial'
+    VENTAS = 'ventas'
+    TIPO_CHOICES = [
+        (HISTORIAL, 'Historial de productos'),
+        (VENTAS, 'Ventas'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    # Primer día del mes archivado
+    mes = models.DateField()
+    archivo = models.CharField(max_length=255)
+    filas = models.PositiveIntegerField(default=0)
+    # Imágenes del historial que usan las filas archivadas
+    imagenes = models.JSONField(default=list, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-mes']
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'mes'], name='segmento_archivo_tipo_mes'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.mes:%Y-%m}"
@@ -1,26 +1,56 @@
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
-from django.core.files.base import ContentFile
-from .models import Producto, HistorialProducto
+from django.db.models import Count
+from core import sugerencias
+from .models import Producto, Categoria, EmpresaNombre, HistorialProducto
+from . import auditoria
+from .empresa import invalidar_empresa
+from .busqueda import indice_productos
 
 @receiver(pre_delete, sender=Producto)
 def registrar_historial_producto(sender, instance, **kwargs):
     nombre_producto = instance.nombre or "Sin nombre"
-    imagen_producto = None
-    if instance.imagen:
-        try:
-            instance.imagen.open('rb')
-            imagen_producto = ContentFile(instance.imagen.read(), name=instance.imagen.name)
-            instance.imagen.close()
-        except Exception as e:
-            print(f"Error al leer la imagen: {e}")
-            
-    
-    HistorialProducto.objects.create(
-        producto=None,  
-        nombre_producto=nombre_producto,
-        usuario=instance.actualizado_por,  
-        tipo_cambio="Eliminado",
-        detalle_cambio=f"Producto <strong>'{nombre_producto}'</strong> eliminado del sistema.",
-        imagen_producto=imagen_producto
-    )
\ No newline at end of file
+    # Al borrar varios productos los eventos se guardan juntos al confirmar
+    auditoria.registrar(
+        None, instance.actualizado_por, HistorialProducto.ELIMINADO,
+        {'cantidad': -instance.cantidad}, nombre_producto=nombre_producto, imagen=instance.imagen,
+    )
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, **kwargs):
+    """Mantiene al día el índice de búsqueda en memoria."""
+    indice_productos.actualizar_producto(instance)
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    indice_productos.eliminar_producto(instance.pk)
+
+
+@receiver(post_save, sender=Categoria)
+def indexar_categoria(sender, instance, created, **kwargs):
+    if not created:
+        indice_productos.actualizar_categoria(instance)
+
+
+
+@receiver(post_save, sender=EmpresaNombre)
+@receiver(post_delete, sender=EmpresaNombre)
+def limpiar_cache_empresa(sender, **kwargs):
+    invalidar_empresa()
+
+
+# Vocabularios para las sugerencias "¿Quizás quisiste decir?"
+sugerencias.registrar(
+    'productos', lambda: Producto.objects.order_by().values_list('nombre').annotate(Count('pk'))
+)
+sugerencias.registrar(
+    'categorias', lambda: Categoria.objects.order_by().values_list('nombre').annotate(Count('pk'))
+)
+sugerencias.registrar(
+    'historial', lambda: HistorialProducto.objects.order_by().values_list('nombre_producto').annotate(Count('pk'))
+)
+sugerencias.vigilar(Producto, 'nombre', 'productos')
+sugerencias.vigilar(Categoria, 'nombre', 'categorias')
+sugerencias.vigilar(HistorialProducto, 'nombre_producto', 'historial')
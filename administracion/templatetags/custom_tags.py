@@ -1,11 +1,43 @@
 from django import template
-from django.contrib.auth.models import Group
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from administracion import imagenes
+from core.grupos import pertenece_a_grupo
 
 register = template.Library()
 
 @register.filter(name='has_group')
 def has_group(user, group_name):
+    # Los grupos del usuario se consultan una sola vez por petición (ver core.grupos)
     if user is None:
         return False
-    group = Group.objects.get(name=group_name)
-    return group in user.groups.all()
\ No newline at end of file
+    return pertenece_a_grupo(user, group_name)
+
+
+@register.filter(name='srcset')
+def srcset(campo, extension='jpg'):
+    """`{{ producto.imagen|srcset:"webp" }}`: variantes para el atributo srcset."""
+    return imagenes.srcset(campo, extension)
+
+
+@register.simple_tag
+def imagen_responsive(campo, sizes='100vw', **atributos):
+    """
+    `<picture>` con las variantes WebP y JPEG de `campo` (ver
+    administracion.imagenes) para que el navegador elija el tamaño según
+    `sizes`. Sin variantes, un `<img>` con el original. Los demás
+    argumentos (alt, class, style...) pasan al `<img>`.
+    """
+    if not campo:
+        return ''
+    atributos.setdefault('loading', 'lazy')
+    if not imagenes.tiene_variantes(campo):
+        return format_html('<img src="{}"{}>', campo.url, flatatt(atributos))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        imagenes.srcset(campo, 'webp'), sizes,
+        campo.storage.url(imagenes.nombre_variante(campo.name, imagenes.tamanos()[-1], 'jpg')),
+        imagenes.srcset(campo, 'jpg'), sizes, flatatt(atributos),
+    )
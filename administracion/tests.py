@@ -1,3 +1,602 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import localdate
+from PIL import Image
+
+from . import auditoria, fts
+from .almacen import (
+    AlmacenContenido, almacen_historial, archivos_historial, es_nombre_por_contenido, imagen_para_historial,
+    variantes,
+)
+from .busqueda import IndiceTrigramas, buscar_productos, filtrar_historial, indice_productos
+from .empresa import invalidar_empresa, obtener_empresa
+from .imagenes import nombre_variante, tiene_variantes
+from .archivo import leer_segmento
+from .models import Categoria, EmpresaNombre, HistorialProducto, Producto, SegmentoArchivo
+
+
+class IndiceTrigramasTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True)
+        self.bebidas = Categoria.objects.create(nombre="Bebidas")
+        self.aseo = Categoria.objects.create(nombre="Aseo")
+        self.cafe = Producto.objects.create(
+            nombre="Café molido", descripcion="Tostado oscuro", precio=12000, cantidad=5, categoria=self.bebidas,
+            actualizado_por=self.usuario,
+        )
+        self.jabon = Producto.objects.create(
+            nombre="Jabón", descripcion="Con aroma a café", precio=3500, cantidad=5, categoria=self.aseo
+        )
+        indice_productos.construir()
+
+    def test_busca_sin_tildes_y_ordena_por_relevancia(self):
+        self.assertEqual(indice_productos.buscar("cafe"), [self.cafe.pk, self.jabon.pk])
+        self.assertEqual(indice_productos.buscar("BEBIDA"), [self.cafe.pk])
+        self.assertEqual(indice_productos.buscar("xyz"), [])
+
+    def test_se_mantiene_al_dia_con_las_senales(self):
+        self.jabon.nombre = "Detergente"
+        self.jabon.save()
+        self.assertEqual(indice_productos.buscar("deterg"), [self.jabon.pk])
+        self.assertEqual(indice_productos.buscar("jabon"), [])
+
+        self.aseo.nombre = "Limpieza"
+        self.aseo.save()
+        self.assertEqual(indice_productos.buscar("limpieza"), [self.jabon.pk])
+
+        self.cafe.delete()
+        self.assertEqual(indice_productos.buscar("molido"), [])
+
+    def test_vista_pagina_los_resultados_del_indice(self):
+        self.client.force_login(self.usuario)
+
+        respuesta = self.client.get(reverse('lista_productos'), {'q': 'café'})
+
+        self.assertEqual(list(respuesta.context['productos']), [self.cafe, self.jabon])
+
+    def test_benchmark_indice_contra_orm(self):
+        """El índice devuelve lo mismo que los icontains y en menos tiempo."""
+        Producto.objects.bulk_create([
+            Producto(
+                nombre=f"Producto {i} {'lapiz' if i % 7 == 0 else 'borrador'}",
+                descripcion=f"Referencia {i * 13}",
+                precio=100 + i,
+                cantidad=1,
+                categoria=self.bebidas if i % 2 else self.aseo,
+            )
+            for i in range(5000)
+        ])
+        indice = IndiceTrigramas()
+        indice.construir()
+        consultas = ["lapiz", "borrador", "referencia 13", "aseo", "producto 42"]
+
+        inicio = time.perf_counter()
+        esperados = {
+            consulta: set(Producto.objects.filter(
+                Q(nombre__icontains=consulta) |
+                Q(descripcion__icontains=consulta) |
+                Q(categoria__nombre__icontains=consulta)
+            ).values_list('pk', flat=True))
+            for consulta in consultas
+        }
+        tiempo_orm = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        obtenidos = {consulta: set(indice.buscar(consulta)) for consulta in consultas}
+        tiempo_indice = time.perf_counter() - inicio
+
+        self.assertEqual(obtenidos, esperados)
+        self.assertLess(tiempo_indice, tiempo_orm)
+
+
+@override_settings(BUSQUEDA_MODO='fts')
+class BusquedaFTSTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True)
+        self.bebidas = Categoria.objects.create(nombre="Bebidas")
+        self.cafe = Producto.objects.create(
+            nombre="Café molido", descripcion="Tostado", precio=12000, cantidad=5, categoria=self.bebidas
+        )
+        self.torta = Producto.objects.create(
+            nombre="Torta", descripcion="Sabor a café", precio=9000, cantidad=5, categoria=self.bebidas
+        )
+        call_command('reconstruir_busqueda', stdout=StringIO())
+        self.addCleanup(fts.desinstalar)
+
+    def test_fts_disponible_tras_reconstruir(self):
+        self.assertTrue(fts.disponible())
+
+    def test_otro_modo_borra_tablas_y_triggers(self):
+        with override_settings(BUSQUEDA_MODO='indice'):
+            call_command('reconstruir_busqueda', stdout=StringIO())
+        self.assertFalse(fts.disponible())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", ['%_fts_%'])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_prefijo_sin_tildes_ordenado_por_bm25(self):
+        self.assertEqual(buscar_productos("caf"), [self.cafe.pk, self.torta.pk])
+        self.assertEqual(buscar_productos("molido tost"), [self.cafe.pk])
+
+    def test_triggers_siguen_cambios_de_producto_y_categoria(self):
+        Producto.objects.filter(pk=self.torta.pk).update(nombre="Ponqué")
+        self.assertEqual(buscar_productos("ponque"), [self.torta.pk])
+
+        self.bebidas.nombre = "Panadería"
+        self.bebidas.save()
+        self.assertEqual(sorted(buscar_productos("panaderia")), sorted([self.cafe.pk, self.torta.pk]))
+
+    def test_historial_incluye_bulk_create(self):
+        HistorialProducto.objects.bulk_create([
+            HistorialProducto(nombre_producto="Café molido", usuario=self.usuario,
+                              tipo_cambio="Vendido", detalle_cambio="Vendido a: <strong>Ana</strong>"),
+            HistorialProducto(nombre_producto="Torta", usuario=self.usuario,
+                              tipo_cambio="Vendido", detalle_cambio="Vendido a: <strong>Luis</strong>"),
+        ])
+        resultado = filtrar_historial(HistorialProducto.objects.all(), "ana")
+        self.assertEqual([h.nombre_producto for h in resultado], ["Café molido"])
+
+    def test_respaldo_orm_sin_fts5(self):
+        with mock.patch('administracion.busqueda.fts.disponible', return_value=False):
+            self.assertEqual(buscar_productos("café"), [self.torta.pk, self.cafe.pk])
+
+    def test_comando_reconstruir(self):
+        call_command('reconstruir_busqueda', stdout=StringIO())
+        self.assertEqual(buscar_productos("torta"), [self.torta.pk])
+
+    def test_ultima_migracion_congela_el_sql_vigente(self):
+        # Si cambia el SQL de fts.py hace falta una migración nueva con el SQL congelado
+        migracion = import_module('administracion.migrations.0018_busqueda_fts_cambios')
+        normalizar = lambda sql: ' '.join(sql.split())
+        self.assertEqual(
+            {nombre: normalizar(sql) for nombre, sql in migracion.SQL_TRIGGERS.items()},
+            {nombre: normalizar(sql) for nombre, sql in fts.SQL_TRIGGERS.items()},
+        )
+        self.assertEqual([normalizar(sql) for sql in migracion.SQL_TABLAS], [normalizar(sql) for sql in fts.SQL_TABLAS])
+        self.assertEqual([normalizar(sql) for sql in migracion.SQL_LLENAR], [normalizar(sql) for sql in fts.SQL_LLENAR])
+
+
+class EmpresaCacheTests(TestCase):
+    def setUp(self):
+        invalidar_empresa()
+        self.empresa = EmpresaNombre.objects.create(nombre="Tienda", nit=123)
+
+    def test_una_sola_consulta_hasta_que_cambia(self):
+        with self.assertNumQueries(1):
+            obtener_empresa()
+            self.assertEqual(obtener_empresa().nombre, "Tienda")
+
+        self.empresa.nombre = "Tienda Nueva"
+        self.empresa.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(obtener_empresa().nombre, "Tienda Nueva")
+
+        self.empresa.delete()
+        self.assertIsNone(obtener_empresa())
+
+    def test_context_processor_es_perezoso(self):
+        from core.context_processors import empresa
+        contexto = empresa(RequestFactory().get('/'))
+
+        with self.assertNumQueries(0):
+            Template("Hola").render(Context(contexto))
+        with self.assertNumQueries(1):
+            self.assertEqual(Template("{{ empresa.nombre }}").render(Context(contexto)), "Tienda")
+
+
+
+class VariantesImagenTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.categoria = Categoria.objects.create(nombre="General")
+
+    def imagen(self, nombre, tamano=(1200, 900), formato='PNG', modo='RGBA'):
+        buffer = BytesIO()
+        Image.new(modo, tamano, (200, 30, 30, 128) if modo == 'RGBA' else (200, 30, 30)).save(buffer, format=formato)
+        return SimpleUploadedFile(nombre, buffer.getvalue())
+
+    def abrir(self, nombre):
+        with Image.open(os.path.join(self.media, nombre)) as imagen:
+            return imagen.format, imagen.size
+
+    def test_reduce_con_lanczos_y_genera_variantes(self):
+        producto = Producto.objects.create(
+            nombre="Café", precio=1000, cantidad=1, categoria=self.categoria, imagen=self.imagen("cafe.png")
+        )
+        # El original queda en 800 px (antes fallaba con Image.ANTIALIAS)
+        self.assertEqual(self.abrir(producto.imagen.name), ('PNG', (800, 600)))
+        for tamano in (96, 320, 800):
+            self.assertEqual(self.abrir(nombre_variante(producto.imagen.name, tamano, 'webp')),
+                             ('WEBP', (tamano, tamano * 3 // 4)))
+            self.assertEqual(self.abrir(nombre_variante(producto.imagen.name, tamano, 'jpg'))[0], 'JPEG')
+
+    def test_plantilla_emite_srcset(self):
+        categoria = Categoria.objects.create(nombre="Marca", imagen=self.imagen("marca.jpg", (500, 500), 'JPEG', 'RGB'))
+        self.assertTrue(os.path.exists(os.path.join(self.media, nombre_variante(categoria.imagen.name, 96, 'webp'))))
+        html = Template(
+            '{% load custom_tags %}{% imagen_responsive marca.imagen sizes="40px" alt=marca.nombre class="x" %}'
+        ).render(Context({'marca': categoria}))
+        self.assertIn('<source type="image/webp" srcset="/media/categorias/marca_96w.webp 96w, '
+                      '/media/categorias/marca_320w.webp 320w, /media/categorias/marca_800w.webp 800w" sizes="40px">', html)
+        self.assertIn('alt="Marca" class="x" loading="lazy"', html)
+        self.assertIn('/media/categorias/marca_96w.jpg 96w', html)
+
+        # Sin variantes (imagen anterior al cambio) se muestra el original
+        otra = Categoria(nombre="Vieja", imagen="categorias/vieja.jpg")
+        html = Template('{% load custom_tags %}{% imagen_responsive m.imagen %}').render(Context({'m': otra}))
+        self.assertEqual(html, '<img src="/media/categorias/vieja.jpg" loading="lazy">')
+
+    def test_logo_y_comando_de_relleno(self):
+        empresa = EmpresaNombre.objects.create(nombre="Tienda", logo=self.imagen("logo.png", (300, 100)))
+        self.assertTrue(tiene_variantes(EmpresaNombre.objects.get(pk=empresa.pk).logo))
+
+        # Imagen subida antes de que existieran las variantes
+        ruta = os.path.join(self.media, 'productos')
+        os.makedirs(ruta, exist_ok=True)
+        Image.new('RGB', (400, 400)).save(os.path.join(ruta, 'viejo.jpg'))
+        producto = Producto.objects.create(nombre="Viejo", precio=1, cantidad=1, categoria=self.categoria)
+        Producto.objects.filter(pk=producto.pk).update(imagen='productos/viejo.jpg')
+
+        salida = StringIO()
+        call_command('generar_variantes', stdout=salida)
+        self.assertIn("Variantes generadas para 1 imagen(es).", salida.getvalue())
+        self.assertTrue(tiene_variantes(Producto.objects.get(pk=producto.pk).imagen))
+
+
+class ImagenesHistorialTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.categoria = Categoria.objects.create(nombre="General")
+        self.usuario = User.objects.create_user(username="admin", password="x")
+
+    def imagen(self, nombre, color=(200, 30, 30)):
+        buffer = BytesIO()
+        Image.new('RGB', (200, 200), color).save(buffer, format='PNG')
+        return SimpleUploadedFile(nombre, buffer.getvalue())
+
+    def archivos(self):
+        """Originales guardados en historial/ (sin contar las variantes)."""
+        return sorted(nombre for nombre in archivos_historial() if not nombre.endswith(('w.webp', 'w.jpg')))
+
+    def test_eventos_comparten_un_archivo(self):
+        producto = Producto.objects.create(
+            nombre="Café", precio=1000, cantidad=1, categoria=self.categoria, imagen=self.imagen("cafe.png"),
+            actualizado_por=self.usuario,
+        )
+        nombres = {imagen_para_historial(producto.imagen) for _ in range(5)}
+        self.assertEqual(len(nombres), 1)
+        nombre = nombres.pop()
+        self.assertTrue(es_nombre_por_contenido(nombre))
+        self.assertEqual(self.archivos(), [nombre])
+        # Las variantes del producto se copian sin volver a procesar la imagen
+        self.assertTrue(tiene_variantes(HistorialProducto(imagen_producto=nombre).imagen_producto))
+
+        # Eliminar el producto registra el evento sin otra copia
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.delete()
+        eliminado = HistorialProducto.objects.get(tipo_cambio="Eliminado")
+        self.assertEqual(eliminado.imagen_producto.name, nombre)
+        self.assertEqual(self.archivos(), [nombre])
+
+    def test_guardado_concurrente_devuelve_el_existente(self):
+        almacen = almacen_historial()
+        primero = almacen.save('historial/a.png', self.imagen("a.png"))
+        # Sin la comprobación previa, como si otro proceso lo hubiera escrito
+        # entre exists() y la escritura
+        with mock.patch.object(AlmacenContenido, 'exists', return_value=False):
+            segundo = almacen.save('historial/a.png', self.imagen("a.png"))
+            variante = almacen.save(variantes(primero)[0], SimpleUploadedFile("v.webp", b"variante"))
+            self.assertEqual(almacen.save(variante, SimpleUploadedFile("v.webp", b"variante")), variante)
+        self.assertEqual(segundo, primero)
+        self.assertEqual(self.archivos(), [primero])
+
+    def test_migracion_unifica_copias(self):
+        os.makedirs(os.path.join(self.media, 'historial'))
+        for nombre in ('cafe.png', 'cafe_Ab12.png'):
+            Image.new('RGB', (50, 50), (1, 2, 3)).save(os.path.join(self.media, 'historial', nombre))
+        HistorialProducto.objects.create(nombre_producto="Café", usuario=self.usuario, tipo_cambio="Vendido", imagen_producto='historial/cafe.png')
+        HistorialProducto.objects.create(nombre_producto="Café", usuario=self.usuario, tipo_cambio="Eliminado", imagen_producto='historial/cafe_Ab12.png')
+        HistorialProducto.objects.create(nombre_producto="Té", usuario=self.usuario, tipo_cambio="Vendido", imagen_producto='historial/perdida.png')
+
+        migracion = import_module('administracion.migrations.0015_imagenes_historial_por_contenido')
+        migracion.migrar_imagenes(django_apps, None)
+
+        nombres = set(HistorialProducto.objects.filter(nombre_producto="Café").values_list('imagen_producto', flat=True))
+        self.assertEqual(len(nombres), 1)
+        self.assertTrue(es_nombre_por_contenido(nombres.pop()))
+        # La que no existe en disco se deja como estaba
+        self.assertTrue(HistorialProducto.objects.filter(imagen_producto='historial/perdida.png').exists())
+
+    def test_limpieza_borra_solo_las_sin_referencias(self):
+        usada = imagen_para_historial(
+            Producto.objects.create(nombre="A", precio=1, cantidad=1, categoria=self.categoria, imagen=self.imagen("a.png")).imagen
+        )
+        HistorialProducto.objects.create(nombre_producto="A", usuario=self.usuario, tipo_cambio="Vendido", imagen_producto=usada)
+        huerfana = almacen_historial().save('historial/b.png', self.imagen("b.png", (0, 0, 255)))
+        vieja = time.time() - 7200
+        os.utime(os.path.join(self.media, huerfana), (vieja, vieja))
+        reciente = almacen_historial().save('historial/c.png', self.imagen("c.png", (0, 255, 0)))
+
+        salida = StringIO()
+        call_command('limpiar_historial_imagenes', stdout=salida)
+        self.assertIn("1 imagen(es) borradas.", salida.getvalue())
+        self.assertEqual(self.archivos(), sorted([usada, reciente]))
+        self.assertTrue(tiene_variantes(HistorialProducto.objects.get().imagen_producto))
+
+        call_command('limpiar_historial_imagenes', gracia=0, stdout=StringIO())
+        self.assertEqual(self.archivos(), [usada])
+
+
+class AuditoriaTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user(username="admin", password="x", is_staff=True)
+        self.categoria = Categoria.objects.create(nombre="General")
+        self.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=100, cantidad=5, categoria=self.categoria)
+            for i in range(3)
+        ]
+
+    def inserts(self, ctx):
+        return [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "administracion_historialproducto"')]
+
+    def test_un_insert_al_confirmar(self):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for producto in self.productos:
+                    auditoria.registrar(producto, self.usuario, "Vendido", {'venta': 1, 'cliente': "Ana", 'cantidad': -1, 'precio': 100})
+                auditoria.registrar(self.productos[0], self.usuario, "Editado", {'campos': []})
+                self.assertFalse(HistorialProducto.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(self.inserts(ctx)), 1)
+        self.assertEqual(HistorialProducto.objects.count(), 4)
+
+    def test_savepoint_deshecho_descarta_sus_eventos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                auditoria.registrar(self.productos[0], self.usuario, "Creado", {'nota': "Creado"})
+                try:
+                    with transaction.atomic():
+                        auditoria.registrar(self.productos[1], self.usuario, "Editado", {'nota': "Perdido"})
+                        raise ValueError
+                except ValueError:
+                    pass
+                auditoria.registrar(self.productos[2], self.usuario, "Editado", {'nota': "Guardado"})
+        self.assertEqual(
+            sorted(evento.cambios['nota'] for evento in HistorialProducto.objects.all()), ["Creado", "Guardado"]
+        )
+
+    def test_segundo_plano_usa_el_pool(self):
+        with override_settings(HISTORIAL_HILOS=1), mock.patch('administracion.auditoria.executor') as pool:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    auditoria.registrar(self.productos[0], self.usuario, "Vendido", {'cantidad': -1}, segundo_plano=True)
+                    auditoria.registrar(self.productos[0], self.usuario, "Editado", {'campos': []})
+        self.assertEqual(list(HistorialProducto.objects.values_list('tipo_cambio', flat=True)), ["Editado"])
+        funcion, eventos = pool.return_value.submit.call_args.args
+        self.assertEqual(funcion, auditoria.guardar_en_hilo)
+        auditoria.guardar(eventos)
+        self.assertEqual(HistorialProducto.objects.filter(tipo_cambio="Vendido").count(), 1)
+
+    def test_editar_producto_registra_al_confirmar(self):
+        self.client.force_login(self.usuario)
+        producto = self.productos[0]
+        datos = {'nombre': producto.nombre, 'precio': 100, 'cantidad': 8, 'categoria': self.categoria.pk}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('editar_producto', args=[producto.pk]), datos)
+        evento = HistorialProducto.objects.get(tipo_cambio="Editado")
+        self.assertEqual(evento.producto, producto)
+        self.assertEqual(evento.cambios, {'campos': [{'campo': 'cantidad', 'antes': 5, 'despues': 8}], 'cantidad': 3})
+        self.assertEqual(evento.detalle_cambio, "")
+        self.assertIn("Cantidad aumentó en 3 (de 5 a 8)", evento.detalle())
+
+
+class HistorialEstructuradoTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username="admin", password="x", is_staff=True)
+        self.cajero = User.objects.create_user(username="cajero", password="x")
+        self.categoria = Categoria.objects.create(nombre="General")
+        self.producto = Producto.objects.create(nombre="Café", precio=1500, cantidad=5, categoria=self.categoria)
+        self.client.force_login(self.admin)
+
+    def evento(self, usuario, tipo, cambios, fecha=None):
+        evento = HistorialProducto.objects.create(
+            producto=self.producto, nombre_producto="Café", usuario=usuario, tipo_cambio=tipo, cambios=cambios
+        )
+        if fecha:
+            HistorialProducto.objects.filter(pk=evento.pk).update(fecha_cambio=fecha)
+        return evento
+
+    def test_detalle_se_arma_al_mostrar_y_escapa(self):
+        venta = self.evento(self.cajero, "Vendido", {'venta': 7, 'cliente': "<b>Ana</b>", 'cantidad': -2, 'precio': Decimal('1500.00')})
+        venta.refresh_from_db()
+        self.assertEqual(venta.cambios['precio'], "1500.00")
+        self.assertIn("Vendido a: <strong>&lt;b&gt;Ana&lt;/b&gt;</strong>", venta.detalle())
+        self.assertIn("Total: <strong>$3000.00</strong>", venta.detalle())
+
+        # Los registros anteriores se muestran con su HTML guardado
+        antiguo = HistorialProducto(tipo_cambio="Vendido", detalle_cambio="Vendido a: <strong>Luis</strong>")
+        self.assertEqual(antiguo.detalle(), "Vendido a: <strong>Luis</strong>")
+
+    @override_settings(BUSQUEDA_MODO='fts')
+    def test_busqueda_encuentra_el_cliente(self):
+        if not fts.reconstruir():
+            self.skipTest("SQLite sin FTS5")
+        self.addCleanup(fts.desinstalar)
+        evento = self.evento(self.cajero, "Vendido", {'venta': 7, 'cliente': "Peña", 'cantidad': -1, 'precio': 1500})
+        self.assertEqual(list(filtrar_historial(HistorialProducto.objects.all(), "pena")), [evento])
+
+    def test_filtros_por_tipo_usuario_y_fecha(self):
+        hoy = localdate()
+        ayer = timezone.now() - timedelta(days=1)
+        venta = self.evento(self.cajero, "Vendido", {'venta': 1, 'cliente': "Ana", 'cantidad': -1, 'precio': 1500})
+        self.evento(self.admin, "Editado", {'campos': []})
+        self.evento(self.cajero, "Devolución", {'venta': 1, 'cliente': "Ana", 'cantidad': 1, 'precio': 1500}, fecha=ayer)
+
+        url = reverse('historial_productos')
+        resp = self.client.get(url, {'tipo': "Vendido"})
+        self.assertEqual(list(resp.context['historial']), [venta])
+        resp = self.client.get(url, {'usuario': self.cajero.pk, 'fecha_inicio': hoy.isoformat(), 'fecha_fin': hoy.isoformat()})
+        self.assertEqual(list(resp.context['historial']), [venta])
+        resp = self.client.get(url, {'usuario': self.cajero.pk})
+        self.assertEqual(len(resp.context['historial']), 2)
+        self.assertEqual([u.username for u in resp.context['usuarios']], ["admin", "cajero"])
+        self.assertContains(resp, "Cliente: <strong>Ana</strong>")
+
+    def test_fecha_inexistente_se_ignora(self):
+        venta = self.evento(self.cajero, "Vendido", {'venta': 1, 'cliente': "Ana", 'cantidad': -1, 'precio': 1500})
+        resp = self.client.get(reverse('historial_productos'), {'fecha_inicio': "2025-02-30"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(resp.context['historial']), [venta])
+
+    def test_filtro_usa_indice(self):
+        for campo, valor in (('tipo_cambio', "Vendido"), ('usuario_id', self.cajero.pk)):
+            plan = (
+                HistorialProducto.objects.filter(**{campo: valor}, fecha_cambio__gte=timezone.now())
+                .order_by('-fecha_cambio').explain()
+            )
+            self.assertIn(f"historial_{campo.split('_')[0]}_fecha", plan)
+
+
+class ArchivoHistorialTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user(username="admin", password="x", is_staff=True)
+        self.categoria = Categoria.objects.create(nombre="General")
+        self.producto = Producto.objects.create(nombre="Café", precio=1500, cantidad=5, categoria=self.categoria)
+        self.viejo = timezone.now() - timedelta(days=500)
+        self.mes = localdate(self.viejo).replace(day=1)
+
+    def evento(self, tipo="Vendido", fecha=None, **kwargs):
+        evento = HistorialProducto.objects.create(
+            producto=self.producto, nombre_producto="Café", usuario=self.usuario, tipo_cambio=tipo,
+            cambios={'venta': 1, 'cliente': "Ana", 'cantidad': -1, 'precio': 1500}, **kwargs
+        )
+        if fecha:
+            HistorialProducto.objects.filter(pk=evento.pk).update(fecha_cambio=fecha)
+        return evento
+
+    def test_archiva_meses_viejos_y_los_lee_el_listado(self):
+        viejos = [self.evento(fecha=self.viejo + timedelta(minutes=i)) for i in range(3)]
+        self.evento("Editado", fecha=self.viejo)
+        reciente = self.evento()
+
+        salida = StringIO()
+        call_command('archivar', meses=12, stdout=salida)
+        self.assertIn(f"Historial {self.mes:%Y-%m}: 4 registro(s) archivado(s).", salida.getvalue())
+        self.assertEqual(list(HistorialProducto.objects.all()), [reciente])
+        segmento = SegmentoArchivo.objects.get()
+        self.assertEqual((segmento.mes, segmento.filas), (self.mes, 4))
+        self.assertTrue(os.path.exists(os.path.join(self.media, segmento.archivo)))
+
+        self.client.force_login(self.usuario)
+        url = reverse('historial_productos')
+        resp = self.client.get(url, {'mes': f"{self.mes:%Y-%m}", 'tipo': "Vendido"})
+        self.assertEqual([e.pk for e in resp.context['historial']], [e.pk for e in reversed(viejos)])
+        self.assertContains(resp, "Vendido a: <strong>Ana</strong>")
+        self.assertContains(resp, "(archivado)")
+        # Sin filtros el total sale del índice
+        resp = self.client.get(url, {'mes': f"{self.mes:%Y-%m}"})
+        self.assertEqual(resp.context['paginator'].count, 4)
+        self.assertEqual(list(self.client.get(url).context['historial']), [reciente])
+
+    def test_volver_a_archivar_une_el_mes(self):
+        self.evento(fecha=self.viejo)
+        call_command('archivar', meses=12, stdout=StringIO())
+        self.evento("Editado", fecha=self.viejo + timedelta(hours=1))
+        # El archivo anterior se borra al confirmar
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archivar', meses=12, stdout=StringIO())
+
+        segmento = SegmentoArchivo.objects.get()
+        self.assertEqual(segmento.filas, 2)
+        self.assertEqual([fila['tipo_cambio'] for fila in leer_segmento(segmento.archivo)], ["Editado", "Vendido"])
+        self.assertEqual(self.segmentos(), [segmento.archivo])
+
+    def segmentos(self):
+        directorio = os.path.join(self.media, 'archivo', 'historial')
+        return sorted(f"archivo/historial/{nombre}" for nombre in os.listdir(directorio))
+
+    def test_fallo_al_borrar_conserva_el_segmento_anterior(self):
+        self.evento(fecha=self.viejo)
+        call_command('archivar', meses=12, stdout=StringIO())
+        anterior = SegmentoArchivo.objects.get().archivo
+        nuevo = self.evento("Editado", fecha=self.viejo + timedelta(hours=1))
+
+        with mock.patch('django.db.models.query.QuerySet.delete', side_effect=RuntimeError("caída")):
+            with self.assertRaises(RuntimeError):
+                call_command('archivar', meses=12, stdout=StringIO())
+        # Ni el índice ni el archivo viejo cambiaron, y el nuevo se borró
+        segmento = SegmentoArchivo.objects.get()
+        self.assertEqual((segmento.archivo, segmento.filas), (anterior, 1))
+        self.assertEqual(self.segmentos(), [anterior])
+        self.assertEqual(list(HistorialProducto.objects.all()), [nuevo])
+
+        call_command('archivar', meses=12, stdout=StringIO())
+        segmento = SegmentoArchivo.objects.get()
+        self.assertEqual([fila['tipo_cambio'] for fila in leer_segmento(segmento.archivo)], ["Editado", "Vendido"])
+
+    def test_fila_en_tabla_y_segmento_no_se_duplica(self):
+        evento = self.evento(fecha=self.viejo)
+        call_command('archivar', meses=12, stdout=StringIO())
+        # Como si el proceso hubiera caído tras escribir el archivo sin borrar la fila
+        evento.save(force_insert=True)
+        HistorialProducto.objects.filter(pk=evento.pk).update(fecha_cambio=self.viejo)
+
+        call_command('archivar', meses=12, stdout=StringIO())
+        segmento = SegmentoArchivo.objects.get()
+        self.assertEqual(segmento.filas, 1)
+        self.assertEqual([fila['id'] for fila in leer_segmento(segmento.archivo)], [evento.pk])
+
+    def test_imagenes_archivadas_no_se_limpian(self):
+        imagen = almacen_historial().save('historial/a.png', SimpleUploadedFile("a.png", b"contenido"))
+        vieja = time.time() - 7200
+        os.utime(os.path.join(self.media, imagen), (vieja, vieja))
+        self.evento(fecha=self.viejo, imagen_producto=imagen)
+        call_command('archivar', meses=12, stdout=StringIO())
+
+        self.assertEqual(SegmentoArchivo.objects.get().imagenes, [imagen])
+        call_command('limpiar_historial_imagenes', stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.media, imagen)))
+
+    def test_lista_productos_no_carga_el_historial(self):
+        self.client.force_login(self.usuario)
+        self.evento()
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse('lista_productos'))
+        self.assertIs(resp.context['historial'], True)
+        consultas = [q['sql'] for q in ctx.captured_queries if 'administracion_historialproducto' in q['sql']]
+        self.assertEqual(len(consultas), 1)
+        self.assertIn("LIMIT 1", consultas[0])
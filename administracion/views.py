@@ -1,20 +1,29 @@
-import difflib
 from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from .models import Producto, Categoria, EmpresaNombre,HistorialProducto
+from .models import Producto, Categoria, EmpresaNombre, HistorialProducto, SegmentoArchivo
+from core.paginacion import PaginacionCursorMixin
+from core.sugerencias import sugerir
+from . import auditoria
+from .archivo import HistorialArchivado, fin_de_mes, mes_parametro
+from .busqueda import ResultadosPorIds, buscar_productos, filtrar_historial
+from django.db import models, transaction
 from django.db.models import Q
 from .forms import NombreEmpresaForm, ProductoForm, MarcaForm
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
+from django.contrib.auth.models import User
+from trabajadores.filtros import fecha_parametro, filtro_parametros, rango_fechas
 
 class AdminRequiredMixin(UserPassesTestMixin):
     def test_func(self):
         return self.request.user.is_staff
     def handle_no_permission(self):
         raise PermissionDenied("No tienes permisos para acceder a esta página.")
-class ListaProductosView(LoginRequiredMixin,ListView):
+class ListaProductosView(LoginRequiredMixin, PaginacionCursorMixin, ListView):
     model = Producto
     paginate_by = 6
+    # Los resultados de una búsqueda (ordenados por relevancia) se paginan con offset
+    orden_cursor = ('-fecha_creacion', '-id')
     template_name = 'administracion/lista_productos.html'
     context_object_name = 'productos'
 
@@ -22,29 +31,26 @@ class ListaProductosView(LoginRequiredMixin,ListView):
         queryset = super().get_queryset().select_related('categoria')
         query = self.request.GET.get('q')
         if query:
-            queryset = queryset.filter(
-                Q(nombre__icontains=query) |
-                Q(descripcion__icontains=query) |
-                Q(categoria__nombre__icontains=query) |
-                Q(precio__icontains=query)
-            )   
+            # El índice en memoria devuelve los ids ordenados por relevancia;
+            # solo se consultan en la BD los productos de la página actual.
+            ids = buscar_productos(query)
             # Si no hay resultados, buscamos sugerencias
-            if not queryset.exists():
-                # Obtener todos los nombres de productos y categorías para comparar
-                all_terms = list(Producto.objects.values_list('nombre', flat=True)) + \
-                            list(Categoria.objects.values_list('nombre', flat=True))
-                
-                # Encontrar términos similares
-                similar_terms = difflib.get_close_matches(query, all_terms, n=3, cutoff=0.6)
+            if not ids:
+                # Términos similares entre los nombres de productos y categorías
+                similar_terms = sugerir(['productos', 'categorias'], query, n=3, corte=0.6)
                 self.similar_terms = similar_terms  # Guardar sugerencias en el contexto
             else:
                 self.similar_terms = []  # No hay sugerencias si hay resultados
+            return ResultadosPorIds(ids, queryset)
 
         return queryset.order_by('-fecha_creacion')
-    historial =HistorialProducto.objects.all()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['historial'] = HistorialProducto.objects.all()
+        # Solo se necesita saber si hay historial (en la tabla o archivado)
+        context['historial'] = HistorialProducto.objects.exists() or SegmentoArchivo.objects.filter(
+            tipo=SegmentoArchivo.HISTORIAL
+        ).exists()
         context['similar_terms'] = getattr(self, 'similar_terms', [])
         return context
 
@@ -62,16 +68,14 @@ class NuevoProductoView(AdminRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.creado_por = self.request.user
         form.instance.actualizado_por = self.request.user
-        response = super().form_valid(form)
-        # self.object es el producto creado
-        HistorialProducto.objects.create(
-            producto=self.object,
-            nombre_producto=self.object.nombre,  # Se asigna el nombre del producto
-            usuario=self.request.user,
-            tipo_cambio="Creado",
-            detalle_cambio="Producto creado en el sistema.",
-            imagen_producto=self.object.imagen  # Guardamos la imagen actual
-        )
+        with transaction.atomic():
+            response = super().form_valid(form)
+            # self.object es el producto creado; el evento se guarda al confirmar
+            auditoria.registrar(
+                self.object, self.request.user, HistorialProducto.CREADO,
+                {'cantidad': self.object.cantidad, 'precio': self.object.precio},
+                imagen=self.object.imagen,  # Guardamos la imagen actual
+            )
         return response
 
 
@@ -81,87 +85,41 @@ class EditarProductoView(AdminRequiredMixin, UpdateView):
     template_name = 'administracion/editar_producto.html'
     success_url = reverse_lazy('lista_productos')
 
+    @transaction.atomic
     def form_valid(self, form):
         # Obtenemos el producto original antes de guardar
         producto_original = self.get_object()
-        old_image = producto_original.imagen
-        old_image_url = old_image.url if old_image else None
 
         # Preparamos el objeto nuevo, pero aún no lo guardamos en la BD
         nuevo_producto = form.save(commit=False)
         nuevo_producto.actualizado_por = self.request.user
 
-        # Guardamos el producto primero, para que la nueva imagen se suba y tenga URL
+        # Guardamos el producto primero, para que la nueva imagen se suba y tenga nombre
         nuevo_producto.save()
         
         # Si usas form.changed_data, guárdalo antes de un nuevo form.save()
         changed_fields = form.changed_data  
-        
-        # Ahora sí podemos obtener la URL de la nueva imagen
-        new_image = nuevo_producto.imagen
-        new_image_url = new_image.url if new_image else None
         nombre_producto = self.object.nombre
-        # Empezamos a armar la lista de cambios
-        cambios = []
-        
+
+        # Cada campo cambiado con su valor anterior y el nuevo; el texto del
+        # historial se arma al mostrarlo
+        campos = []
         for field in changed_fields:
             valor_antiguo = getattr(producto_original, field)
             valor_nuevo = getattr(nuevo_producto, field)
-            nombre_producto=nombre_producto
-            # 1. Si cambió la cantidad
-            if field == "cantidad":
-                diferencia = valor_nuevo - valor_antiguo
-                if diferencia > 0:
-                    cambios.append(
-                        f"Cantidad aumentó en {diferencia} (de {valor_antiguo} a {valor_nuevo})"
-                    )
-                else:
-                    cambios.append(
-                        f"Cantidad reducida en {abs(diferencia)} (de {valor_antiguo} a {valor_nuevo})"
-                    )
-
-      
-            elif field == "imagen":
-                
-                if old_image_url and new_image_url:
-                    cambios.append(
-                        f"Imagen: "
-                        f"<img src='{old_image_url}' style='max-width:100px; vertical-align:middle;'> "
-                        f"→ "
-                        f"<img src='{new_image_url}' style='max-width:100px; vertical-align:middle;'>"
-                    )
-                elif old_image_url and not new_image_url:
-                    cambios.append(
-                        f"Imagen eliminada: "
-                        f"<img src='{old_image_url}' style='max-width:100px; vertical-align:middle;'>"
-                    )
-                elif new_image_url and not old_image_url:
-                    cambios.append(
-                        f"Imagen agregada: "
-                        f"<img src='{new_image_url}' style='max-width:100px; vertical-align:middle;'>"
-                    )
-                else:
-                
-                    cambios.append("Sin cambios en la imagen.")
-            
-           
-            elif field == 'nombre':
-                cambios.append(
-                    f"Se cambió el {field} de: <strong>{valor_antiguo}</strong> a: <strong>{valor_nuevo}</strong>"
-                )
-            
-            # 4. Otros campos
-            else:
-                cambios.append(f"{field}: {valor_antiguo} → {valor_nuevo}")
-
-
-        if cambios:
-            HistorialProducto.objects.create(
-                producto=nuevo_producto,
-                usuario=self.request.user,
-                tipo_cambio="Editado",
-                nombre_producto = nombre_producto,
-                detalle_cambio="\n".join(cambios)
+            if field == "imagen":
+                valor_antiguo, valor_nuevo = valor_antiguo.name or None, valor_nuevo.name or None
+            elif isinstance(valor_nuevo, models.Model) or isinstance(valor_antiguo, models.Model):
+                valor_antiguo, valor_nuevo = str(valor_antiguo), str(valor_nuevo)
+            campos.append({'campo': field, 'antes': valor_antiguo, 'despues': valor_nuevo})
+
+        if campos:
+            cambios = {'campos': campos}
+            if "cantidad" in changed_fields:
+                cambios['cantidad'] = nuevo_producto.cantidad - producto_original.cantidad
+            auditoria.registrar(
+                nuevo_producto, self.request.user, HistorialProducto.EDITADO, cambios,
+                nombre_producto=nombre_producto,
             )
 
         return super().form_valid(form)
@@ -172,11 +130,12 @@ class EliminarProductoView(AdminRequiredMixin, DeleteView):
     template_name = 'administracion/eliminar_producto.html'
     success_url = reverse_lazy('lista_productos')
 
-class ListaHistorialProductoView(AdminRequiredMixin, ListView):
+class ListaHistorialProductoView(AdminRequiredMixin, PaginacionCursorMixin, ListView):
     model = HistorialProducto
     template_name = 'administracion/historial_productos.html'
     context_object_name = 'historial'
     paginate_by = 10
+    orden_cursor = ('-fecha_cambio', '-id')
 
     def get_queryset(self):
         queryset = HistorialProducto.objects.select_related("producto", "usuario").order_by("-fecha_cambio")
@@ -184,25 +143,39 @@ class ListaHistorialProductoView(AdminRequiredMixin, ListView):
         # Obtener valores de los filtros
         producto_id = self.request.GET.get("producto_id")
         query = self.request.GET.get("q")
+        tipo = self.request.GET.get("tipo")
+        usuario_id = self.request.GET.get("usuario")
+
+        # Un mes archivado se lee de su segmento en lugar de la tabla
+        mes = mes_parametro(self.request.GET.get("mes"))
+        if mes:
+            segmento = SegmentoArchivo.objects.filter(tipo=SegmentoArchivo.HISTORIAL, mes=mes).first()
+            if segmento:
+                self.similar_terms = []
+                return HistorialArchivado(
+                    segmento, producto_id=producto_id, tipo=tipo, usuario_id=usuario_id, consulta=query,
+                    desde=fecha_parametro(self.request.GET.get("fecha_inicio")),
+                    hasta=fecha_parametro(self.request.GET.get("fecha_fin")),
+                )
+            queryset = queryset.filter(rango_fechas('fecha_cambio', mes, fin_de_mes(mes)))
 
-        # Filtrar por ID de producto (select)
+        # Filtros por igualdad más el rango de fechas: cada uno tiene su
+        # índice (columna, fecha_cambio)
         if producto_id:
-            try:
-                producto = Producto.objects.get(pk=producto_id)
-                queryset = queryset.filter(
-                    Q(producto_id=producto_id) | Q(nombre_producto=producto.nombre)
-                )
-            except Producto.DoesNotExist:
-                queryset = queryset.none()
+            queryset = queryset.filter(producto_id=producto_id) if producto_id.isdigit() else queryset.none()
+        if tipo:
+            queryset = queryset.filter(tipo_cambio=tipo)
+        if usuario_id:
+            queryset = queryset.filter(usuario_id=usuario_id) if usuario_id.isdigit() else queryset.none()
+        queryset = queryset.filter(filtro_parametros(self.request.GET, 'fecha_cambio'))
 
         # Filtrar por nombre del producto (buscador)
         if query:
-            queryset = queryset.filter(nombre_producto__icontains=query)
+            queryset = filtrar_historial(queryset, query)
 
             # Si no hay resultados, buscar términos similares
             if not queryset.exists():
-                all_terms = list(HistorialProducto.objects.values_list('nombre_producto', flat=True))
-                similar_terms = difflib.get_close_matches(query, all_terms, n=3, cutoff=0.6)
+                similar_terms = sugerir('historial', query, n=3, corte=0.6)
                 self.similar_terms = similar_terms
             else:
                 self.similar_terms = []
@@ -213,15 +186,24 @@ class ListaHistorialProductoView(AdminRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['productos'] = Producto.objects.all()  # Lista para el select
+        # Lista para el select: solo lo que muestra la opción
+        context['productos'] = Producto.objects.only('id', 'nombre').order_by('nombre')
+        context['tipos'] = HistorialProducto.TIPO_CHOICES
+        context['meses_archivados'] = SegmentoArchivo.objects.filter(
+            tipo=SegmentoArchivo.HISTORIAL
+        ).values_list('mes', flat=True)
+        context['usuarios'] = User.objects.filter(
+            pk__in=HistorialProducto.objects.values('usuario_id')
+        ).order_by('username')
         context['similar_terms'] = getattr(self, 'similar_terms', [])  # Sugerencias de búsqueda
         return context
 
 ########################################################################################
 
-class ListarMarcas(AdminRequiredMixin,ListView):
+class ListarMarcas(AdminRequiredMixin, PaginacionCursorMixin, ListView):
     model = Categoria
     paginate_by = 6
+    orden_cursor = ('nombre', 'id')
     template_name = 'administracion/lista_marca.html'
     context_object_name = 'marcas'
 
@@ -234,11 +216,8 @@ class ListarMarcas(AdminRequiredMixin,ListView):
             )   
             # Si no hay resultados, buscamos sugerencias
             if not queryset.exists():
-                # Obtener todos los nombres de categorías para comparar
-                all_terms = list(Categoria.objects.values_list('nombre', flat=True))
-                
-                # Encontrar términos similares
-                similar_terms = difflib.get_close_matches(query, all_terms, n=3, cutoff=0.6)
+                # Encontrar términos similares entre los nombres de categorías
+                similar_terms = sugerir('categorias', query, n=3, corte=0.6)
                 self.similar_terms = similar_terms  # Guardar sugerencias en el contexto
             else:
                 self.similar_terms = []  # No hay sugerencias si hay resultados
@@ -0,0 +1,44 @@
+"""
+Reintentos ante el bloqueo de escritura de SQLite.
+
+SQLite admite una sola escritura a la vez; con varios cajeros (o hilos en
+segundo plano) una transacción puede encontrar la base bloqueada.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+def base_de_datos_bloqueada(error):
+    mensaje = str(error).lower()
+    return 'database is locked' in mensaje or 'database table is locked' in mensaje
+
+
+def reintentar_si_bloqueada(funcion=None, *, intentos=None, espera=None):
+    """
+    Reintenta `funcion` cuando SQLite responde que la base está bloqueada por
+    otra escritura. Debe envolver la transacción completa: dentro de un
+    bloque atomic ya no se puede reintentar.
+    """
+    if funcion is None:
+        return functools.partial(reintentar_si_bloqueada, intentos=intentos, espera=espera)
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        maximo = intentos or getattr(settings, 'STOCK_REINTENTOS', 5)
+        pausa = espera or getattr(settings, 'STOCK_ESPERA_REINTENTO', 0.05)
+        for intento in range(1, maximo + 1):
+            try:
+                return funcion(*args, **kwargs)
+            except OperationalError as error:
+                if intento == maximo or not base_de_datos_bloqueada(error):
+                    raise
+                if transaction.get_connection().in_atomic_block:
+                    raise
+                # Espera exponencial con algo de azar para no chocar de nuevo
+                time.sleep(pausa * (2 ** (intento - 1)) * (1 + random.random()))
+
+    return envoltura
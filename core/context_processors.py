@@ -1,7 +1,9 @@
 
-from administracion.models import EmpresaNombre
+from django.utils.functional import SimpleLazyObject
+
+from administracion.empresa import obtener_empresa
 
 def empresa(request):
-    # Da el nombre de la empresa para el contexto global, revisa en settings.py en la sección de context_processors
-    empresa = EmpresaNombre.objects.first()
-    return {'empresa': empresa}
+    # Da el nombre de la empresa para el contexto global, revisa en settings.py en la sección de context_processors.
+    # Es perezoso: si la plantilla no usa `empresa` no se consulta nada, y si la usa sale de la caché.
+    return {'empresa': SimpleLazyObject(obtener_empresa)}
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.cache import cache
+
+CLAVE_VERSION = 'grupos:version'
+
+
+def _clave(usuario_id, version):
+    return f'grupos:{version}:{usuario_id}'
+
+
+def _cache_activa():
+    return bool(getattr(settings, 'GRUPOS_CACHE_TIMEOUT', 0))
+
+
+def nombres_grupos(user):
+    """
+    Nombres de los grupos del usuario. Se guardan en el propio objeto user
+    (dura lo que dura la petición) y, si GRUPOS_CACHE_TIMEOUT no es 0, también
+    en la caché entre peticiones. Como mucho hace una consulta por petición.
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    grupos = getattr(user, '_nombres_grupos', None)
+    if grupos is None:
+        clave = None
+        if _cache_activa():
+            version = cache.get_or_set(CLAVE_VERSION, 1, None)
+            clave = _clave(user.pk, version)
+            grupos = cache.get(clave)
+        if grupos is None:
+            grupos = frozenset(user.groups.values_list('name', flat=True))
+            if clave:
+                cache.set(clave, grupos, settings.GRUPOS_CACHE_TIMEOUT)
+        user._nombres_grupos = grupos
+    return grupos
+
+
+def pertenece_a_grupo(user, nombre):
+    return nombre in nombres_grupos(user)
+
+
+def invalidar_usuarios(usuario_ids):
+    """Olvida los grupos guardados de esos usuarios (cambió su membresía)."""
+    if not _cache_activa():
+        return
+    version = cache.get(CLAVE_VERSION)
+    if version is not None:
+        cache.delete_many([_clave(usuario_id, version) for usuario_id in usuario_ids])
+
+
+def invalidar_todos():
+    """Olvida los grupos de todos los usuarios (se renombró o eliminó un grupo)."""
+    if not _cache_activa():
+        return
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        pass
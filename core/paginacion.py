@@ -0,0 +1,173 @@
+"""
+Paginación por cursor (keyset): en lugar de OFFSET y COUNT(*), cada página
+se pide a partir de la última fila de la anterior, por ejemplo
+`WHERE (fecha, id) < (f, i) ORDER BY fecha DESC, id DESC LIMIT n`. El costo
+no crece con la profundidad de la página, a cambio de no saber el total ni
+poder saltar a una página arbitraria.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from django.http import Http404
+
+SIGUIENTE = 'n'
+ANTERIOR = 'p'
+
+
+def codificar_cursor(direccion, valores):
+    """Token opaco con la dirección y los valores de la fila de referencia."""
+    valores = [v.isoformat() if isinstance(v, (date, datetime)) else
+               str(v) if isinstance(v, Decimal) else v for v in valores]
+    datos = json.dumps([direccion, valores], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(datos).decode().rstrip('=')
+
+
+def decodificar_cursor(token):
+    """Devuelve (dirección, valores) o lanza ValueError si el token no es válido."""
+    try:
+        datos = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direccion, valores = json.loads(datos)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if direccion not in (SIGUIENTE, ANTERIOR) or not isinstance(valores, list):
+        raise ValueError('Cursor inválido')
+    return direccion, valores
+
+
+class PaginaCursor:
+    """Página con la misma interfaz básica que django.core.paginator.Page."""
+
+    def __init__(self, object_list, cursor_anterior, cursor_siguiente):
+        self.object_list = object_list
+        self.cursor_anterior = cursor_anterior
+        self.cursor_siguiente = cursor_siguiente
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, indice):
+        return self.object_list[indice]
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class PaginadorCursor:
+    """
+    Pagina un queryset por las columnas de `orden` (por ejemplo
+    `('-fecha_creacion', '-id')`), que deben identificar cada fila de forma
+    única y no ser nulas: la última suele ser la llave primaria.
+    """
+
+    def __init__(self, queryset, per_page, orden):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.orden = tuple(orden)
+        self.campos = [campo.lstrip('-') for campo in self.orden]
+
+    def _convertir(self, valores):
+        if len(valores) != len(self.campos):
+            raise ValueError('Cursor inválido')
+        modelo = self.queryset.model
+        try:
+            return [
+                modelo._meta.get_field(campo).to_python(valor)
+                for campo, valor in zip(self.campos, valores)
+            ]
+        except (ValidationError, TypeError):
+            raise ValueError('Cursor inválido')
+
+    def _despues_de(self, valores, invertir):
+        """Q de las filas que van después de `valores` en el orden (o antes si invertir)."""
+        condicion = Q()
+        iguales = Q()
+        for campo, valor in zip(self.orden, valores):
+            nombre = campo.lstrip('-')
+            descendente = campo.startswith('-') != invertir
+            condicion |= iguales & Q(**{f'{nombre}__{"lt" if descendente else "gt"}': valor})
+            iguales &= Q(**{nombre: valor})
+        return condicion
+
+    def _clave(self, objeto):
+        return [getattr(objeto, campo) for campo in self.campos]
+
+    def page(self, token=None):
+        direccion, valores = SIGUIENTE, None
+        if token:
+            direccion, valores = decodificar_cursor(token)
+            valores = self._convertir(valores)
+
+        invertir = direccion == ANTERIOR
+        orden = self.orden
+        if invertir:
+            orden = [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in orden]
+        queryset = self.queryset.order_by(*orden)
+        if valores is not None:
+            queryset = queryset.filter(self._despues_de(valores, invertir))
+
+        # Una fila de más indica si hay otra página en esa dirección
+        filas = list(queryset[:self.per_page + 1])
+        hay_mas = len(filas) > self.per_page
+        filas = filas[:self.per_page]
+        if invertir:
+            filas.reverse()
+
+        anterior = siguiente = None
+        if filas:
+            if (hay_mas if invertir else valores is not None):
+                anterior = codificar_cursor(ANTERIOR, self._clave(filas[0]))
+            if (valores is not None if invertir else hay_mas):
+                siguiente = codificar_cursor(SIGUIENTE, self._clave(filas[-1]))
+        elif valores is not None:
+            # Página vacía (se borraron filas): se ofrece volver
+            if invertir:
+                siguiente = codificar_cursor(SIGUIENTE, valores)
+            else:
+                anterior = codificar_cursor(ANTERIOR, valores)
+        return PaginaCursor(filas, anterior, siguiente)
+
+
+class PaginacionCursorMixin:
+    """
+    Para ListView: con `paginacion = 'cursor'` la vista pagina con cursores
+    opacos en el parámetro `cursor` según `orden_cursor`; con 'offset' usa el
+    Paginator de Django. Las listas que no son querysets (por ejemplo los
+    resultados de una búsqueda ordenados por relevancia) siempre usan offset.
+    En el contexto queda `paginacion_cursor` para que la plantilla sepa qué
+    enlaces mostrar.
+    """
+    paginacion = 'cursor'
+    orden_cursor = ('-fecha_creacion', '-id')
+    cursor_kwarg = 'cursor'
+
+    def usa_cursor(self, queryset):
+        return self.paginacion == 'cursor' and isinstance(queryset, QuerySet)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.usa_cursor(queryset):
+            return super().paginate_queryset(queryset, page_size)
+        paginador = PaginadorCursor(queryset, page_size, self.orden_cursor)
+        try:
+            pagina = paginador.page(self.request.GET.get(self.cursor_kwarg))
+        except ValueError:
+            raise Http404('Cursor de paginación inválido.')
+        return (paginador, pagina, pagina.object_list, pagina.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['paginacion_cursor'] = isinstance(context.get('paginator'), PaginadorCursor)
+        return context
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .grupos import invalidar_todos, invalidar_usuarios
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def grupos_de_usuario_cambiaron(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalida la caché de grupos cuando cambia la membresía de un usuario."""
+    if action == 'pre_clear' and reverse:
+        # Se vacía un grupo: hay que saber qué usuarios tenía antes de borrar
+        invalidar_usuarios(list(instance.user_set.values_list('pk', flat=True)))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            invalidar_usuarios([instance.pk])
+        elif pk_set:
+            invalidar_usuarios(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def grupo_cambio(sender, **kwargs):
+    invalidar_todos()
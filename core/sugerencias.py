@@ -0,0 +1,282 @@
+"""
+Sugerencias "¿Quizás quisiste decir?" sin recorrer la tabla en cada búsqueda.
+
+Cada vocabulario (nombres de productos, categorías, clientes...) se carga una
+vez por proceso en árboles BK agrupados por longitud y se mantiene al día con
+señales. Se vuelve a cargar pasados SUGERENCIAS_TTL segundos, para recoger
+los cambios de otros procesos, y guarda como mucho SUGERENCIAS_MAX_TERMINOS
+términos (los más frecuentes). La distancia del árbol es la de inserciones/borrados (basada en la
+subsecuencia común más larga), que acota el ratio de difflib: si
+ratio >= corte entonces distancia <= (1 - corte) * (len(a) + len(b)). Así el
+árbol descarta candidatos sin perder ninguno, y los que quedan se puntúan con
+difflib.SequenceMatcher, por lo que el resultado es el mismo que daría
+difflib.get_close_matches sobre la lista completa (sin repetidos).
+"""
+import heapq
+import threading
+import time
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+def mascaras(texto):
+    """Bits por carácter de `texto`, para el cálculo paralelo de la LCS."""
+    resultado = {}
+    for i, caracter in enumerate(texto):
+        resultado[caracter] = resultado.get(caracter, 0) | (1 << i)
+    return resultado
+
+
+def distancia(mascaras_a, largo_a, b):
+    """
+    Distancia de inserciones/borrados entre `a` (dado por sus máscaras) y `b`:
+    len(a) + len(b) - 2 * LCS, con el algoritmo de bits de Allison-Dix.
+    """
+    if not largo_a or not b:
+        return largo_a + len(b)
+    todos = (1 << largo_a) - 1
+    v = todos
+    for caracter in b:
+        u = v & mascaras_a.get(caracter, 0)
+        v = ((v + u) | (v - u)) & todos
+    lcs = largo_a - bin(v).count('1')
+    return largo_a + len(b) - 2 * lcs
+
+
+class ArbolBK:
+    """Árbol BK sobre la distancia de inserciones/borrados."""
+
+    def __init__(self):
+        self.raiz = None
+
+    def agregar(self, termino):
+        if self.raiz is None:
+            self.raiz = (termino, {})
+            return
+        nodo = self.raiz
+        while True:
+            texto, hijos = nodo
+            if texto == termino:
+                return
+            d = distancia(mascaras(texto), len(texto), termino)
+            if d not in hijos:
+                hijos[d] = (termino, {})
+                return
+            nodo = hijos[d]
+
+    def buscar(self, consulta, radio):
+        if self.raiz is None:
+            return
+        mascaras_consulta = mascaras(consulta)
+        pendientes = [self.raiz]
+        while pendientes:
+            texto, hijos = pendientes.pop()
+            d = distancia(mascaras_consulta, len(consulta), texto)
+            if d <= radio:
+                yield texto
+            for k, hijo in hijos.items():
+                if d - radio <= k <= d + radio:
+                    pendientes.append(hijo)
+
+
+class Vocabulario:
+    """
+    Conjunto de términos con su número de apariciones, cargado la primera vez
+    que se usa y otra vez cuando vence el TTL. Los términos que dejan de
+    existir quedan marcados en el árbol hasta que se reconstruye.
+    """
+
+    def __init__(self, nombre, cargar):
+        self.nombre = nombre
+        self._cargar = cargar
+        self._lock = threading.RLock()
+        self._conteos = None
+        self._arboles = {}
+        self._borrados = 0
+        self._cargado_en = None
+        # Cambia con cada modificación; invalida las sugerencias en caché
+        self.version = 0
+
+    @property
+    def cargado(self):
+        return self._conteos is not None
+
+    def vigente(self):
+        if self._conteos is None:
+            return False
+        ttl = getattr(settings, 'SUGERENCIAS_TTL', 300)
+        return not ttl or time.monotonic() - self._cargado_en < ttl
+
+    def asegurar(self):
+        with self._lock:
+            if not self.vigente():
+                conteos = Counter()
+                for termino, veces in self._cargar():
+                    if termino:
+                        conteos[termino] += veces
+                self._reconstruir(conteos)
+                self._cargado_en = time.monotonic()
+
+    def _reconstruir(self, conteos):
+        limite = getattr(settings, 'SUGERENCIAS_MAX_TERMINOS', 20000)
+        if limite and len(conteos) > limite:
+            conteos = Counter(dict(conteos.most_common(limite)))
+        self._conteos = conteos
+        self._arboles = {}
+        self._borrados = 0
+        for termino in conteos:
+            self._arboles.setdefault(len(termino), ArbolBK()).agregar(termino)
+        self.version += 1
+
+    def recargar(self):
+        with self._lock:
+            self._conteos = None
+            self.version += 1
+
+    def agregar(self, *terminos):
+        """Suma apariciones. Los términos nuevos que no caben esperan a la próxima carga."""
+        with self._lock:
+            if self._conteos is None:
+                return
+            limite = getattr(settings, 'SUGERENCIAS_MAX_TERMINOS', 20000)
+            for termino in terminos:
+                if not termino:
+                    continue
+                if limite and termino not in self._conteos and len(self._conteos) >= limite:
+                    continue
+                if self._conteos[termino] == 0:
+                    self._arboles.setdefault(len(termino), ArbolBK()).agregar(termino)
+                self._conteos[termino] += 1
+            self.version += 1
+
+    def quitar(self, *terminos):
+        with self._lock:
+            if self._conteos is None:
+                return
+            for termino in terminos:
+                if self._conteos.get(termino, 0) <= 0:
+                    continue
+                self._conteos[termino] -= 1
+                if self._conteos[termino] == 0:
+                    self._borrados += 1
+            self.version += 1
+            if self._borrados > max(64, len(self._conteos) // 2):
+                self._reconstruir(+self._conteos)
+
+    def candidatos(self, consulta, corte):
+        """(puntaje, término) de los términos con ratio de difflib >= corte."""
+        with self._lock:
+            self.asegurar()
+            largo = len(consulta)
+            comparador = SequenceMatcher()
+            comparador.set_seq2(consulta)
+            resultado = []
+            for largo_termino, arbol in self._arboles.items():
+                total = largo + largo_termino
+                # Cota por longitudes (real_quick_ratio de difflib)
+                if not total or 2.0 * min(largo, largo_termino) / total < corte:
+                    continue
+                radio = int((1 - corte) * total + 1e-9)
+                for termino in arbol.buscar(consulta, radio):
+                    if self._conteos.get(termino, 0) <= 0:
+                        continue
+                    comparador.set_seq1(termino)
+                    puntaje = comparador.ratio()
+                    if puntaje >= corte:
+                        resultado.append((puntaje, termino))
+            return resultado
+
+_vocabularios = {}
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def registrar(nombre, cargar):
+    """
+    Registra un vocabulario. `cargar` devuelve pares (término, apariciones),
+    por ejemplo `Modelo.objects.values_list('campo').annotate(Count('pk'))`.
+    """
+    _vocabularios[nombre] = Vocabulario(nombre, cargar)
+    return _vocabularios[nombre]
+
+
+def vocabulario(nombre):
+    return _vocabularios[nombre]
+
+
+def sugerir(nombres, consulta, n=3, corte=0.6):
+    """
+    Hasta `n` términos parecidos a `consulta` en uno o varios vocabularios,
+    del más parecido al menos, como difflib.get_close_matches. Los resultados
+    se guardan en una caché LRU (SUGERENCIAS_CACHE entradas) que se invalida
+    sola cuando cambia alguno de los vocabularios.
+    """
+    if isinstance(nombres, str):
+        nombres = [nombres]
+    vocabs = [vocabulario(nombre) for nombre in nombres]
+    for vocab in vocabs:
+        vocab.asegurar()
+    clave = (tuple(nombres), tuple(vocab.version for vocab in vocabs), consulta, n, corte)
+
+    with _cache_lock:
+        if clave in _cache:
+            _cache.move_to_end(clave)
+            return list(_cache[clave])
+
+    candidatos = {}
+    for vocab in vocabs:
+        for puntaje, termino in vocab.candidatos(consulta, corte):
+            candidatos[termino] = max(puntaje, candidatos.get(termino, 0))
+    resultado = [termino for _, termino in heapq.nlargest(n, ((p, t) for t, p in candidatos.items()))]
+
+    with _cache_lock:
+        _cache[clave] = resultado
+        while len(_cache) > getattr(settings, 'SUGERENCIAS_CACHE', 512):
+            _cache.popitem(last=False)
+    return list(resultado)
+
+
+def vigilar(modelo, campo, nombre):
+    """
+    Conecta las señales de `modelo` para que el vocabulario `nombre` siga los
+    valores de `campo` al crear, editar o eliminar registros. Los
+    bulk_create no disparan señales: quien los use debe llamar a agregar().
+
+    El valor anterior se toma de `_<campo>_guardado`, que el modelo guarda en
+    from_db (como Producto._imagen_guardada). Solo si no está, por ejemplo
+    con el campo diferido, se lee de la BD antes de guardar.
+    """
+    vocab = _vocabularios[nombre]
+    uid = f'sugerencias-{nombre}-{modelo._meta.label}'
+    guardado = f'_{campo}_guardado'
+
+    def antes_de_guardar(sender, instance, update_fields=None, **kwargs):
+        if update_fields is not None and campo not in update_fields:
+            return
+        if (vocab.cargado and instance.pk and not instance._state.adding
+                and getattr(instance, guardado, None) is None):
+            setattr(instance, guardado, (
+                sender._default_manager.filter(pk=instance.pk).values_list(campo, flat=True).first()
+            ))
+
+    def despues_de_guardar(sender, instance, created, update_fields=None, **kwargs):
+        if update_fields is not None and campo not in update_fields:
+            return
+        anterior = getattr(instance, guardado, None)
+        actual = getattr(instance, campo)
+        setattr(instance, guardado, actual)
+        if created:
+            vocab.agregar(actual)
+        elif anterior is not None and anterior != actual:
+            vocab.quitar(anterior)
+            vocab.agregar(actual)
+
+    def despues_de_eliminar(sender, instance, **kwargs):
+        vocab.quitar(getattr(instance, campo))
+
+    pre_save.connect(antes_de_guardar, sender=modelo, weak=False, dispatch_uid=uid)
+    post_save.connect(despues_de_guardar, sender=modelo, weak=False, dispatch_uid=uid)
+    post_delete.connect(despues_de_eliminar, sender=modelo, weak=False, dispatch_uid=uid)
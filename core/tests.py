@@ -1,3 +1,232 @@
-from django.test import TestCase
+import difflib
+import random
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.urls import reverse
+
+from administracion.models import Categoria, Producto
+from administracion.templatetags.custom_tags import has_group
+from . import sugerencias
+from .grupos import nombres_grupos, pertenece_a_grupo
+from .paginacion import PaginadorCursor, codificar_cursor
+from .sugerencias import ArbolBK, Vocabulario, distancia, mascaras
+
+
+class DistanciaTests(SimpleTestCase):
+    def test_distancia_inserciones_y_borrados(self):
+        casos = [("", "abc", 3), ("abc", "abc", 0), ("cafe", "cafes", 1), ("kitten", "sitting", 5)]
+        for a, b, esperado in casos:
+            self.assertEqual(distancia(mascaras(a), len(a), b), esperado)
+            self.assertEqual(distancia(mascaras(b), len(b), a), esperado)
+
+    def test_arbol_bk_devuelve_todos_los_terminos_del_radio(self):
+        arbol = ArbolBK()
+        palabras = ["arroz", "arroces", "azucar", "aceite", "arena", "rosa"]
+        for palabra in palabras:
+            arbol.agregar(palabra)
+        esperado = {p for p in palabras if distancia(mascaras("arros"), 5, p) <= 4}
+        self.assertEqual(set(arbol.buscar("arros", 4)), esperado)
+
+
+class VocabularioTests(SimpleTestCase):
+    def test_mismos_resultados_que_difflib(self):
+        aleatorio = random.Random(7)
+        silabas = ["ca", "fe", "mo", "li", "do", "ja", "bon", "ar", "roz", "le", "che", "pan"]
+        palabras = sorted({
+            " ".join("".join(aleatorio.choice(silabas) for _ in range(aleatorio.randint(1, 3)))
+                     for _ in range(aleatorio.randint(1, 2)))
+            for _ in range(800)
+        })
+        vocab = Vocabulario('prueba', lambda: [(p, 1) for p in palabras])
+        consultas = [aleatorio.choice(palabras)[:-1] + "x" for _ in range(40)] + ["cafe", "zzz", ""]
+
+        for consulta in consultas:
+            candidatos = vocab.candidatos(consulta, 0.6)
+            obtenidos = [t for _, t in sorted(candidatos, reverse=True)[:3]]
+            self.assertEqual(obtenidos, difflib.get_close_matches(consulta, palabras, n=3, cutoff=0.6))
+
+    def test_agregar_y_quitar_terminos(self):
+        vocab = Vocabulario('prueba', lambda: [("manzana", 2)])
+        vocab.asegurar()
+        vocab.quitar("manzana")
+        self.assertEqual([t for _, t in vocab.candidatos("manzanas", 0.6)], ["manzana"])
+        vocab.quitar("manzana")
+        self.assertEqual(vocab.candidatos("manzanas", 0.6), [])
+        vocab.agregar("manzana")
+        self.assertEqual([t for _, t in vocab.candidatos("manzanas", 0.6)], ["manzana"])
+
+    @override_settings(SUGERENCIAS_MAX_TERMINOS=2)
+    def test_limite_conserva_los_mas_frecuentes(self):
+        vocab = Vocabulario('prueba', lambda: [("pera", 1), ("perla", 5), ("perro", 3)])
+        self.assertEqual(sorted(t for _, t in vocab.candidatos("pera", 0.6)), ["perla", "perro"])
+        # Los términos nuevos que no caben esperan a la próxima carga
+        vocab.agregar("perica")
+        self.assertEqual(sorted(t for _, t in vocab.candidatos("peric", 0.6)), ["perla", "perro"])
+
+    @override_settings(SUGERENCIAS_TTL=60)
+    def test_ttl_recoge_cambios_de_otros_procesos(self):
+        terminos = [("naranja", 1)]
+        vocab = Vocabulario('prueba', lambda: list(terminos))
+        vocab.asegurar()
+        terminos.append(("lima", 1))
+        self.assertEqual([t for _, t in vocab.candidatos("limas", 0.6)], [])
+
+        ahora = time.monotonic()
+        with mock.patch('core.sugerencias.time.monotonic', return_value=ahora + 61):
+            self.assertEqual([t for _, t in vocab.candidatos("limas", 0.6)], ["lima"])
+
+
+class SugerenciasVistasTests(TestCase):
+    def setUp(self):
+        for nombre in ('productos', 'categorias', 'historial', 'clientes'):
+            sugerencias.vocabulario(nombre).recargar()
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True)
+        self.client.force_login(self.usuario)
+        self.categoria = Categoria.objects.create(nombre="Lácteos")
+        Producto.objects.create(nombre="Mantequilla", precio=1, cantidad=1, categoria=self.categoria)
+
+    def test_vocabulario_sigue_los_cambios_por_senales(self):
+        self.assertEqual(sugerencias.sugerir('productos', "mantekilla"), ["Mantequilla"])
+
+        producto = Producto.objects.get()
+        producto.nombre = "Margarina"
+        producto.save()
+        self.assertEqual(sugerencias.sugerir('productos', "mantekilla"), [])
+        self.assertEqual(sugerencias.sugerir('productos', "margarin"), ["Margarina"])
+
+    def test_nombre_anterior_sin_consultar_la_bd(self):
+        sugerencias.sugerir('productos', "mantekilla")
+        producto = Producto.objects.get()
+        producto.nombre = "Margarina"
+        with CaptureQueriesContext(connection) as ctx:
+            producto.save()
+        # El nombre anterior viene de from_db, no de un SELECT antes de guardar
+        self.assertFalse(any(
+            consulta['sql'].startswith('SELECT "administracion_producto"."nombre"')
+            for consulta in ctx.captured_queries
+        ))
+        self.assertEqual(sugerencias.sugerir('productos', "mantekilla"), [])
+
+        # Un segundo cambio parte del nombre recién guardado
+        producto.nombre = "Mantequilla"
+        producto.save()
+        self.assertEqual(sugerencias.sugerir('productos', "margarin"), [])
+
+    def test_vistas_usan_el_vocabulario_en_memoria(self):
+        sugerencias.sugerir(['productos', 'categorias'], "calentamiento")
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(reverse('lista_productos'), {'q': 'mantekilla'})
+        self.assertEqual(respuesta.context['similar_terms'], ["Mantequilla"])
+        # Con el vocabulario cargado ya no se leen todos los nombres de la BD
+        self.assertFalse(any('GROUP BY' in consulta['sql'] for consulta in ctx.captured_queries))
+
+        respuesta = self.client.get(reverse('lista_marcas'), {'q': 'lacteo'})
+        self.assertEqual(respuesta.context['similar_terms'], ["Lácteos"])
+
+
+@override_settings(GRUPOS_CACHE_TIMEOUT=300)
+class GruposTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.trabajadores = Group.objects.create(name='Trabajadores')
+        self.usuario = User.objects.create_user('cajero', password='x')
+
+    def usuario_nuevo(self):
+        # Simula otra petición: un objeto user sin grupos memorizados
+        return User.objects.get(pk=self.usuario.pk)
+
+    def test_una_consulta_por_peticion(self):
+        self.usuario.groups.add(self.trabajadores)
+        usuario = self.usuario_nuevo()
+        with self.assertNumQueries(1):
+            for _ in range(20):
+                self.assertTrue(has_group(usuario, 'Trabajadores'))
+                self.assertFalse(has_group(usuario, 'NoExiste'))
+
+    def test_cache_entre_peticiones(self):
+        self.usuario.groups.add(self.trabajadores)
+        nombres_grupos(self.usuario_nuevo())
+        usuario = self.usuario_nuevo()
+        with self.assertNumQueries(0):
+            self.assertTrue(pertenece_a_grupo(usuario, 'Trabajadores'))
+
+    def test_invalidacion_al_cambiar_membresia(self):
+        self.assertFalse(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+        self.usuario.groups.add(self.trabajadores)
+        self.assertTrue(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+        self.trabajadores.user_set.remove(self.usuario)
+        self.assertFalse(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+        self.trabajadores.user_set.add(self.usuario)
+        self.assertTrue(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+        self.trabajadores.user_set.clear()
+        self.assertFalse(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+
+    def test_invalidacion_al_renombrar_grupo(self):
+        self.usuario.groups.add(self.trabajadores)
+        self.assertTrue(pertenece_a_grupo(self.usuario_nuevo(), 'Trabajadores'))
+        self.trabajadores.name = 'Cajeros'
+        self.trabajadores.save()
+        usuario = self.usuario_nuevo()
+        self.assertFalse(pertenece_a_grupo(usuario, 'Trabajadores'))
+        self.assertTrue(pertenece_a_grupo(usuario, 'Cajeros'))
+
+    def test_anonimo(self):
+        self.assertFalse(has_group(AnonymousUser(), 'Trabajadores'))
+        self.assertFalse(has_group(None, 'Trabajadores'))
+
+    def test_login_redirige_trabajadores(self):
+        self.usuario.groups.add(self.trabajadores)
+        respuesta = self.client.post(reverse('iniciar_sesion'), {'username': 'cajero', 'password': 'x'})
+        self.assertRedirects(respuesta, reverse('venta_list') + '?login', fetch_redirect_response=False)
+
+
+class PaginacionCursorTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('admin', password='x', is_staff=True)
+        # Nombres repetidos para probar el desempate por id
+        Categoria.objects.bulk_create(
+            [Categoria(nombre=f'Marca {i // 3:02d}') for i in range(25)]
+        )
+        self.esperado = list(Categoria.objects.order_by('nombre', 'id').values_list('pk', flat=True))
+
+    def test_recorre_hacia_adelante_y_atras_sin_repetir(self):
+        paginador = PaginadorCursor(Categoria.objects.all(), 4, ('nombre', 'id'))
+        paginas = [paginador.page()]
+        while paginas[-1].has_next():
+            paginas.append(paginador.page(paginas[-1].cursor_siguiente))
+        self.assertEqual([c.pk for p in paginas for c in p], self.esperado)
+        self.assertFalse(paginas[0].has_previous())
+
+        # De vuelta desde la última página se obtienen las mismas páginas
+        pagina = paginas[-1]
+        for anterior in reversed(paginas[:-1]):
+            pagina = paginador.page(pagina.cursor_anterior)
+            self.assertEqual([c.pk for c in pagina], [c.pk for c in anterior])
+        self.assertFalse(pagina.has_previous())
+
+    def test_vista_sin_count_ni_offset(self):
+        self.client.force_login(self.usuario)
+        url = reverse('lista_marcas')
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(url)
+        self.assertTrue(respuesta.context['paginacion_cursor'])
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries).upper()
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+        cursor = respuesta.context['page_obj'].cursor_siguiente
+        respuesta = self.client.get(url, {'cursor': cursor})
+        self.assertEqual([m.pk for m in respuesta.context['marcas']], self.esperado[6:12])
+        self.assertContains(respuesta, 'cursor=')
+
+    def test_cursor_invalido(self):
+        self.client.force_login(self.usuario)
+        for cursor in ('basura', codificar_cursor('n', ['x'])):
+            respuesta = self.client.get(reverse('lista_marcas'), {'cursor': cursor})
+            self.assertEqual(respuesta.status_code, 404)
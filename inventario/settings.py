@@ -86,9 +86,69 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Toma el bloqueo de escritura al abrir la transacción para que dos
+            # cajeros no se bloqueen mutuamente al descontar stock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# Reintentos cuando SQLite responde "database is locked" al registrar ventas
+STOCK_REINTENTOS = 5
+STOCK_ESPERA_REINTENTO = 0.05
+
+# Segundos antes de reconstruir el índice de búsqueda de productos en memoria.
+# Las señales lo mantienen al día dentro de cada proceso; el TTL recoge los
+# cambios hechos por otros procesos (0 = no expira).
+BUSQUEDA_INDICE_TTL = 300
+
+# Motor del buscador de productos e historial:
+#   'indice' -> índice de trigramas en memoria (por proceso)
+#   'fts'    -> tablas FTS5 de SQLite con ranking BM25 (python manage.py reconstruir_busqueda)
+#               Con otro modo, migrate y reconstruir_busqueda borran las tablas y triggers FTS5
+#   'orm'    -> filtros icontains; también es el respaldo si FTS5 no está disponible
+BUSQUEDA_MODO = 'indice'
+
+# Entradas de la caché LRU de sugerencias "¿Quizás quisiste decir?"
+SUGERENCIAS_CACHE = 512
+# Segundos antes de volver a cargar cada vocabulario de sugerencias desde la
+# BD, para recoger los cambios de otros procesos (0 = no expira), y máximo de
+# términos por vocabulario (se quedan los más frecuentes; 0 = sin límite)
+SUGERENCIAS_TTL = 300
+SUGERENCIAS_MAX_TERMINOS = 20000
+
+# Segundos que se guarda en caché la configuración de la empresa. Se invalida
+# al guardarla o eliminarla; el tiempo límite cubre a los demás procesos.
+EMPRESA_CACHE_TIMEOUT = 300
+
+# Segundos que se guardan en caché los grupos de cada usuario entre peticiones
+# (0 = solo durante la petición). Se invalida al cambiar la membresía o los grupos.
+GRUPOS_CACHE_TIMEOUT = 300
+
+# Reporte de ventas en PDF: ventas leídas por lote y bytes que el archivo
+# temporal guarda en memoria antes de pasar a disco
+REPORTE_LOTE_VENTAS = 500
+REPORTE_MEMORIA_MAXIMA = 5 * 1024 * 1024
+
+# Reportes en segundo plano: hilos del pool (0 = generar en la petición),
+# segundos que se conservan los archivos y segundos sin avance tras los que
+# un trabajo se da por perdido
+REPORTES_HILOS = 2
+REPORTES_TTL = 3600
+REPORTES_SIN_PROGRESO = 300
+
+# Tickets de venta guardados en MEDIA_ROOT/TICKETS_DIR; con TICKETS_PRERENDER
+# se generan en segundo plano apenas se confirma la venta
+TICKETS_DIR = 'tickets'
+TICKETS_PRERENDER = False
+
+# Impresora térmica para los tickets ESC/POS: 'tcp://host:9100' o la ruta de
+# un archivo de spool o dispositivo (vacío = solo descarga)
+TICKETS_IMPRESORA = ''
+TICKETS_IMPRESORA_TIMEOUT = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -127,6 +187,21 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Variantes de las imágenes subidas (lado máximo en píxeles) y calidad WebP/JPEG
+IMAGENES_TAMANOS = (96, 320, 800)
+IMAGENES_CALIDAD = 80
+# Hilos que escriben los eventos del historial marcados `segundo_plano` después
+# del commit (0 = en la misma petición; con SQLite un hilo más compite por el
+# bloqueo de escritura). Las ventas nunca van a estos hilos
+HISTORIAL_HILOS = 0
+
+# Historial y ventas con más de ARCHIVO_MESES meses se pasan a segmentos
+# mensuales comprimidos en MEDIA_ROOT/ARCHIVO_DIR (comando `archivar`)
+ARCHIVO_DIR = 'archivo'
+ARCHIVO_MESES = 12
+# Segundos que se recuerda el nombre por contenido de cada imagen del historial
+HISTORIAL_IMAGENES_CACHE_TIMEOUT = 60 * 60 * 24
 LOGIN_URL = 'iniciar_sesion'
 LOGOUT_REDIRECT_URL =  'iniciar_sesion'
 
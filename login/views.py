@@ -6,7 +6,8 @@ from django.contrib.auth.views import LoginView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.models import User
-from administracion.models import EmpresaNombre
+from administracion.empresa import obtener_empresa
+from core.grupos import pertenece_a_grupo
 
 # Create your views here.
 class CustomLoginView(LoginView):
@@ -19,14 +20,14 @@ class CustomLoginView(LoginView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["nombre"] = EmpresaNombre.objects.first()
+        context["nombre"] = obtener_empresa()
         return context
 
     def get_success_url(self):
         user = self.request.user
         if user.is_superuser:
             return reverse_lazy('lista_productos') + '?login'
-        if user.groups.filter(name='Trabajadores').exists():
+        if pertenece_a_grupo(user, 'Trabajadores'):
             return reverse_lazy('venta_list') + '?login'
         return reverse_lazy('lista_productos') + '?login'
     
@@ -1,6 +1,26 @@
 from django.contrib import admin
 
 from .models import Venta, VentaProducto
+from .services import eliminar_lineas, eliminar_ventas
 
-# Register your models here.
-admin.site.register(Venta)
+
+# Los borrados del admin (uno o la acción de borrar seleccionados) van por
+# los servicios en lote en lugar de las señales de cada línea
+@admin.register(Venta)
+class VentaAdmin(admin.ModelAdmin):
+    def delete_model(self, request, obj):
+        eliminar_ventas(Venta.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        eliminar_ventas(queryset)
+
+
+@admin.register(VentaProducto)
+class VentaProductoAdmin(admin.ModelAdmin):
+    list_display = ('venta', 'nombre_producto', 'cantidad', 'cantidad_devuelta', 'subtotal')
+
+    def delete_model(self, request, obj):
+        eliminar_lineas(VentaProducto.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        eliminar_lineas(queryset)
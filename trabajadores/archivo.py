@@ -0,0 +1,79 @@
+"""
+Archivo de las ventas cerradas (ver administracion/archivo.py).
+
+Las ventas anteriores al horizonte se guardan con sus líneas en segmentos
+mensuales y se borran de la tabla. El resumen diario (ResumenVentaDiaria) no
+se toca, así que los totales de esos meses siguen disponibles.
+"""
+import functools
+
+from django.db import transaction
+from django.utils.timezone import localtime
+
+from administracion.archivo import fin_de_mes, guardar_segmento, horizonte, meses_anteriores
+from administracion.models import SegmentoArchivo
+from .filtros import rango_fechas
+from .models import Venta, VentaProducto
+from .services import borrar_filas, despues_de_borrar
+
+
+def fila_venta(venta):
+    return {
+        'id': venta.pk,
+        'fecha': localtime(venta.fecha_creacion).isoformat(),
+        'fecha_actualizacion': localtime(venta.fecha_actualizacion).isoformat(),
+        'cliente': venta.cliente,
+        'vendedor_id': venta.vendedor_id,
+        'vendedor': venta.vendedor.username,
+        'metodo_pago': venta.metodo_pago,
+        'total': venta.total,
+        'total_devuelto': venta.total_devuelto,
+        'devolucion': venta.devolucion,
+        'lineas': [
+            {
+                'producto_id': linea.producto_id,
+                'nombre_producto': linea.nombre_producto,
+                'cantidad': linea.cantidad,
+                'precio': linea.precio,
+                'subtotal': linea.subtotal,
+                'cantidad_devuelta': linea.cantidad_devuelta,
+            }
+            for linea in venta.ventaproducto_set.all()
+        ],
+    }
+
+
+def archivar_ventas(meses=None):
+    """
+    Pasa a segmentos las ventas anteriores al horizonte, un mes a la vez.
+    Devuelve {mes: ventas archivadas}.
+    """
+    limite = horizonte(meses)
+    archivadas = {}
+    for mes in meses_anteriores(Venta.objects.all(), 'fecha_creacion', limite):
+        ventas = (
+            Venta.objects.filter(rango_fechas('fecha_creacion', mes, fin_de_mes(mes)))
+            .select_related('vendedor').prefetch_related('ventaproducto_set')
+            .order_by('-fecha_creacion', '-id')
+        )
+        ids = []
+        clientes = []
+
+        def filas():
+            for venta in ventas.iterator(chunk_size=500):
+                ids.append(venta.pk)
+                clientes.append(venta.cliente)
+                yield fila_venta(venta)
+
+        def borrar():
+            for lote in range(0, len(ids), 500):
+                parte = ids[lote:lote + 500]
+                # Sin señales: borrar una venta archivada no devuelve su stock
+                # ni ajusta el total de la venta
+                borrar_filas(VentaProducto, 'venta', parte)
+                borrar_filas(Venta, 'id', parte)
+            transaction.on_commit(functools.partial(despues_de_borrar, ids, clientes))
+
+        guardar_segmento(SegmentoArchivo.VENTAS, mes, filas(), borrar)
+        archivadas[mes] = len(ids)
+    return archivadas
@@ -0,0 +1,69 @@
+"""
+Filtros de fechas que pueden usar índices.
+
+`fecha_creacion__date` envuelve la columna en una conversión de zona horaria
+(con USE_TZ y America/Bogota), así que la base de datos no puede usar un
+índice sobre ella. Aquí los días locales se convierten en rangos semiabiertos
+[inicio, fin) de datetimes con zona, que se comparan directamente contra la
+columna guardada en UTC.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+
+
+def fecha_parametro(valor):
+    """
+    Fecha de un parámetro 'AAAA-MM-DD', o None si falta, está mal escrita o
+    no existe (parse_date lanza ValueError con fechas como 2025-02-30).
+    """
+    try:
+        return parse_date(valor or '')
+    except ValueError:
+        return None
+
+
+def inicio_dia(dia):
+    """Medianoche local del día `dia` como datetime con zona."""
+    return make_aware(datetime.combine(dia, time.min))
+
+
+def rango_fechas(campo, desde=None, hasta=None):
+    """
+    Q de los registros cuyo `campo` cae entre los días locales `desde` y
+    `hasta` (ambos incluidos). Cualquiera de los dos puede faltar.
+    """
+    condicion = Q()
+    if desde:
+        condicion &= Q(**{f'{campo}__gte': inicio_dia(desde)})
+    if hasta:
+        # Hasta la medianoche del día siguiente, sin incluirla
+        condicion &= Q(**{f'{campo}__lt': inicio_dia(hasta + timedelta(days=1))})
+    return condicion
+
+
+def filtro_parametros(parametros, campo='fecha_creacion'):
+    """
+    Q de fechas para los parámetros del reporte (ver
+    reportes.parametros_reporte): un día con 'dia' o un rango con
+    'fecha_inicio' y 'fecha_fin'. Las fechas mal escritas se ignoran.
+    """
+    if parametros.get('dia'):
+        dia = fecha_parametro(parametros['dia'])
+        return rango_fechas(campo, dia, dia)
+    return rango_fechas(
+        campo,
+        fecha_parametro(parametros.get('fecha_inicio')),
+        fecha_parametro(parametros.get('fecha_fin')),
+    )
+
+
+def sin_devolucion(campo='devolucion'):
+    """
+    Q de las ventas no devueltas. `devolucion=False` se traduce en SQLite como
+    `NOT devolucion`, que no usa el índice (devolucion, fecha_creacion);
+    con IN la columna se compara por igualdad y el índice sí sirve.
+    """
+    return Q(**{f'{campo}__in': [False]})
@@ -1,5 +1,6 @@
 from django import forms
-from .models import Venta, VentaProducto
+from django.forms import BaseInlineFormSet
+from .models import Venta, VentaProducto, Producto
 
 class VentaForm(forms.ModelForm):
     class Meta:
@@ -9,16 +10,49 @@ class VentaForm(forms.ModelForm):
             'cliente': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Nombre del cliente'}),
             'metodo_pago': forms.Select(attrs={'class': 'form-select' ,'required':'true'}),
         }
+
+class ProductoChoiceField(forms.ModelChoiceField):
+    """
+    Campo de producto que resuelve el valor desde un diccionario precargado
+    por el formset, en lugar de hacer una consulta por cada línea.
+    """
+    productos = None
+
+    def to_python(self, value):
+        if self.productos is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            return self.productos[int(value)]
+        except (KeyError, ValueError, TypeError):
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+
 class VentaProductoForm(forms.ModelForm):
+    # Se declara fuera de Meta.fields para que la validación del modelo no
+    # vuelva a consultar la llave foránea; el producto ya viene de la BD.
+    # No es obligatorio: las filas sin producto las descarta lineas().
+    producto = ProductoChoiceField(queryset=Producto.objects.all(), required=False)
+
     class Meta:
         model = VentaProducto
-        fields = ['producto', 'cantidad']
+        fields = ['cantidad']
+
+    def __init__(self, *args, productos=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['producto'].productos = productos
 
     def clean(self):
         cleaned_data = super().clean()
         producto = cleaned_data.get('producto')
         cantidad = cleaned_data.get('cantidad')
 
+        if not producto and 'producto' not in self.errors:
+            # Fila vacía: no se valida la cantidad, el formset la ignora
+            return cleaned_data
+
         if cantidad is None:
             raise forms.ValidationError("Debe ingresar una cantidad para cada producto.")
 
@@ -32,3 +66,43 @@ class VentaProductoForm(forms.ModelForm):
                 )
 
         return cleaned_data
+
+class BaseVentaProductoFormSet(BaseInlineFormSet):
+    """Formset que carga todos los productos enviados con una sola consulta."""
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['productos'] = self.productos_enviados()
+        return kwargs
+
+    def productos_enviados(self):
+        if not self.is_bound:
+            return None
+        if not hasattr(self, '_productos_enviados'):
+            ids = set()
+            for i in range(self.total_form_count()):
+                valor = self.data.get(f'{self.add_prefix(i)}-producto')
+                if valor and str(valor).isdigit():
+                    ids.add(int(valor))
+            self._productos_enviados = Producto.objects.in_bulk(ids) if ids else {}
+        return self._productos_enviados
+
+    def lineas(self):
+        """Devuelve las líneas válidas como tuplas (producto, cantidad)."""
+        return [
+            (form.cleaned_data['producto'], form.cleaned_data['cantidad'])
+            for form in self.forms
+            if form.cleaned_data.get('producto')
+        ]
+
+    def agregar_conflictos(self, conflictos):
+        """Marca en cada línea el stock que quedó disponible al momento de cobrar."""
+        for form in self.forms:
+            producto = form.cleaned_data.get('producto')
+            if producto and producto.pk in conflictos:
+                form.add_error('cantidad', (
+                    f"No hay suficiente stock para {producto.nombre}. "
+                    f"Stock disponible: {conflictos[producto.pk]}."
+                ))
+        if not conflictos:
+            self.non_form_errors().append("El stock cambió mientras se registraba la venta. Intente de nuevo.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from trabajadores.trabajos import limpiar_reportes_vencidos
+
+
+class Command(BaseCommand):
+    help = "Elimina los reportes en segundo plano (y sus archivos) más antiguos que REPORTES_TTL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help="Segundos de vigencia; por defecto REPORTES_TTL.")
+
+    def handle(self, *args, **options):
+        eliminados = limpiar_reportes_vencidos(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f"{eliminados} reporte(s) eliminado(s)."))
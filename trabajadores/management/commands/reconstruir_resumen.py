@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from trabajadores.resumen import reconstruir
+
+
+class Command(BaseCommand):
+    help = "Vuelve a calcular el resumen diario de ventas (ResumenVentaDiaria) desde las ventas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help="Filas insertadas por consulta (por defecto 1000).")
+
+    def handle(self, *args, **options):
+        creadas = reconstruir(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Resumen reconstruido: {creadas} fila(s)."))
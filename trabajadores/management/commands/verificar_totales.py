@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from trabajadores.models import Venta, VentaProducto
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el total y el total devuelto de cada venta con la suma de sus "
+        "productos y, con --reparar, corrige las diferencias."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true', help="Corrige los totales que no coinciden.")
+        parser.add_argument('--lote', type=int, default=1000, help="Ventas revisadas por consulta (por defecto 1000).")
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        reparar = options['reparar']
+
+        # Sumas de las líneas de cada venta, calculadas en la misma consulta del lote
+        def suma_lineas(expresion):
+            return Coalesce(
+                Subquery(
+                    VentaProducto.objects.filter(venta=OuterRef('pk'))
+                    .order_by()
+                    .values('venta')
+                    .annotate(suma=Sum(expresion))
+                    .values('suma')
+                ),
+                Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+
+        ventas = Venta.objects.annotate(
+            calculado=suma_lineas('subtotal'),
+            devuelto=suma_lineas(F('cantidad_devuelta') * F('precio')),
+        ).order_by('pk')
+
+        revisadas = 0
+        diferencias = []
+        ultimo_id = 0
+        while True:
+            filas = list(
+                ventas.filter(pk__gt=ultimo_id)
+                .values_list('pk', 'total', 'calculado', 'total_devuelto', 'devuelto')[:lote]
+            )
+            if not filas:
+                break
+            ultimo_id = filas[-1][0]
+            revisadas += len(filas)
+
+            erroneas = []
+            for pk, total, calculado, total_devuelto, devuelto in filas:
+                if total != calculado:
+                    self.stdout.write(self.style.WARNING(
+                        f"Venta #{pk}: total guardado {total}, suma de productos {calculado}"
+                    ))
+                if total_devuelto != devuelto:
+                    self.stdout.write(self.style.WARNING(
+                        f"Venta #{pk}: total devuelto guardado {total_devuelto}, suma de lo devuelto {devuelto}"
+                    ))
+                if total != calculado or total_devuelto != devuelto:
+                    erroneas.append(Venta(pk=pk, total=calculado, total_devuelto=devuelto))
+            if erroneas and reparar:
+                Venta.objects.bulk_update(erroneas, ['total', 'total_devuelto'], batch_size=lote)
+            diferencias.extend(erroneas)
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS(f"{revisadas} ventas revisadas, todos los totales coinciden."))
+        elif reparar:
+            self.stdout.write(self.style.SUCCESS(
+                f"{revisadas} ventas revisadas, {len(diferencias)} totales corregidos."
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{revisadas} ventas revisadas, {len(diferencias)} con diferencias. "
+                "Ejecute con --reparar para corregirlas."
+            ))
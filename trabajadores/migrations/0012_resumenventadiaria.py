@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def llenar_resumen(apps, schema_editor):
+    # El resumen se llena en 0014: resumen.reconstruir ya usa columnas
+    # agregadas después de esta migración
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0014_busqueda_fts'),
+        ('trabajadores', '0011_reportejob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenVentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('metodo_pago', models.CharField(choices=[('efectivo', 'Efectivo'), ('tarjeta', 'Tarjeta'), ('transferencia', 'Transferencia')], max_length=20)),
+                ('unidades', models.IntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('ventas', models.IntegerField(default=0)),
+                ('producto', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='administracion.producto')),
+                ('vendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('producto__isnull', False)), fields=('fecha', 'vendedor', 'metodo_pago', 'producto'), name='resumen_diario_por_producto'), models.UniqueConstraint(condition=models.Q(('producto__isnull', True)), fields=('fecha', 'vendedor', 'metodo_pago'), name='resumen_diario_por_venta')],
+            },
+        ),
+        migrations.RunPython(llenar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0014_busqueda_fts'),
+        ('trabajadores', '0012_resumenventadiaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['devolucion', 'fecha_creacion'], name='venta_devolucion_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['vendedor', 'fecha_creacion'], name='venta_vendedor_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['metodo_pago', 'fecha_creacion'], name='venta_metodo_pago_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='ventaproducto',
+            index=models.Index(fields=['producto', 'venta'], name='ventaproducto_producto_venta'),
+        ),
+    ]
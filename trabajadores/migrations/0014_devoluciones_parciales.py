@@ -0,0 +1,46 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def marcar_devueltas(apps, schema_editor):
+    # Antes solo existían devoluciones completas
+    Venta = apps.get_model('trabajadores', 'Venta')
+    VentaProducto = apps.get_model('trabajadores', 'VentaProducto')
+    VentaProducto.objects.filter(venta__devolucion=True).update(cantidad_devuelta=F('cantidad'))
+    Venta.objects.filter(devolucion=True).update(total_devuelto=F('total'))
+
+
+def llenar_resumen(apps, schema_editor):
+    from trabajadores.resumen import meses_archivados, reconstruir
+    # Los meses archivados no tienen ventas en la tabla: su resumen se conserva
+    reconstruir(
+        apps.get_model('trabajadores', 'Venta'),
+        apps.get_model('trabajadores', 'VentaProducto'),
+        apps.get_model('trabajadores', 'ResumenVentaDiaria'),
+        archivados=meses_archivados(apps.get_model('administracion', 'SegmentoArchivo')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trabajadores', '0013_indices_ventas'),
+        ('administracion', '0017_segmentos_archivo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venta',
+            name='total_devuelto',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='ventaproducto',
+            name='cantidad_devuelta',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(marcar_devueltas, migrations.RunPython.noop),
+        migrations.RunPython(llenar_resumen, migrations.RunPython.noop),
+    ]
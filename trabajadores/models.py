@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models import F, Sum
 from django.contrib.auth.models import User
 from administracion.models import Producto
+from .stock import reservar_stock
 
 class Venta(models.Model):
     METODO_PAGO_CHOICES = [
@@ -26,14 +28,53 @@ class Venta(models.Model):
         User, on_delete=models.SET_NULL, null=True, blank=True, related_name='ventas_actualizadas'
     )
     devolucion = models.BooleanField(default=False) 
+    # Suma de lo devuelto (devoluciones parciales o completas); el total
+    # cobrado es total - total_devuelto
+    total_devuelto = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        # Los filtros del reporte y de las listas combinan una igualdad con un
+        # rango de fecha_creacion (ver filtros.py)
+        indexes = [
+            models.Index(fields=['devolucion', 'fecha_creacion'], name='venta_devolucion_fecha'),
+            models.Index(fields=['vendedor', 'fecha_creacion'], name='venta_vendedor_fecha'),
+            models.Index(fields=['metodo_pago', 'fecha_creacion'], name='venta_metodo_pago_fecha'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Cliente en la BD, para las sugerencias (core.sugerencias.vigilar)
+        instancia._cliente_guardado = instancia.__dict__.get('cliente')
+        return instancia
 
     def __str__(self):
         return f"Venta #{self.id} - {self.cliente}"
 
+    @property
+    def total_neto(self):
+        return self.total - self.total_devuelto
+
     def actualizar_total(self):
-        self.total = sum(item.subtotal for item in self.ventaproducto_set.all())
+        # Recalcula el total desde cero; el día a día lo mantiene
+        # VentaProducto con ajustes incrementales (ver ajustar_total).
+        self.total = self.ventaproducto_set.aggregate(total=Sum('subtotal'))['total'] or 0
         self.save(update_fields=['total'])
 
+    @classmethod
+    def ajustar_total(cls, venta_id, diferencia, devuelto=0):
+        """
+        Suma `diferencia` al total de la venta (y `devuelto` a total_devuelto)
+        con un UPDATE atómico.
+        """
+        cambios = {}
+        if diferencia:
+            cambios['total'] = F('total') + diferencia
+        if devuelto:
+            cambios['total_devuelto'] = F('total_devuelto') + devuelto
+        if cambios:
+            cls.objects.filter(pk=venta_id).update(**cambios)
+
     def save(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         if not self.pk and user:
@@ -43,6 +84,10 @@ class Venta(models.Model):
         super().save(*args, **kwargs)
 
 
+# Campos de una línea que cuentan en el resumen diario (ver resumen.ajustar_linea)
+CAMPOS_RESUMEN = ('venta_id', 'producto_id', 'cantidad', 'cantidad_devuelta', 'precio')
+
+
 class VentaProducto(models.Model):
     venta = models.ForeignKey(
         Venta, 
@@ -64,6 +109,24 @@ class VentaProducto(models.Model):
     cantidad = models.PositiveIntegerField(default=1)
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    # Unidades de la línea ya devueltas (ver services.devolver_venta)
+    cantidad_devuelta = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Ventas de un producto sin leer la tabla de líneas
+            models.Index(fields=['producto', 'venta'], name='ventaproducto_producto_venta'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Subtotal guardado en la BD, para ajustar el total de la venta por diferencia
+        instancia._subtotal_guardado = instancia.__dict__.get('subtotal')
+        # Lo que la línea aporta al resumen diario, para ajustarlo igual
+        if all(campo in instancia.__dict__ for campo in CAMPOS_RESUMEN):
+            instancia._resumen_guardado = tuple(instancia.__dict__[campo] for campo in CAMPOS_RESUMEN)
+        return instancia
 
     def save(self, *args, **kwargs):
         # Si existe un producto y no se ha asignado el nombre, lo copiamos.
@@ -78,13 +141,118 @@ class VentaProducto(models.Model):
         self.subtotal = self.cantidad * self.precio
 
         # Si es un registro nuevo (no existe self.pk) y el producto no es None,
-        # descontamos el stock del producto.
+        # descontamos el stock del producto con un UPDATE condicional.
         if not self.pk and self.producto:
-            self.producto.cantidad -= self.cantidad
-            self.producto.save()
+            reservar_stock({self.producto_id: self.cantidad})
 
+        anterior = 0 if self._state.adding else self.subtotal_guardado()
+        resumen_anterior = None if self._state.adding else self.resumen_guardado()
         super().save(*args, **kwargs)
-        self.venta.actualizar_total()
+        self._subtotal_guardado = self.subtotal
+
+        # El total de la venta se ajusta solo por la diferencia de esta línea
+        diferencia = self.subtotal - anterior
+        Venta.ajustar_total(self.venta_id, diferencia)
+        if diferencia and self._meta.get_field('venta').is_cached(self):
+            self.venta.total += diferencia
+
+        # Y el resumen diario, también por diferencia (import local: resumen
+        # importa este módulo)
+        from .resumen import ajustar_linea
+        self._resumen_guardado = tuple(getattr(self, campo) for campo in CAMPOS_RESUMEN)
+        ajustar_linea(self, resumen_anterior)
+
+    def subtotal_guardado(self):
+        subtotal = getattr(self, '_subtotal_guardado', None)
+        if subtotal is None:
+            subtotal = VentaProducto.objects.filter(pk=self.pk).values_list('subtotal', flat=True).first() or 0
+        return subtotal
+
+    def resumen_guardado(self):
+        """Valores de CAMPOS_RESUMEN en la BD, o None si la línea no existe."""
+        guardado = getattr(self, '_resumen_guardado', None)
+        if guardado is None:
+            guardado = VentaProducto.objects.filter(pk=self.pk).values_list(*CAMPOS_RESUMEN).first()
+        return guardado
+
+    @property
+    def pendiente(self):
+        """Unidades que aún se pueden devolver."""
+        return self.cantidad - self.cantidad_devuelta
 
     def __str__(self):
         return f"{self.cantidad}x {self.nombre_producto}"
+
+
+class ReporteJob(models.Model):
+    """Reporte de ventas en PDF generado en segundo plano (ver trabajos.py)."""
+    PENDIENTE = 'pendiente'
+    PROCESANDO = 'procesando'
+    TERMINADO = 'terminado'
+    ERROR = 'error'
+    ESTADO_CHOICES = [
+        (PENDIENTE, 'Pendiente'),
+        (PROCESANDO, 'Procesando'),
+        (TERMINADO, 'Terminado'),
+        (ERROR, 'Error'),
+    ]
+
+    # Hash de los filtros, del alcance del usuario y de la versión de los
+    # datos: dos pedidos iguales comparten el mismo trabajo.
+    clave = models.CharField(max_length=64, db_index=True)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reportes')
+    parametros = models.JSONField(default=dict)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=PENDIENTE)
+    ventas_totales = models.PositiveIntegerField(default=0)
+    ventas_procesadas = models.PositiveIntegerField(default=0)
+    paginas = models.PositiveIntegerField(default=0)
+    archivo = models.FileField(upload_to='reportes/', blank=True, null=True)
+    nombre_archivo = models.CharField(max_length=100)
+    error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Reporte #{self.id} - {self.get_estado_display()}"
+
+    @property
+    def activo(self):
+        return self.estado in (self.PENDIENTE, self.PROCESANDO)
+
+
+class ResumenVentaDiaria(models.Model):
+    """
+    Totales por día, vendedor, método de pago y producto de las ventas no
+    devueltas. La fila con producto vacío acumula la venta completa (todas
+    sus líneas); las demás, solo las líneas de ese producto. Se mantiene en
+    la misma transacción de la venta y de la devolución (ver resumen.py) y
+    se reconstruye con `manage.py reconstruir_resumen`.
+    """
+    fecha = models.DateField()
+    vendedor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    metodo_pago = models.CharField(max_length=20, choices=Venta.METODO_PAGO_CHOICES)
+    # Sin llave foránea real: el resumen conserva el producto aunque se elimine
+    producto = models.ForeignKey(
+        Producto, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    unidades = models.IntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    ventas = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fecha', 'vendedor', 'metodo_pago', 'producto'],
+                condition=models.Q(producto__isnull=False),
+                name='resumen_diario_por_producto',
+            ),
+            models.UniqueConstraint(
+                fields=['fecha', 'vendedor', 'metodo_pago'],
+                condition=models.Q(producto__isnull=True),
+                name='resumen_diario_por_venta',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} - {self.vendedor_id} - {self.metodo_pago} - {self.producto_id or 'total'}"
@@ -0,0 +1,300 @@
+"""
+Reporte de ventas en PDF con memoria acotada.
+
+Las ventas se leen por lotes con `iterator(chunk_size=...)` (las líneas se
+consultan lote por lote) y el PDF se escribe en un archivo temporal
+que solo pasa a disco cuando supera REPORTE_MEMORIA_MAXIMA. La vista lo
+devuelve con un FileResponse que lo envía por bloques, así que ni las ventas
+ni el PDF completo quedan en memoria a la vez.
+"""
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Min
+from django.utils.timezone import localdate, localtime
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from administracion.empresa import obtener_empresa
+from .filtros import filtro_parametros, sin_devolucion
+from .models import Venta, VentaProducto
+
+
+# Parámetros del formulario de exportación que filtran el reporte
+CAMPOS_FILTRO = ('fecha_inicio', 'fecha_fin', 'vendedor', 'producto', 'metodo_pago')
+
+
+def parametros_reporte(datos):
+    """
+    Filtros del reporte tomados de `datos` (request.GET o request.POST), sin
+    valores vacíos. Sin fechas el reporte es el del día, que queda fijo en
+    'dia' para que no cambie si se genera más tarde.
+    """
+    parametros = {campo: datos.get(campo) for campo in CAMPOS_FILTRO if datos.get(campo)}
+    if 'fecha_inicio' not in parametros and 'fecha_fin' not in parametros:
+        parametros['dia'] = localdate().isoformat()
+    return parametros
+
+
+def filtrar_ventas(usuario, parametros):
+    """Ventas que entran en el reporte según el usuario y los parámetros."""
+    queryset = Venta.objects.filter(sin_devolucion())
+    if not usuario.is_superuser:
+        queryset = queryset.filter(vendedor=usuario)
+
+    # "Ventas del Día" o "Ventas por Rango de Fechas", como rango de datetimes
+    # para que se use el índice sobre fecha_creacion
+    queryset = queryset.filter(filtro_parametros(parametros))
+
+    # Filtrado por vendedor
+    vendedor_id = parametros.get('vendedor')
+    if vendedor_id:
+        queryset = queryset.filter(vendedor_id=vendedor_id)
+
+    # Filtrado por producto: subconsulta sobre el índice (producto, venta)
+    # en lugar de un JOIN con DISTINCT
+    producto_id = parametros.get('producto')
+    if producto_id:
+        queryset = queryset.filter(
+            pk__in=VentaProducto.objects.filter(producto_id=producto_id).values('venta_id')
+        )
+
+    # Filtrado por método de pago
+    metodo_pago = parametros.get('metodo_pago')
+    if metodo_pago:
+        queryset = queryset.filter(metodo_pago=metodo_pago)
+
+    return queryset.select_related('vendedor')
+
+
+def nombre_reporte(parametros):
+    if parametros.get('dia'):
+        return f"ventas_{parametros['dia']}.pdf"
+    today = localdate().isoformat()
+    fecha_inicio = parametros.get('fecha_inicio', today)
+    fecha_fin = parametros.get('fecha_fin', today)
+    return f"ventas_{fecha_inicio}_a_{fecha_fin}.pdf"
+
+
+def resumen_ventas(queryset):
+    """
+    Primera y última fecha, cantidad de ventas y última modificación, en una
+    sola consulta.
+    """
+    return queryset.order_by().aggregate(
+        primera=Min('fecha_creacion'),
+        ultima=Max('fecha_creacion'),
+        cantidad=Count('pk', distinct=True),
+        modificada=Max('fecha_actualizacion'),
+    )
+
+
+def ventas_por_lotes(queryset, lote=None):
+    """
+    Recorre las ventas junto con sus productos sin cargar más de `lote` a la
+    vez: genera pares (venta, [(cantidad, nombre_producto), ...]). La
+    cantidad es la que quedó vendida: sin las unidades devueltas.
+
+    Las líneas se traen con una consulta por lote. No se usa
+    prefetch_related porque las referencias cruzadas entre ventas y líneas
+    forman ciclos que el recolector libera tarde y la memoria crece con el
+    tamaño del reporte.
+    """
+    lote = lote or getattr(settings, 'REPORTE_LOTE_VENTAS', 500)
+    ventas = (
+        queryset.select_related('vendedor')
+        .order_by('fecha_creacion', 'id')
+        .iterator(chunk_size=lote)
+    )
+    while True:
+        bloque = list(islice(ventas, lote))
+        if not bloque:
+            break
+        productos = defaultdict(list)
+        filas = (
+            VentaProducto.objects.filter(
+                venta_id__in=[venta.pk for venta in bloque], cantidad_devuelta__lt=F('cantidad')
+            )
+            .order_by('id')
+            .values_list('venta_id', F('cantidad') - F('cantidad_devuelta'), 'nombre_producto')
+        )
+        for venta_id, cantidad, nombre in filas:
+            productos[venta_id].append((cantidad, nombre))
+        for venta in bloque:
+            yield venta, productos.get(venta.pk, [])
+
+
+def format_price(price):
+    price = float(price)
+    if price % 1 == 0:
+        return f"${int(price):,}"
+    else:
+        return f"${price:,.2f}"
+
+
+def truncate_text(text, max_length):
+    """Trunca el texto si excede la longitud máxima, añadiendo '...'."""
+    return text[:max_length - 3] + '...' if len(text) > max_length else text
+
+
+def escribir_reporte_ventas(destino, ventas, resumen, empresa=None, progreso=None):
+    """
+    Dibuja el reporte en `destino` (un archivo abierto en modo binario).
+    `ventas` es un iterable de pares (venta, productos) como los de
+    ventas_por_lotes; se recorre una sola vez. Si se pasa `progreso`, se
+    llama con (ventas dibujadas, páginas) al cerrar cada página.
+    """
+    dibujadas = 0
+    pdf = canvas.Canvas(destino, pagesize=letter, pageCompression=1)
+    width, height = letter
+    page_number = 1
+
+    # Configuración de dimensiones
+    row_height = 25
+    margin_bottom = 80
+    line_height = 15
+
+    # Estilos centralizados
+    styles = {
+        'title': {'font': 'Helvetica-Bold', 'size': 18, 'color': (0.2, 0.4, 0.6)},
+        'header': {'font': 'Helvetica-Bold', 'size': 12, 'color': (1, 1, 1)},
+        'body': {'font': 'Helvetica', 'size': 10, 'color': (0.2, 0.2, 0.2)},
+        'accent': {'color': (0.2, 0.4, 0.6)},
+        'row_color': (0.95, 0.95, 0.95),
+        'footer_font': {'font': 'Helvetica', 'size': 8, 'color': (0.4, 0.4, 0.4)}
+    }
+
+    # El rango llega como fechas (del resumen diario) o como fechas y horas
+    min_date, max_date = resumen['primera'], resumen['ultima']
+    if isinstance(min_date, datetime):
+        min_date, max_date = localtime(min_date).date(), localtime(max_date).date()
+    date_range = (min_date.strftime("%d/%m/%Y") if min_date == max_date
+                  else f"{min_date.strftime('%d/%m/%Y')} al {max_date.strftime('%d/%m/%Y')}")
+
+    def draw_header():
+        """Dibuja el encabezado del PDF."""
+        y = height - 50
+        pdf.setFont(styles['title']['font'], styles['title']['size'])
+        pdf.setFillColorRGB(*styles['title']['color'])
+        pdf.drawString(40, y, f"Reporte de Ventas Detallado para {date_range}")
+        y -= 20
+        pdf.setFont(styles['body']['font'], styles['body']['size'])
+        pdf.setFillColorRGB(*styles['body']['color'])
+        pdf.drawString(40, y, f"Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+        y -= 10
+        pdf.line(40, y, width - 40, y)
+        return y - 15
+
+    def draw_footer():
+        """Dibuja el pie de página del PDF."""
+        pdf.setFont(styles['footer_font']['font'], styles['footer_font']['size'])
+        pdf.setFillColorRGB(*styles['footer_font']['color'])
+        if empresa and empresa.nombre:
+            pdf.drawCentredString(width / 2, 30, f"Página {page_number} - Sistema de Inventario {empresa.nombre}")
+        else:
+            pdf.drawCentredString(width / 2, 30, f"Página {page_number} - Sistema de Inventario ")
+        pdf.line(40, 40, width - 40, 40)
+
+    def draw_table_header(y):
+        """Dibuja el encabezado de la tabla."""
+        pdf.setFillColorRGB(*styles['accent']['color'])
+        pdf.rect(40, y - row_height, width - 80, row_height, fill=1)
+        pdf.setFont(styles['header']['font'], styles['header']['size'])
+        pdf.setFillColorRGB(*styles['header']['color'])
+        headers = ["ID", "Cliente", "Vendedor", "Productos", "Pago", "Total", "Fecha"]
+        x_positions = [50, 100, 170, 250, 350, 425, 510]
+        for i, header in enumerate(headers):
+            pdf.drawString(x_positions[i], y - (row_height / 1.5), header)
+        return y - row_height
+
+    # Inicio del contenido
+    y_position = draw_table_header(draw_header())
+    total_ventas = 0
+
+    for venta, productos in ventas:
+        productos_lista = [
+            f"{cantidad}x {nombre if nombre else 'Producto eliminado'}"
+            for cantidad, nombre in productos]
+
+        num_productos = len(productos_lista)
+        row_height_adjusted = row_height + (num_productos - 1) * line_height
+
+        # Verificar espacio suficiente o iniciar nueva página
+        if y_position < margin_bottom + row_height_adjusted:
+            draw_footer()
+            pdf.showPage()
+            if progreso:
+                progreso(dibujadas, page_number)
+            page_number += 1
+            y_position = draw_table_header(draw_header())
+
+        # Dibujar fila de la venta
+        pdf.setFillColorRGB(*styles['row_color'])
+        pdf.rect(40, y_position - row_height_adjusted, width - 80, row_height_adjusted, fill=1)
+        pdf.setFont(styles['body']['font'], styles['body']['size'])
+        pdf.setFillColorRGB(*styles['body']['color'])
+
+        pdf.drawString(50, y_position - 15, str(venta.id))
+        pdf.drawString(100, y_position - 15, truncate_text(str(venta.cliente), 18))
+        pdf.drawString(170, y_position - 15, truncate_text(venta.vendedor.username, 10))
+        pdf.drawString(350, y_position - 15, truncate_text(str(venta.metodo_pago), 10))
+        pdf.drawRightString(460, y_position - 15, format_price(venta.total_neto))
+
+        pdf.drawString(490, y_position - 15, localtime(venta.fecha_creacion).strftime("%d/%m/%Y %H:%M"))
+
+        # Dibujar lista de productos
+        for i, product in enumerate(productos_lista):
+            pdf.drawString(250, y_position - 13 - i * line_height, truncate_text(product, 16))
+
+        total_ventas += venta.total_neto
+        dibujadas += 1
+        pdf.line(40, y_position - row_height_adjusted, width - 40, y_position - row_height_adjusted)
+        y_position -= row_height_adjusted
+
+    # Asegurar espacio para el total general
+    if y_position < margin_bottom + 40:
+        draw_footer()
+        pdf.showPage()
+        page_number += 1
+        y_position = draw_table_header(draw_header())
+
+    # Dibujar total general
+    pdf.setFont(styles['header']['font'], 14)
+    total_text = f"TOTAL GENERAL: {format_price(total_ventas)}"
+    text_width = pdf.stringWidth(total_text, styles['header']['font'], 14)
+    y_position -= 40
+    pdf.setFillColorRGB(*styles['accent']['color'])
+    pdf.rect(width - 40 - (text_width + 20), y_position, text_width + 20, 30, fill=1)
+    pdf.setFillColorRGB(1, 1, 1)
+    pdf.drawRightString(width - 40 - 10, y_position + 8, total_text)
+
+    # Finalizar el PDF
+    draw_footer()
+    pdf.save()
+    if progreso:
+        progreso(dibujadas, page_number)
+
+
+def generar_reporte_ventas(queryset, resumen=None, lote=None, progreso=None):
+    """
+    Genera el reporte de `queryset` y devuelve el archivo temporal listo para
+    leer desde el inicio, o None si no hay ventas.
+    """
+    resumen = resumen or resumen_ventas(queryset)
+    if not resumen['cantidad']:
+        return None
+    archivo = SpooledTemporaryFile(
+        max_size=getattr(settings, 'REPORTE_MEMORIA_MAXIMA', 5 * 1024 * 1024), mode='w+b'
+    )
+    try:
+        escribir_reporte_ventas(
+            archivo, ventas_por_lotes(queryset, lote), resumen, obtener_empresa(), progreso
+        )
+    except Exception:
+        archivo.close()
+        raise
+    archivo.seek(0)
+    return archivo
@@ -0,0 +1,371 @@
+"""
+Mantenimiento y consulta de ResumenVentaDiaria.
+
+Cada venta suma (y cada devolución resta) en una fila por producto y en la
+fila total del día (producto vacío) con dos sentencias fijas: un INSERT ...
+ON CONFLICT DO UPDATE para las filas de producto y otro para la fila total,
+así la transacción del cobro retiene poco el bloqueo de escritura. Las bases
+sin ese upsert usan tres consultas: un INSERT OR IGNORE de las filas que
+falten, un SELECT de sus ids y un único UPDATE con CASE. Así los reportes
+que solo necesitan totales o saber si hay ventas recorren días en lugar de
+ventas.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.timezone import localdate
+
+from administracion.archivo import fin_de_mes
+from administracion.models import SegmentoArchivo
+from .filtros import fecha_parametro, rango_fechas
+from .models import ResumenVentaDiaria, Venta, VentaProducto
+
+
+def diferencias(lineas, signo=1, cerradas=None):
+    """
+    {producto_id o None: [unidades, ingresos, ventas]} de una venta a partir
+    de sus líneas (producto_id, cantidad, subtotal). None es la fila total.
+
+    `cerradas` son las filas cuyo conteo de ventas cambia (todas si es
+    None): en una devolución parcial la venta sigue contando para el día y
+    para los productos que no se devolvieron completos.
+    """
+    filas = defaultdict(lambda: [0, Decimal('0'), 0])
+    # La fila total siempre está, aunque la venta ya no tenga líneas
+    filas[None]
+    for producto_id, cantidad, subtotal in lineas:
+        total = filas[None]
+        total[0] += signo * cantidad
+        total[1] += signo * subtotal
+        # Una línea sin producto (eliminado) solo cuenta en el total del día
+        if producto_id is not None:
+            fila = filas[producto_id]
+            fila[0] += signo * cantidad
+            fila[1] += signo * subtotal
+    for clave, fila in filas.items():
+        if cerradas is None or clave in cerradas:
+            fila[2] = signo
+    return filas
+
+
+def aplicar_venta(venta, lineas, signo=1, cerradas=None):
+    """
+    Suma (signo=1) o resta (signo=-1) la venta en el resumen. Debe llamarse
+    dentro de la transacción que guarda la venta o la devolución.
+    """
+    filas = diferencias(lineas, signo, cerradas)
+    clave = {
+        'fecha': localdate(venta.fecha_creacion),
+        'vendedor_id': venta.vendedor_id,
+        'metodo_pago': venta.metodo_pago,
+    }
+    if connection.features.supports_update_conflicts_with_target:
+        productos = {producto_id: valores for producto_id, valores in filas.items() if producto_id is not None}
+        sumar_filas(clave, productos, por_producto=True)
+        sumar_filas(clave, {None: filas[None]}, por_producto=False)
+        return
+    ResumenVentaDiaria.objects.bulk_create(
+        [ResumenVentaDiaria(producto_id=producto_id, **clave) for producto_id in filas],
+        ignore_conflicts=True,
+    )
+    productos = [producto_id for producto_id in filas if producto_id is not None]
+    ids = dict(
+        ResumenVentaDiaria.objects.filter(**clave)
+        .filter(Q(producto__in=productos) | Q(producto__isnull=True))
+        .values_list('producto_id', 'pk')
+    )
+
+    def caso(indice, campo):
+        return Case(
+            *[When(pk=ids[producto_id], then=F(campo) + Value(valores[indice]))
+              for producto_id, valores in filas.items()],
+            default=F(campo),
+        )
+
+    ResumenVentaDiaria.objects.filter(pk__in=ids.values()).update(
+        unidades=caso(0, 'unidades'),
+        ingresos=caso(1, 'ingresos'),
+        ventas=caso(2, 'ventas'),
+    )
+
+
+def ajustar_linea(linea, anterior=None):
+    """
+    Lleva al resumen el cambio de una línea guardada con save() (por ejemplo
+    desde el admin): resta lo que aportaba `anterior` (los CAMPOS_RESUMEN que
+    tenía en la BD, None si es nueva) y suma lo que aporta ahora. La venta
+    cuenta en la fila de un producto mientras tenga alguna línea pendiente de
+    él; la fila total del día no cambia su conteo.
+    """
+    actual = (linea.venta_id, linea.producto_id, linea.cantidad, linea.cantidad_devuelta, linea.precio)
+    if anterior == actual:
+        return
+    for estado, signo in ((anterior, -1), (actual, 1)):
+        if estado is None:
+            continue
+        venta_id, producto_id, cantidad, devuelta, precio = estado
+        pendiente = cantidad - devuelta
+        if pendiente <= 0:
+            continue
+        venta = linea.venta if venta_id == linea.venta_id else Venta.objects.get(pk=venta_id)
+        if venta.devolucion:
+            continue
+        cerradas = set()
+        if producto_id is not None and not (
+            VentaProducto.objects.filter(venta_id=venta_id, producto_id=producto_id, cantidad_devuelta__lt=F('cantidad'))
+            .exclude(pk=linea.pk).exists()
+        ):
+            cerradas.add(producto_id)
+        aplicar_venta(venta, [(producto_id, pendiente, pendiente * precio)], signo, cerradas)
+
+
+def sumar_filas(clave, filas, por_producto):
+    """
+    Suma `filas` ({producto_id: [unidades, ingresos, ventas]}) en las filas
+    del resumen de `clave` con un solo INSERT ... ON CONFLICT DO UPDATE: crea
+    las que falten y acumula en las demás. El destino del conflicto es el
+    índice único parcial de las filas por producto o el de la fila total.
+    """
+    if not filas:
+        return
+    opciones = ResumenVentaDiaria._meta
+    tabla = connection.ops.quote_name(opciones.db_table)
+    columna = {campo: connection.ops.quote_name(opciones.get_field(campo).column) for campo in (
+        'fecha', 'vendedor', 'metodo_pago', 'producto', 'unidades', 'ingresos', 'ventas'
+    )}
+    unicos = ['fecha', 'vendedor', 'metodo_pago'] + (['producto'] if por_producto else [])
+    condicion = 'IS NOT NULL' if por_producto else 'IS NULL'
+    sumas = ', '.join(
+        f"{columna[campo]} = {tabla}.{columna[campo]} + excluded.{columna[campo]}"
+        for campo in ('unidades', 'ingresos', 'ventas')
+    )
+    fecha = connection.ops.adapt_datefield_value(clave['fecha'])
+    parametros = []
+    for producto_id, (unidades, ingresos, ventas) in filas.items():
+        parametros += [
+            fecha, clave['vendedor_id'], clave['metodo_pago'], producto_id, unidades,
+            connection.ops.adapt_decimalfield_value(ingresos, 14, 2), ventas,
+        ]
+    sql = (
+        f"INSERT INTO {tabla} ({', '.join(columna.values())}) "
+        f"VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(filas))} "
+        f"ON CONFLICT ({', '.join(columna[campo] for campo in unicos)}) WHERE {columna['producto']} {condicion} "
+        f"DO UPDATE SET {sumas}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+
+
+def pendientes_por_venta(ventas_ids):
+    """{venta_id: [(producto_id, unidades, subtotal), ...]} de lo que aún no se devolvió."""
+    lineas = defaultdict(list)
+    filas = (
+        VentaProducto.objects.filter(venta_id__in=ventas_ids, cantidad_devuelta__lt=F('cantidad'))
+        .order_by().values_list('venta_id', 'producto_id', F('cantidad') - F('cantidad_devuelta'), 'precio')
+    )
+    for venta_id, producto_id, unidades, precio in filas:
+        lineas[venta_id].append((producto_id, unidades, unidades * precio))
+    return lineas
+
+
+def quitar_ventas(ventas, lote=500):
+    """
+    Resta del resumen las ventas que se van a borrar (con sus líneas aún en
+    la tabla): solo lo que no se había devuelto. Las ya devueltas por
+    completo no cuentan desde su devolución.
+    """
+    ventas = [venta for venta in ventas if not venta.devolucion]
+    for inicio in range(0, len(ventas), lote):
+        bloque = ventas[inicio:inicio + lote]
+        lineas = pendientes_por_venta([venta.pk for venta in bloque])
+        for venta in bloque:
+            aplicar_venta(venta, lineas.get(venta.pk, []), signo=-1)
+
+
+def quitar_lineas(lineas):
+    """
+    Resta del resumen las líneas ya borradas (instancias con su venta), cuya
+    venta sigue existiendo: lo que no se había devuelto y, en la fila de
+    cada producto, la venta si ya no le queda otra línea pendiente de ese
+    producto. La venta sigue contando en la fila total del día.
+    """
+    por_venta = defaultdict(list)
+    for linea in lineas:
+        if linea.pendiente and not linea.venta.devolucion:
+            por_venta[linea.venta_id].append(linea)
+    if not por_venta:
+        return
+    quedan = set(
+        VentaProducto.objects.filter(
+            venta_id__in=list(por_venta), producto__isnull=False, cantidad_devuelta__lt=F('cantidad')
+        ).order_by().values_list('venta_id', 'producto_id')
+    )
+    for venta_id, grupo in por_venta.items():
+        cerradas = {
+            linea.producto_id for linea in grupo
+            if linea.producto_id is not None and (venta_id, linea.producto_id) not in quedan
+        }
+        aplicar_venta(
+            grupo[0].venta,
+            [(linea.producto_id, linea.pendiente, linea.pendiente * linea.precio) for linea in grupo],
+            signo=-1, cerradas=cerradas,
+        )
+
+
+def filtrar_resumen(usuario=None, parametros=None):
+    """
+    Filas del resumen para los mismos filtros del reporte de ventas
+    (ver reportes.parametros_reporte): con producto, las filas de ese
+    producto; sin producto, las filas totales.
+    """
+    parametros = parametros or {}
+    queryset = ResumenVentaDiaria.objects.all()
+    if usuario is not None and not usuario.is_superuser:
+        queryset = queryset.filter(vendedor=usuario)
+
+    if parametros.get('dia'):
+        queryset = queryset.filter(fecha=fecha_parametro(parametros['dia']))
+    else:
+        fecha_inicio = fecha_parametro(parametros.get('fecha_inicio'))
+        if fecha_inicio:
+            queryset = queryset.filter(fecha__gte=fecha_inicio)
+        fecha_fin = fecha_parametro(parametros.get('fecha_fin'))
+        if fecha_fin:
+            queryset = queryset.filter(fecha__lte=fecha_fin)
+
+    vendedor_id = parametros.get('vendedor')
+    if vendedor_id:
+        queryset = queryset.filter(vendedor_id=vendedor_id)
+    metodo_pago = parametros.get('metodo_pago')
+    if metodo_pago:
+        queryset = queryset.filter(metodo_pago=metodo_pago)
+
+    producto_id = parametros.get('producto')
+    if producto_id:
+        return queryset.filter(producto_id=producto_id)
+    return queryset.filter(producto__isnull=True)
+
+
+def hay_ventas(queryset):
+    return queryset.filter(ventas__gt=0).exists()
+
+
+def totales(queryset):
+    """Primer y último día con ventas y totales de las filas dadas."""
+    return queryset.filter(ventas__gt=0).aggregate(
+        primera=Min('fecha'),
+        ultima=Max('fecha'),
+        cantidad=Coalesce(Sum('ventas'), 0),
+        unidades=Coalesce(Sum('unidades'), 0),
+        ingresos=Sum('ingresos'),
+    )
+
+
+def por_dia(queryset):
+    """Ventas, unidades e ingresos de cada día."""
+    return (
+        queryset.filter(ventas__gt=0)
+        .values('fecha')
+        .annotate(ventas=Sum('ventas'), unidades=Sum('unidades'), ingresos=Sum('ingresos'))
+        .order_by('fecha')
+    )
+
+
+def meses_archivados(segmento_model=SegmentoArchivo):
+    """Primer día de cada mes cuyas ventas se archivaron (ver archivo.archivar_ventas)."""
+    return list(segmento_model.objects.filter(tipo=SegmentoArchivo.VENTAS).values_list('mes', flat=True))
+
+
+def meses_entre(desde, hasta):
+    """Primer día de cada mes entre las fechas `desde` y `hasta`."""
+    mes = desde.replace(day=1)
+    while mes <= hasta:
+        yield mes
+        mes = fin_de_mes(mes) + timedelta(days=1)
+
+
+def reconstruir(venta_model=Venta, linea_model=VentaProducto, resumen_model=ResumenVentaDiaria, lote=1000,
+                archivados=None):
+    """
+    Borra y vuelve a calcular el resumen desde las ventas. Recibe los
+    modelos para poder usarse también desde una migración.
+
+    Las filas de los meses `archivados` (por defecto los de SegmentoArchivo)
+    se conservan: sus ventas ya no están en la tabla y el resumen es lo
+    único que queda de ellas para los reportes.
+    """
+    if archivados is None:
+        archivados = meses_archivados()
+    en_archivo = Q()
+    ventas_en_archivo = Q()
+    lineas_en_archivo = Q()
+    for mes in archivados:
+        en_archivo |= Q(fecha__gte=mes, fecha__lte=fin_de_mes(mes))
+        ventas_en_archivo |= rango_fechas('fecha_creacion', mes, fin_de_mes(mes))
+        lineas_en_archivo |= rango_fechas('venta__fecha_creacion', mes, fin_de_mes(mes))
+
+    with transaction.atomic():
+        resumen_model.objects.exclude(en_archivo).delete()
+
+        # Lo devuelto de cada línea se descuenta con las columnas de la propia
+        # línea (cantidad_devuelta), sin leer el historial
+        linea = 'ventaproducto_set__'
+        # Filas totales: una por día, vendedor y método de pago
+        totales_dia = (
+            venta_model.objects.exclude(ventas_en_archivo).filter(devolucion=False)
+            .annotate(dia=TruncDate('fecha_creacion'))
+            .values('dia', 'vendedor_id', 'metodo_pago')
+            .annotate(
+                total_unidades=Coalesce(Sum(F(f'{linea}cantidad') - F(f'{linea}cantidad_devuelta')), 0),
+                total_ingresos=Coalesce(
+                    Sum(F(f'{linea}subtotal') - F(f'{linea}cantidad_devuelta') * F(f'{linea}precio')),
+                    Value(Decimal('0')),
+                ),
+                total_ventas=Count('pk', distinct=True),
+            )
+            .order_by()
+        )
+        # Filas por producto: las líneas devueltas por completo ya no cuentan
+        productos_dia = (
+            linea_model.objects.exclude(lineas_en_archivo).filter(
+                venta__devolucion=False, producto__isnull=False, cantidad_devuelta__lt=F('cantidad')
+            )
+            .annotate(dia=TruncDate('venta__fecha_creacion'))
+            .values('dia', 'venta__vendedor_id', 'venta__metodo_pago', 'producto_id')
+            .annotate(
+                total_unidades=Sum(F('cantidad') - F('cantidad_devuelta')),
+                total_ingresos=Sum(F('subtotal') - F('cantidad_devuelta') * F('precio')),
+                total_ventas=Count('venta', distinct=True),
+            )
+            .order_by()
+        )
+
+        def filas():
+            for fila in totales_dia.iterator(chunk_size=lote):
+                yield resumen_model(
+                    fecha=fila['dia'], vendedor_id=fila['vendedor_id'], metodo_pago=fila['metodo_pago'],
+                    unidades=fila['total_unidades'], ingresos=fila['total_ingresos'], ventas=fila['total_ventas'],
+                )
+            for fila in productos_dia.iterator(chunk_size=lote):
+                yield resumen_model(
+                    fecha=fila['dia'], vendedor_id=fila['venta__vendedor_id'],
+                    metodo_pago=fila['venta__metodo_pago'], producto_id=fila['producto_id'],
+                    unidades=fila['total_unidades'], ingresos=fila['total_ingresos'], ventas=fila['total_ventas'],
+                )
+
+        creadas = 0
+        bloque = []
+        for fila in filas():
+            bloque.append(fila)
+            if len(bloque) >= lote:
+                resumen_model.objects.bulk_create(bloque)
+                creadas += len(bloque)
+                bloque = []
+        if bloque:
+            resumen_model.objects.bulk_create(bloque)
+            creadas += len(bloque)
+    return creadas
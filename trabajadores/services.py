@@ -0,0 +1,292 @@
+import functools
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from django.utils import timezone
+
+from administracion import auditoria
+from administracion.models import HistorialProducto
+from core import sugerencias
+from core.bloqueos import reintentar_si_bloqueada
+from .models import Producto, Venta, VentaProducto
+from .resumen import aplicar_venta, quitar_lineas, quitar_ventas
+from .stock import liberar_stock, reservar_stock
+from .tickets import invalidar_ticket
+from .trabajos import encolar_ticket
+
+
+def cambios_venta(venta, cantidad, precio):
+    """Datos del historial de una venta (cantidad negativa) o devolución (positiva)."""
+    return {'venta': venta.pk, 'cliente': venta.cliente, 'cantidad': cantidad, 'precio': precio}
+
+
+def agrupar_cantidades(lineas):
+    """Suma las cantidades por producto: {producto_id: cantidad}."""
+    cantidades = OrderedDict()
+    for producto_id, cantidad in lineas:
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    return cantidades
+
+
+@reintentar_si_bloqueada
+def registrar_venta(venta, lineas, usuario):
+    """
+    Registra una venta completa en una sola transacción y con un número
+    constante de consultas, sin importar cuántos productos tenga.
+
+    `lineas` es una lista de tuplas (producto, cantidad). Los productos se
+    vuelven a leer en bloque dentro de la transacción para tomar el nombre y
+    el precio vigentes; las líneas y el historial se insertan con
+    bulk_create, el stock se reserva con un único UPDATE condicional y el
+    resumen diario se actualiza en la misma transacción. Con
+    TICKETS_PRERENDER el ticket se genera en segundo plano tras el commit.
+
+    Lanza StockInsuficiente si otro cajero se llevó el stock entre la
+    validación del formulario y el cobro; en ese caso no se guarda nada.
+    """
+    cantidades = agrupar_cantidades((producto.pk, cantidad) for producto, cantidad in lineas)
+    try:
+        with transaction.atomic():
+            # Primero el stock: si no alcanza, no se escribe nada más
+            reservar_stock(cantidades)
+            productos = Producto.objects.in_bulk(list(cantidades))
+
+            detalles = []
+            for producto, cantidad in lineas:
+                producto = productos[producto.pk]
+                detalles.append(VentaProducto(
+                    producto=producto,
+                    nombre_producto=producto.nombre,
+                    cantidad=cantidad,
+                    precio=producto.precio,
+                    subtotal=cantidad * producto.precio,
+                ))
+
+            # El total se calcula una sola vez antes de insertar la venta
+            venta.total = sum(detalle.subtotal for detalle in detalles)
+            venta.save()
+
+            for detalle in detalles:
+                detalle.venta = venta
+            VentaProducto.objects.bulk_create(detalles)
+            aplicar_venta(venta, [(d.producto_id, d.cantidad, d.subtotal) for d in detalles])
+
+            # El historial se escribe en un solo bulk_create después del
+            # commit; no va al pool de hilos, que podría perderlo sin aviso
+            for detalle in detalles:
+                auditoria.registrar(
+                    detalle.producto, usuario, HistorialProducto.VENDIDO,
+                    cambios_venta(venta, -detalle.cantidad, detalle.precio),
+                    imagen=detalle.producto.imagen,
+                )
+            if getattr(settings, 'TICKETS_PRERENDER', False):
+                venta_id = venta.pk
+                transaction.on_commit(lambda: encolar_ticket(venta_id))
+    except Exception:
+        # La transacción se deshizo: la venta vuelve a ser nueva por si se reintenta
+        venta.pk = None
+        venta._state.adding = True
+        raise
+
+    return venta
+
+
+@reintentar_si_bloqueada
+def devolver_venta(venta_id, usuario, cantidades=None):
+    """
+    Devuelve una venta completa o, con `cantidades` ({id de línea: unidades}),
+    solo parte de sus líneas, en una sola transacción y con un número
+    constante de consultas.
+
+    Cada línea suma lo devuelto en cantidad_devuelta (nunca más de lo que
+    queda por devolver) y la venta en total_devuelto, con UPDATE sobre F();
+    el stock vuelve con un único UPDATE, el resumen diario resta solo lo
+    devuelto y el historial se escribe en lote al confirmar. La venta queda
+    marcada como devolución cuando ya no le queda nada por devolver.
+
+    Devuelve (venta, [(línea, unidades devueltas), ...]); la lista está vacía
+    si no había nada que devolver. Lanza Venta.DoesNotExist si no existe.
+    """
+    with transaction.atomic():
+        # Se lee dentro de la transacción para no devolver dos veces lo mismo
+        venta = Venta.objects.select_for_update().get(pk=venta_id)
+        lineas = list(
+            venta.ventaproducto_set.select_related('producto')
+            .filter(cantidad_devuelta__lt=F('cantidad')).order_by('id')
+        )
+        devueltas = []
+        for linea in lineas:
+            pedida = linea.pendiente if cantidades is None else cantidades.get(linea.pk, 0)
+            unidades = min(max(pedida, 0), linea.pendiente)
+            if unidades:
+                devueltas.append((linea, unidades))
+        if not devueltas:
+            return venta, []
+
+        VentaProducto.objects.filter(pk__in=[linea.pk for linea, _ in devueltas]).update(
+            cantidad_devuelta=Case(
+                *[When(pk=linea.pk, then=F('cantidad_devuelta') + Value(unidades, PositiveIntegerField()))
+                  for linea, unidades in devueltas],
+                default=F('cantidad_devuelta'),
+            )
+        )
+        liberar_stock(agrupar_cantidades(
+            (linea.producto_id, unidades) for linea, unidades in devueltas if linea.producto_id
+        ))
+
+        # Productos que ya no tienen nada por devolver en esta venta. Las
+        # líneas de productos eliminados (producto_id None) solo cuentan para
+        # saber si la venta quedó completa: None es la fila total del resumen
+        restantes = {}
+        for linea in lineas:
+            restantes[linea.pk] = linea.pendiente
+        for linea, unidades in devueltas:
+            linea.cantidad_devuelta += unidades
+            restantes[linea.pk] -= unidades
+        por_producto = {}
+        for linea in lineas:
+            if linea.producto_id is not None:
+                por_producto[linea.producto_id] = por_producto.get(linea.producto_id, 0) + restantes[linea.pk]
+        cerradas = {producto_id for producto_id, pendiente in por_producto.items() if not pendiente}
+        completa = not any(restantes.values())
+        if completa:
+            cerradas.add(None)
+
+        monto = sum(linea.precio * unidades for linea, unidades in devueltas)
+        Venta.objects.filter(pk=venta.pk).update(
+            total_devuelto=F('total_devuelto') + monto,
+            devolucion=completa,
+            fecha_actualizacion=timezone.now(),
+        )
+        venta.refresh_from_db(fields=['total_devuelto', 'devolucion', 'fecha_actualizacion'])
+        aplicar_venta(
+            venta, [(linea.producto_id, unidades, linea.precio * unidades) for linea, unidades in devueltas],
+            signo=-1, cerradas=cerradas,
+        )
+
+        for linea, unidades in devueltas:
+            if linea.producto:
+                auditoria.registrar(
+                    linea.producto, usuario, HistorialProducto.DEVOLUCION,
+                    cambios_venta(venta, unidades, linea.precio), imagen=linea.producto.imagen,
+                )
+        # El UPDATE no dispara las señales de Venta: el ticket guardado se borra aquí
+        transaction.on_commit(lambda: invalidar_ticket(venta.pk))
+    return venta, devueltas
+
+
+def stock_por_devolver(lineas):
+    """
+    {producto_id: unidades} que las líneas dadas (queryset) aún tienen fuera
+    del stock: lo vendido menos lo ya devuelto, agrupado en una consulta.
+    """
+    return dict(
+        lineas.filter(producto__isnull=False, cantidad_devuelta__lt=F('cantidad'))
+        .order_by().values('producto_id')
+        .annotate(unidades=Sum(F('cantidad') - F('cantidad_devuelta')))
+        .values_list('producto_id', 'unidades')
+    )
+
+
+def borrar_filas(modelo, campo, valores):
+    """
+    DELETE directo de las filas de `modelo` con `campo` en `valores`, sin
+    pasar por QuerySet.delete(): no hay cascadas ni señales por fila. Quien
+    lo usa ya hizo lo que harían las señales (stock, totales, resumen) y
+    borra antes las líneas de las ventas. Devuelve las filas borradas.
+    """
+    if not valores:
+        return 0
+    tabla = connection.ops.quote_name(modelo._meta.db_table)
+    columna = connection.ops.quote_name(modelo._meta.get_field(campo).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {tabla} WHERE {columna} IN ({', '.join(['%s'] * len(valores))})", list(valores)
+        )
+        return cursor.rowcount
+
+
+@reintentar_si_bloqueada
+def eliminar_lineas(lineas):
+    """
+    Borra las líneas de venta (queryset) con un número fijo de consultas por
+    venta afectada: el stock vuelve con un UPDATE, los totales (y lo
+    devuelto) de las ventas bajan con otro, el resumen diario resta lo que
+    no se había devuelto y las líneas se borran sin las señales de cada fila.
+    Devuelve la cantidad de líneas borradas.
+    """
+    with transaction.atomic():
+        borrar = list(lineas.select_related('venta').order_by())
+        if not borrar:
+            return 0
+        liberar_stock(agrupar_cantidades(
+            (linea.producto_id, linea.pendiente) for linea in borrar if linea.producto_id and linea.pendiente
+        ))
+        diferencias = {}
+        for linea in borrar:
+            total, devuelto = diferencias.get(linea.venta_id, (0, 0))
+            diferencias[linea.venta_id] = (total + linea.subtotal, devuelto + linea.cantidad_devuelta * linea.precio)
+        Venta.objects.filter(pk__in=diferencias).update(
+            total=Case(
+                *[When(pk=venta_id, then=F('total') - total) for venta_id, (total, _) in diferencias.items()],
+                default=F('total'),
+            ),
+            total_devuelto=Case(
+                *[When(pk=venta_id, then=F('total_devuelto') - devuelto)
+                  for venta_id, (_, devuelto) in diferencias.items()],
+                default=F('total_devuelto'),
+            ),
+            fecha_actualizacion=timezone.now(),
+        )
+        for inicio in range(0, len(borrar), 500):
+            borrar_filas(VentaProducto, 'id', [linea.pk for linea in borrar[inicio:inicio + 500]])
+        quitar_lineas(borrar)
+
+        def invalidar():
+            for venta_id in diferencias:
+                invalidar_ticket(venta_id)
+
+        transaction.on_commit(invalidar)
+    return len(borrar)
+
+
+def despues_de_borrar(ids, clientes):
+    """Lo que harían las señales de cada venta borrada sin pasar por ellas."""
+    for venta_id in ids:
+        invalidar_ticket(venta_id)
+    sugerencias.vocabulario('clientes').quitar(*clientes)
+
+
+@reintentar_si_bloqueada
+def eliminar_ventas(ventas):
+    """
+    Borra las ventas (queryset) y sus líneas sin las señales de cada fila:
+    el stock de todas las líneas vuelve con un solo UPDATE, el resumen
+    diario resta lo que no se había devuelto (unas pocas consultas por
+    venta) y no se recalcula el total de ventas que se están borrando. Los
+    tickets y las sugerencias de clientes se actualizan al confirmar.
+    Devuelve lo mismo que QuerySet.delete().
+    """
+    with transaction.atomic():
+        borrar = list(ventas.order_by().only('pk', 'cliente', 'vendedor_id', 'metodo_pago', 'fecha_creacion', 'devolucion'))
+        ids = [venta.pk for venta in borrar]
+        lineas = 0
+        stock = {}
+        for inicio in range(0, len(ids), 500):
+            parte = VentaProducto.objects.filter(venta_id__in=ids[inicio:inicio + 500])
+            for producto_id, unidades in stock_por_devolver(parte).items():
+                stock[producto_id] = stock.get(producto_id, 0) + unidades
+        liberar_stock(stock)
+        quitar_ventas(borrar)
+        for inicio in range(0, len(ids), 500):
+            parte = ids[inicio:inicio + 500]
+            lineas += borrar_filas(VentaProducto, 'venta', parte)
+            borrar_filas(Venta, 'id', parte)
+        transaction.on_commit(functools.partial(despues_de_borrar, ids, [venta.cliente for venta in borrar]))
+
+    por_modelo = {Venta._meta.label: len(ids)} if ids else {}
+    if lineas:
+        por_modelo[VentaProducto._meta.label] = lineas
+    return len(ids) + lineas, por_modelo
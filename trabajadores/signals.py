@@ -1,16 +1,100 @@
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import VentaProducto
+from django.utils import timezone
+from core import sugerencias
+from .models import Venta, VentaProducto
+from .resumen import aplicar_venta, quitar_ventas
+from .stock import liberar_stock
+from .tickets import invalidar_ticket
 
+def borra_la_venta(origin):
+    """
+    True si el borrado no empezó por la línea sino por algo que la arrastra
+    en cascada (su venta, el vendedor...): la venta también se está borrando.
+    """
+    if origin is None:
+        return False
+    return getattr(origin, 'model', type(origin)) is not VentaProducto
+
+
+@receiver(pre_delete, sender=Venta)
+def quitar_venta_del_resumen(sender, instance, **kwargs):
+    """Antes de borrar la venta (sus líneas aún existen) se resta del resumen diario."""
+    quitar_ventas([instance])
+
+
+@receiver(pre_delete, sender=VentaProducto)
+def lineas_del_producto(sender, instance, origin=None, **kwargs):
+    """
+    Recuerda las líneas pendientes del mismo producto en la venta, para que
+    al borrar varias juntas solo una reste la venta de la fila del producto.
+    """
+    if instance.producto_id and instance.pendiente and not borra_la_venta(origin):
+        instance._lineas_del_producto = list(
+            VentaProducto.objects.filter(
+                venta_id=instance.venta_id, producto_id=instance.producto_id, cantidad_devuelta__lt=F('cantidad')
+            ).values_list('pk', flat=True)
+        )
+
+
+@receiver(post_delete, sender=VentaProducto)
+def devolver_stock(sender, instance, origin=None, **kwargs):
+    """
+    Al eliminar un detalle de venta, se suma al stock del producto lo que no
+    se había devuelto, se descuenta su subtotal del total de la venta y se
+    resta del resumen diario. Para borrar muchas ventas o líneas, ver
+    services.eliminar_ventas y services.eliminar_lineas.
+    """
+    pendiente = instance.pendiente
+    if instance.producto_id and pendiente:
+        liberar_stock({instance.producto_id: pendiente})
+
+    # Si la venta también se borra no tiene sentido ajustar su total, y el
+    # resumen ya lo restó quitar_venta_del_resumen
+    if borra_la_venta(origin):
+        return
+    Venta.ajustar_total(
+        instance.venta_id, -instance.subtotal, devuelto=-instance.cantidad_devuelta * instance.precio
+    )
+    venta = instance.venta
+    if pendiente and not venta.devolucion:
+        cerradas = set()
+        hermanas = instance.__dict__.pop('_lineas_del_producto', [])
+        if hermanas and instance.pk == min(hermanas) and not VentaProducto.objects.filter(pk__in=hermanas).exists():
+            cerradas.add(instance.producto_id)
+        aplicar_venta(
+            venta, [(instance.producto_id, pendiente, pendiente * instance.precio)], signo=-1, cerradas=cerradas
+        )
+
+
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+def invalidar_ticket_venta(sender, instance, created=False, **kwargs):
+    """Una venta editada, devuelta o eliminada ya no sirve su ticket guardado."""
+    if not created:
+        venta_id = instance.pk
+        transaction.on_commit(lambda: invalidar_ticket(venta_id))
+
+
+@receiver(post_save, sender=VentaProducto)
 @receiver(post_delete, sender=VentaProducto)
-def devolver_stock(sender, instance, **kwargs):
+def invalidar_ticket_linea(sender, instance, origin=None, **kwargs):
     """
-    Al eliminar un detalle de venta, se suma la cantidad vendida al stock del producto
-    y se actualiza el total de la venta.
+    Editar una línea cambia el ticket: se mueve la fecha_actualizacion de la
+    venta (nueva versión y ETag) y se borran los tickets guardados.
     """
+    if borra_la_venta(origin):
+        # invalidar_ticket_venta se encarga al borrar la venta
+        return
+    Venta.objects.filter(pk=instance.venta_id).update(fecha_actualizacion=timezone.now())
+    venta_id = instance.venta_id
+    transaction.on_commit(lambda: invalidar_ticket(venta_id))
 
-    if instance.producto:
-        instance.producto.cantidad += instance.cantidad
-        instance.producto.save()
 
-    instance.venta.actualizar_total()
\ No newline at end of file
+# Nombres de clientes para las sugerencias del listado de ventas
+sugerencias.registrar(
+    'clientes', lambda: Venta.objects.order_by().values_list('cliente').annotate(Count('pk'))
+)
+sugerencias.vigilar(Venta, 'cliente', 'clientes')
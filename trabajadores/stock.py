@@ -0,0 +1,64 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+
+from administracion.models import Producto
+
+
+class StockInsuficiente(Exception):
+    """
+    Uno o más productos no tienen stock suficiente al momento de reservar.
+    `conflictos` es un diccionario {producto_id: stock_disponible}.
+    """
+
+    def __init__(self, conflictos):
+        self.conflictos = conflictos
+        super().__init__(f"Stock insuficiente para los productos {sorted(conflictos)}")
+
+
+def reservar_stock(cantidades):
+    """
+    Descuenta el stock de varios productos con un único UPDATE condicional:
+    solo se aplica si todos los productos tienen stock suficiente. En caso
+    contrario no se descuenta nada y se lanza StockInsuficiente con el stock
+    disponible de cada producto en conflicto.
+
+    `cantidades` es un diccionario {producto_id: cantidad}.
+    """
+    if not cantidades:
+        return
+    condicion = reduce(or_, (
+        Q(pk=pk, cantidad__gte=cantidad) for pk, cantidad in cantidades.items()
+    ))
+    try:
+        with transaction.atomic():
+            actualizados = Producto.objects.filter(pk__in=cantidades).filter(condicion).update(
+                cantidad=Case(
+                    *[When(pk=pk, then=F('cantidad') - cantidad) for pk, cantidad in cantidades.items()]
+                )
+            )
+            if actualizados != len(cantidades):
+                # Deshace los productos que sí alcanzaron a descontarse
+                raise StockInsuficiente({})
+    except StockInsuficiente:
+        disponibles = dict(
+            Producto.objects.filter(pk__in=cantidades).values_list('pk', 'cantidad')
+        )
+        raise StockInsuficiente({
+            pk: disponibles.get(pk, 0)
+            for pk, cantidad in cantidades.items()
+            if disponibles.get(pk, 0) < cantidad
+        })
+
+
+def liberar_stock(cantidades):
+    """Devuelve stock a varios productos con un único UPDATE atómico."""
+    if not cantidades:
+        return 0
+    return Producto.objects.filter(pk__in=cantidades).update(
+        cantidad=Case(
+            *[When(pk=pk, then=F('cantidad') + cantidad) for pk, cantidad in cantidades.items()]
+        )
+    )
@@ -3,9 +3,44 @@
 from django.http import HttpResponse
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import namedtuple
+import io
 import random
+import re
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from unittest import mock
+from zoneinfo import ZoneInfo
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from administracion.empresa import invalidar_empresa, obtener_empresa
+from administracion.models import EmpresaNombre, HistorialProducto
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import localdate
+from PIL import Image
+
+from .models import Producto, ReporteJob, ResumenVentaDiaria, Venta, VentaProducto
+from . import reportes, tickets
+from .reportes import filtrar_ventas
+from .resumen import filtrar_resumen, hay_ventas, reconstruir, totales
+from .services import devolver_venta, eliminar_lineas, eliminar_ventas, registrar_venta
+from .trabajos import limpiar_reportes_vencidos
+from .views import VentaListView
+from .stock import StockInsuficiente, reservar_stock
 
 def generate_pdf(queryset):
     """Genera el PDF a partir del queryset con un diseño de tabla mejorado."""
@@ -177,6 +212,1108 @@ def test_generate_pdf():
 
     print("PDF de prueba generado con 800 filas: 'test_ventas.pdf'")
 
+class VentaTestMixin:
+    """Datos base para las pruebas de ventas."""
+
+    def crear_productos(self, n, cantidad=100, precio=1000):
+        from administracion.models import Categoria, Producto
+        categoria = Categoria.objects.create(nombre="General")
+        return [
+            Producto.objects.create(
+                nombre=f"Producto {i}", precio=precio, cantidad=cantidad, categoria=categoria
+            )
+            for i in range(n)
+        ]
+
+    def datos_venta(self, lineas, cliente="Cliente"):
+        datos = {
+            'cliente': cliente,
+            'metodo_pago': 'efectivo',
+            'ventaproducto_set-TOTAL_FORMS': str(len(lineas)),
+            'ventaproducto_set-INITIAL_FORMS': '0',
+            'ventaproducto_set-MIN_NUM_FORMS': '0',
+            'ventaproducto_set-MAX_NUM_FORMS': '1000',
+        }
+        for i, (producto, cantidad) in enumerate(lineas):
+            datos[f'ventaproducto_set-{i}-producto'] = str(producto.pk)
+            datos[f'ventaproducto_set-{i}-cantidad'] = str(cantidad)
+        return datos
+
+
+class CrearVentaTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("cajero", password="x")
+        self.client.force_login(self.usuario)
+
+    def test_registra_lineas_stock_total_e_historial(self):
+        from administracion.models import HistorialProducto
+        p1, p2 = self.crear_productos(2, cantidad=10, precio=1500)
+
+        # El historial se escribe al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('venta_create'), self.datos_venta([(p1, 2), (p2, 3)]))
+
+        self.assertRedirects(respuesta, reverse('venta_list'), fetch_redirect_response=False)
+        venta = Venta.objects.get()
+        self.assertEqual(venta.total, Decimal('7500'))
+        self.assertEqual(venta.vendedor, self.usuario)
+        self.assertEqual(venta.ventaproducto_set.count(), 2)
+        p1.refresh_from_db()
+        p2.refresh_from_db()
+        self.assertEqual((p1.cantidad, p2.cantidad), (8, 7))
+        self.assertEqual(HistorialProducto.objects.filter(tipo_cambio="Vendido").count(), 2)
+
+    def test_fila_sin_producto_se_ignora(self):
+        producto, = self.crear_productos(1, cantidad=10)
+        datos = self.datos_venta([(producto, 2)])
+        datos.update({
+            'ventaproducto_set-TOTAL_FORMS': '2',
+            'ventaproducto_set-1-producto': '',
+            'ventaproducto_set-1-cantidad': '3',
+        })
+        respuesta = self.client.post(reverse('venta_create'), datos)
+
+        self.assertRedirects(respuesta, reverse('venta_list'), fetch_redirect_response=False)
+        venta = Venta.objects.get()
+        self.assertEqual(venta.ventaproducto_set.count(), 1)
+        producto.refresh_from_db()
+        self.assertEqual(producto.cantidad, 8)
+
+    @override_settings(HISTORIAL_HILOS=1)
+    def test_historial_de_la_venta_no_va_al_pool(self):
+        from administracion.models import HistorialProducto
+        producto, = self.crear_productos(1)
+        with mock.patch('administracion.auditoria.executor') as pool:
+            with self.captureOnCommitCallbacks(execute=True):
+                registrar_venta(Venta(cliente="Ana", vendedor=self.usuario), [(producto, 1)], self.usuario)
+        pool.return_value.submit.assert_not_called()
+        self.assertEqual(HistorialProducto.objects.filter(tipo_cambio="Vendido").count(), 1)
+
+    def test_benchmark_consultas_constantes(self):
+        """El número de consultas del checkout no crece con las líneas."""
+        productos = self.crear_productos(40)
+        consultas = {}
+        for n in (1, 10, 40):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(
+                    reverse('venta_create'),
+                    self.datos_venta([(p, 1) for p in productos[:n]]),
+                )
+            consultas[n] = len(ctx.captured_queries)
+
+        self.assertEqual(consultas[1], consultas[10])
+        self.assertEqual(consultas[1], consultas[40])
+        self.assertEqual(Venta.objects.count(), 3)
+
+
+class ReservaStockTests(VentaTestMixin, TestCase):
+    def test_no_descuenta_nada_si_un_producto_no_alcanza(self):
+        p1, p2 = self.crear_productos(2, cantidad=5)
+
+        with self.assertRaises(StockInsuficiente) as ctx:
+            reservar_stock({p1.pk: 2, p2.pk: 6})
+
+        self.assertEqual(ctx.exception.conflictos, {p2.pk: 5})
+        p1.refresh_from_db()
+        self.assertEqual(p1.cantidad, 5)
+
+    def test_conflicto_se_reporta_en_la_linea(self):
+        usuario = User.objects.create_user("cajero", password="x")
+        self.client.force_login(usuario)
+        producto, = self.crear_productos(1, cantidad=5)
+        datos = self.datos_venta([(producto, 4)])
+        # Otro cajero vende entre la validación y el cobro
+        Producto.objects.filter(pk=producto.pk).update(cantidad=3)
+
+        with mock.patch('trabajadores.forms.BaseVentaProductoFormSet.productos_enviados',
+                        return_value={producto.pk: producto}):
+            respuesta = self.client.post(reverse('venta_create'), datos)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(
+            respuesta.context['formset'].forms[0].errors['cantidad'],
+            [f"No hay suficiente stock para {producto.nombre}. Stock disponible: 3."],
+        )
+        self.assertFalse(Venta.objects.exists())
+
+
+# La base de pruebas en memoria responde "table is locked" al instante en vez
+# de esperar el timeout de SQLite como la base en archivo: sin esa espera solo
+# quedan los reintentos, que ocho hilos sin pausa agotan con facilidad
+@override_settings(STOCK_REINTENTOS=20)
+class ReservaStockConcurrenteTests(VentaTestMixin, TransactionTestCase):
+    def test_estres_varios_cajeros_mismo_producto(self):
+        """N hilos venden el mismo producto: el stock final es exacto."""
+        usuario = User.objects.create_user("cajero", password="x")
+        producto, = self.crear_productos(1, cantidad=50)
+        trabajadores, intentos_por_trabajador = 8, 10
+        resultados = {'vendidas': 0, 'rechazadas': 0}
+        candado = threading.Lock()
+        barrera = threading.Barrier(trabajadores)
+
+        def cajero():
+            try:
+                barrera.wait()
+                for _ in range(intentos_por_trabajador):
+                    venta = Venta(cliente="Cliente", vendedor=usuario)
+                    try:
+                        registrar_venta(venta, [(producto, 1)], usuario)
+                        clave = 'vendidas'
+                    except StockInsuficiente:
+                        clave = 'rechazadas'
+                    with candado:
+                        resultados[clave] += 1
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=cajero) for _ in range(trabajadores)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        producto.refresh_from_db()
+        self.assertEqual(producto.cantidad, 0)
+        self.assertEqual(resultados, {'vendidas': 50, 'rechazadas': 30})
+        self.assertEqual(VentaProducto.objects.count(), 50)
+
+
+class TotalIncrementalTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("cajero", password="x")
+        self.p1, self.p2 = self.crear_productos(2, cantidad=10, precio=1000)
+        self.venta = Venta.objects.create(cliente="Cliente", vendedor=self.usuario)
+
+    def test_total_se_ajusta_al_crear_editar_y_eliminar(self):
+        linea = VentaProducto.objects.create(venta=self.venta, producto=self.p1, cantidad=2, precio=0)
+        VentaProducto.objects.create(venta=self.venta, producto=self.p2, cantidad=1, precio=0)
+        self.venta.refresh_from_db()
+        self.assertEqual(self.venta.total, Decimal('3000'))
+
+        linea = VentaProducto.objects.get(pk=linea.pk)
+        linea.cantidad = 5
+        linea.save()
+        self.venta.refresh_from_db()
+        self.assertEqual(self.venta.total, Decimal('6000'))
+
+        linea.delete()
+        self.venta.refresh_from_db()
+        self.assertEqual(self.venta.total, Decimal('1000'))
+
+    def test_guardar_linea_no_relee_las_demas(self):
+        for producto in (self.p1, self.p2):
+            VentaProducto.objects.create(venta=self.venta, producto=producto, cantidad=1, precio=0)
+        linea = VentaProducto(venta=self.venta, producto=self.p1, cantidad=1, precio=0)
+
+        with CaptureQueriesContext(connection) as ctx:
+            linea.save()
+
+        # Solo la comprobación del resumen de si queda otra línea del producto
+        lecturas = [
+            consulta['sql'] for consulta in ctx.captured_queries
+            if 'FROM "trabajadores_ventaproducto"' in consulta['sql']
+        ]
+        self.assertEqual(len(lecturas), 1)
+        self.assertIn('LIMIT 1', lecturas[0])
+
+    def test_comando_verificar_y_reparar_totales(self):
+        VentaProducto.objects.create(venta=self.venta, producto=self.p1, cantidad=2, precio=0)
+        Venta.objects.filter(pk=self.venta.pk).update(total=1)
+
+        salida = StringIO()
+        call_command('verificar_totales', stdout=salida)
+        self.assertIn("1 con diferencias", salida.getvalue())
+        self.venta.refresh_from_db()
+        self.assertEqual(self.venta.total, Decimal('1'))
+
+        call_command('verificar_totales', '--reparar', '--lote', '1', stdout=StringIO())
+        self.venta.refresh_from_db()
+        self.assertEqual(self.venta.total, Decimal('2000'))
+
+    def test_comando_verifica_total_devuelto(self):
+        linea = VentaProducto.objects.create(venta=self.venta, producto=self.p1, cantidad=2, precio=0)
+        VentaProducto.objects.filter(pk=linea.pk).update(cantidad_devuelta=1)
+        salida = StringIO()
+        call_command('verificar_totales', stdout=salida)
+        self.assertIn("total devuelto guardado 0.00, suma de lo devuelto 1000", salida.getvalue())
+
+        call_command('verificar_totales', '--reparar', stdout=StringIO())
+        self.venta.refresh_from_db()
+        self.assertEqual((self.venta.total, self.venta.total_devuelto), (Decimal('2000'), Decimal('1000')))
+
+
+class ListaVentasTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+        self.productos = self.crear_productos(6)
+
+    def crear_ventas(self, n, lineas):
+        for i in range(n):
+            registrar_venta(
+                Venta(cliente=f"Cliente {i}", vendedor=self.usuario),
+                [(p, 1) for p in self.productos[:lineas]],
+                self.usuario,
+            )
+
+    def consultas_lista(self, por_pagina):
+        with mock.patch.object(VentaListView, 'paginate_by', por_pagina):
+            with CaptureQueriesContext(connection) as ctx:
+                respuesta = self.client.get(reverse('venta_list'))
+        self.assertEqual(respuesta.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_consultas_fijas_sin_importar_tamano_de_pagina(self):
+        self.crear_ventas(20, lineas=6)
+        self.consultas_lista(5)  # calienta la caché de la empresa
+        self.assertEqual(self.consultas_lista(2), self.consultas_lista(20))
+
+    def test_muestra_productos_de_cada_venta(self):
+        self.crear_ventas(1, lineas=2)
+        VentaProducto.objects.filter(producto=self.productos[1]).update(producto=None)
+        respuesta = self.client.get(reverse('venta_list'))
+        self.assertContains(respuesta, "Producto 0")
+        self.assertContains(respuesta, "Producto 1")
+
+    def test_opciones_reporte(self):
+        self.crear_ventas(1, lineas=1)
+        datos = self.client.get(reverse('opciones_reporte')).json()
+        self.assertEqual(datos['vendedores'], [{'id': self.usuario.pk, 'username': 'admin'}])
+        self.assertEqual(len(datos['productos']), 6)
+
+
+class ReporteVentasTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+
+    def crear_ventas(self, n, lineas=3):
+        ventas = Venta.objects.bulk_create(
+            [Venta(cliente=f"Cliente {i}", vendedor=self.usuario, total=3000) for i in range(n)]
+        )
+        VentaProducto.objects.bulk_create([
+            VentaProducto(venta=venta, nombre_producto=f"Producto {j}", cantidad=1, precio=1000, subtotal=1000)
+            for venta in ventas for j in range(lineas)
+        ])
+        # bulk_create no pasa por registrar_venta: el resumen diario se recalcula
+        reconstruir()
+        return Venta.objects.filter(pk__in=[venta.pk for venta in ventas])
+
+    def pico_memoria(self, funcion):
+        tracemalloc.start()
+        try:
+            funcion()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_exporta_pdf_por_bloques(self):
+        self.crear_ventas(30)
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(reverse('venta_export_pdf'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.streaming)
+        self.assertIn('attachment; filename="ventas_', respuesta['Content-Disposition'])
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+        sql = [q['sql'] for q in ctx.captured_queries]
+        self.assertEqual(sum('MIN(' in q and 'MAX(' in q for q in sql), 1)
+        self.assertFalse(any('LIMIT 1' in q and 'trabajadores_venta' in q for q in sql))
+
+    def test_sin_ventas_no_genera_pdf(self):
+        respuesta = self.client.get(reverse('venta_export_pdf'))
+        self.assertContains(respuesta, "No hay ventas registradas para el día de hoy")
+
+    def test_fecha_inexistente_se_ignora(self):
+        self.crear_ventas(2)
+        respuesta = self.client.get(reverse('venta_export_pdf'), {'fecha_inicio': "2025-02-30"})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+
+    def test_lotes_incluyen_todas_las_lineas(self):
+        queryset = self.crear_ventas(25, lineas=2)
+        filas = list(reportes.ventas_por_lotes(queryset, lote=10))
+        self.assertEqual(len(filas), 25)
+        self.assertTrue(all(len(productos) == 2 for _, productos in filas))
+
+    def test_benchmark_memoria_constante_al_leer_ventas(self):
+        """El pico de memoria al recorrer las ventas no crece con su número."""
+        picos = {}
+        for n in (500, 2000):
+            queryset = self.crear_ventas(n)
+            picos[n] = self.pico_memoria(lambda: sum(1 for _ in reportes.ventas_por_lotes(queryset, lote=200)))
+        # Con prefetch_related sobre todo el queryset el pico crece con las ventas
+        completo = self.pico_memoria(lambda: list(queryset.prefetch_related('ventaproducto_set')))
+        self.assertLess(picos[2000], picos[500] * 1.3)
+        self.assertLess(picos[2000] * 3, completo)
+
+
+class ReporteJobMixin:
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+
+    def vender(self, n=3):
+        productos = self.crear_productos(1)
+        for i in range(n):
+            registrar_venta(Venta(cliente=f"Cliente {i}", vendedor=self.usuario), [(productos[0], 1)], self.usuario)
+
+
+@override_settings(REPORTES_HILOS=0)
+class ReporteJobTests(ReporteJobMixin, VentaTestMixin, TestCase):
+    def test_encola_informa_y_descarga(self):
+        self.vender()
+        respuesta = self.client.post(reverse('venta_export_pdf'))
+        self.assertEqual(respuesta.status_code, 202)
+        datos = respuesta.json()
+
+        estado = self.client.get(datos['estado_url']).json()
+        self.assertEqual(estado['estado'], ReporteJob.TERMINADO)
+        self.assertEqual((estado['ventas_procesadas'], estado['ventas_totales'], estado['paginas']), (3, 3, 1))
+
+        descarga = self.client.get(estado['descarga_url'])
+        self.assertTrue(b''.join(descarga.streaming_content).startswith(b'%PDF'))
+        descarga.close()
+
+    def test_mismos_filtros_comparten_trabajo(self):
+        self.vender()
+        primero = self.client.post(reverse('venta_export_pdf'), {'metodo_pago': 'efectivo'}).json()
+        segundo = self.client.post(reverse('venta_export_pdf'), {'metodo_pago': 'efectivo'}).json()
+        self.assertEqual(primero['id'], segundo['id'])
+        self.assertEqual(ReporteJob.objects.count(), 1)
+
+        # Otros filtros o datos nuevos generan otro reporte
+        otro = self.client.post(reverse('venta_export_pdf'), {'metodo_pago': 'efectivo', 'vendedor': self.usuario.pk}).json()
+        self.assertNotEqual(otro['id'], primero['id'])
+        self.vender(1)
+        nuevo = self.client.post(reverse('venta_export_pdf'), {'metodo_pago': 'efectivo'}).json()
+        self.assertNotIn(nuevo['id'], (primero['id'], otro['id']))
+
+    def test_sin_ventas(self):
+        respuesta = self.client.post(reverse('venta_export_pdf'))
+        self.assertEqual(respuesta.status_code, 404)
+        self.assertFalse(ReporteJob.objects.exists())
+
+    def test_otro_usuario_no_ve_el_reporte(self):
+        self.vender()
+        datos = self.client.post(reverse('venta_export_pdf')).json()
+        self.client.force_login(User.objects.create_user("otro", password="x", is_staff=True))
+        self.assertEqual(self.client.get(datos['estado_url']).status_code, 404)
+
+    def test_limpieza_por_ttl(self):
+        self.vender()
+        self.client.post(reverse('venta_export_pdf'))
+        job = ReporteJob.objects.get()
+        ruta = job.archivo.path
+        self.assertTrue(os.path.exists(ruta))
+        self.assertEqual(limpiar_reportes_vencidos(), 0)
+        call_command('limpiar_reportes', ttl=-1, stdout=StringIO())
+        self.assertFalse(ReporteJob.objects.exists())
+        self.assertFalse(os.path.exists(ruta))
+
+
+@override_settings(REPORTES_HILOS=1)
+class ReporteJobHiloTests(ReporteJobMixin, VentaTestMixin, TransactionTestCase):
+    def test_genera_en_segundo_plano(self):
+        self.vender()
+        datos = self.client.post(reverse('venta_export_pdf')).json()
+        self.assertIn(datos['estado'], (ReporteJob.PENDIENTE, ReporteJob.PROCESANDO, ReporteJob.TERMINADO))
+        for _ in range(200):
+            job = ReporteJob.objects.get(pk=datos['id'])
+            if not job.activo:
+                break
+            time.sleep(0.05)
+        self.assertEqual(job.estado, ReporteJob.TERMINADO, job.error)
+        self.assertEqual(job.ventas_procesadas, 3)
+
+
+class ResumenDiarioTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+        self.p1, self.p2 = self.crear_productos(2, cantidad=50, precio=1000)
+
+    def filas(self):
+        return {
+            (fila.producto_id, fila.metodo_pago): (fila.unidades, fila.ingresos, fila.ventas)
+            for fila in ResumenVentaDiaria.objects.all()
+        }
+
+    def vender(self, lineas, metodo_pago='efectivo'):
+        venta = Venta(cliente="Cliente", vendedor=self.usuario, metodo_pago=metodo_pago)
+        return registrar_venta(venta, lineas, self.usuario)
+
+    def test_venta_actualiza_filas_total_y_por_producto(self):
+        self.vender([(self.p1, 2), (self.p2, 3), (self.p1, 1)])
+        self.vender([(self.p1, 1)])
+        self.vender([(self.p2, 4)], metodo_pago='tarjeta')
+        self.assertEqual(self.filas(), {
+            (None, 'efectivo'): (7, Decimal('7000'), 2),
+            (self.p1.pk, 'efectivo'): (4, Decimal('4000'), 2),
+            (self.p2.pk, 'efectivo'): (3, Decimal('3000'), 1),
+            (None, 'tarjeta'): (4, Decimal('4000'), 1),
+            (self.p2.pk, 'tarjeta'): (4, Decimal('4000'), 1),
+        })
+
+    def test_devolucion_resta_una_sola_vez(self):
+        self.vender([(self.p1, 2)])
+        venta = self.vender([(self.p1, 1), (self.p2, 1)])
+        for _ in range(2):
+            self.client.post(reverse('devolver_venta', args=[venta.pk]))
+        self.assertEqual(self.filas(), {
+            (None, 'efectivo'): (2, Decimal('2000'), 1),
+            (self.p1.pk, 'efectivo'): (2, Decimal('2000'), 1),
+            (self.p2.pk, 'efectivo'): (0, Decimal('0'), 0),
+        })
+        self.p1.refresh_from_db()
+        self.assertEqual(self.p1.cantidad, 48)
+
+    def test_reconstruir_coincide_con_incremental(self):
+        self.vender([(self.p1, 2), (self.p2, 3), (self.p1, 1)])
+        self.vender([(self.p2, 4)], metodo_pago='tarjeta')
+        venta = self.vender([(self.p1, 5)])
+        self.client.post(reverse('devolver_venta', args=[venta.pk]))
+        incremental = {clave: valor for clave, valor in self.filas().items() if valor[2]}
+
+        call_command('reconstruir_resumen', stdout=StringIO())
+        self.assertEqual(self.filas(), incremental)
+
+    def test_editar_lineas_con_save_ajusta_el_resumen(self):
+        venta = self.vender([(self.p1, 2), (self.p2, 1)])
+        self.vender([(self.p1, 1)])
+        linea = venta.ventaproducto_set.get(producto=self.p1)
+        linea.cantidad = 4
+        linea.save()
+        # Cambiar el producto saca la venta de la fila del anterior
+        otra = VentaProducto.objects.get(venta=venta, producto=self.p2)
+        otra.producto = self.p1
+        otra.save()
+        VentaProducto.objects.create(venta=venta, producto=self.p2, cantidad=3, precio=0)
+        incremental = {clave: valor for clave, valor in self.filas().items() if valor[2]}
+        self.assertEqual(incremental[(None, 'efectivo')], (9, Decimal('9000'), 2))
+
+        call_command('reconstruir_resumen', stdout=StringIO())
+        self.assertEqual(self.filas(), incremental)
+
+    def test_validar_ventas_lee_solo_el_resumen(self):
+        self.vender([(self.p1, 2)])
+        hoy = localdate().isoformat()
+        url = reverse('validar_ventas')
+        with CaptureQueriesContext(connection) as ctx:
+            datos = self.client.get(url, {'fecha_inicio': hoy, 'fecha_fin': hoy, 'producto': self.p1.pk}).json()
+        self.assertTrue(datos['existe'])
+        self.assertFalse(any('"trabajadores_venta"' in q['sql'] for q in ctx.captured_queries))
+        datos = self.client.get(url, {'fecha_inicio': hoy, 'fecha_fin': hoy, 'producto': self.p2.pk}).json()
+        self.assertFalse(datos['existe'])
+
+    def test_resumen_por_dia(self):
+        self.vender([(self.p1, 2)])
+        self.vender([(self.p2, 1)], metodo_pago='tarjeta')
+        datos = self.client.get(reverse('ventas_resumen')).json()
+        self.assertEqual(datos['ventas'], 2)
+        self.assertEqual(datos['unidades'], 3)
+        self.assertEqual(datos['dias'], [
+            {'fecha': localdate().isoformat(), 'ventas': 2, 'unidades': 3, 'ingresos': '3000.00'}
+        ])
+
+
+class DevolucionParcialTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+        self.p1, self.p2 = self.crear_productos(2, cantidad=50, precio=1000)
+        self.venta = registrar_venta(
+            Venta(cliente="Cliente", vendedor=self.usuario), [(self.p1, 3), (self.p2, 2)], self.usuario
+        )
+        self.l1, self.l2 = self.venta.ventaproducto_set.order_by('id')
+
+    def filas(self):
+        return {
+            fila.producto_id: (fila.unidades, fila.ingresos, fila.ventas)
+            for fila in ResumenVentaDiaria.objects.all()
+        }
+
+    def test_devolucion_parcial_por_lineas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(
+                reverse('devolver_venta', args=[self.venta.pk]),
+                {f'devolver_{self.l1.pk}': '1', f'devolver_{self.l2.pk}': '2'},
+            )
+        self.assertRedirects(respuesta, reverse('venta_detail', args=[self.venta.pk]))
+        self.venta.refresh_from_db()
+        self.assertFalse(self.venta.devolucion)
+        self.assertEqual(self.venta.total_devuelto, Decimal('3000'))
+        self.assertEqual(
+            list(self.venta.ventaproducto_set.order_by('id').values_list('cantidad_devuelta', flat=True)), [1, 2]
+        )
+        self.p1.refresh_from_db()
+        self.p2.refresh_from_db()
+        self.assertEqual((self.p1.cantidad, self.p2.cantidad), (48, 50))
+        # La venta sigue contando para el día y para p1, ya no para p2
+        self.assertEqual(self.filas(), {
+            None: (2, Decimal('2000'), 1),
+            self.p1.pk: (2, Decimal('2000'), 1),
+            self.p2.pk: (0, Decimal('0'), 0),
+        })
+        self.assertEqual(
+            HistorialProducto.objects.filter(tipo_cambio=HistorialProducto.DEVOLUCION).count(), 2
+        )
+
+        # No se devuelve más de lo que queda y al terminar la venta queda devuelta
+        venta, devueltas = devolver_venta(self.venta.pk, self.usuario, {self.l1.pk: 10})
+        self.assertEqual([unidades for _, unidades in devueltas], [2])
+        self.assertTrue(venta.devolucion)
+        self.assertEqual(venta.total_neto, 0)
+        self.assertEqual(self.filas()[None], (0, Decimal('0'), 0))
+        self.assertEqual(devolver_venta(self.venta.pk, self.usuario)[1], [])
+        self.p1.refresh_from_db()
+        self.assertEqual(self.p1.cantidad, 50)
+
+    def test_linea_de_producto_eliminado_no_cierra_el_dia(self):
+        self.p2.delete()
+        self.l2.refresh_from_db()
+        venta, devueltas = devolver_venta(self.venta.pk, self.usuario, {self.l2.pk: 2})
+        self.assertEqual([unidades for _, unidades in devueltas], [2])
+        self.assertFalse(venta.devolucion)
+        self.assertEqual(self.filas()[None], (3, Decimal('3000'), 1))
+        self.assertEqual(self.filas()[self.p1.pk], (3, Decimal('3000'), 1))
+        self.assertTrue(hay_ventas(filtrar_resumen(self.usuario)))
+
+    def test_reconstruir_descuenta_lo_devuelto(self):
+        devolver_venta(self.venta.pk, self.usuario, {self.l1.pk: 1, self.l2.pk: 2})
+        incremental = {clave: valor for clave, valor in self.filas().items() if valor[2]}
+        reconstruir()
+        self.assertEqual(self.filas(), incremental)
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            devolver_venta(self.venta.pk, self.usuario, {self.l1.pk: 1})
+        otra = registrar_venta(
+            Venta(cliente="Otro", vendedor=self.usuario),
+            [(producto, 1) for producto in self.crear_productos(8, cantidad=5)], self.usuario,
+        )
+        with CaptureQueriesContext(connection) as ctx_grande:
+            devolver_venta(otra.pk, self.usuario)
+        self.assertEqual(len(ctx_grande.captured_queries), len(ctx.captured_queries))
+
+    def test_error_deshace_todo(self):
+        with mock.patch('trabajadores.services.aplicar_venta', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                devolver_venta(self.venta.pk, self.usuario)
+        self.p1.refresh_from_db()
+        self.assertEqual(self.p1.cantidad, 47)
+        self.assertFalse(self.venta.ventaproducto_set.filter(cantidad_devuelta__gt=0).exists())
+        self.assertTrue(devolver_venta(self.venta.pk, self.usuario)[0].devolucion)
+        self.p1.refresh_from_db()
+        self.assertEqual(self.p1.cantidad, 50)
+
+    def test_reporte_muestra_lo_vendido_neto(self):
+        devolver_venta(self.venta.pk, self.usuario, {self.l2.pk: 2})
+        [(venta, productos)] = list(reportes.ventas_por_lotes(Venta.objects.all()))
+        self.assertEqual(productos, [(3, self.p1.nombre)])
+        self.assertEqual(venta.total_neto, Decimal('3000'))
+
+    def test_solo_staff(self):
+        vendedor = User.objects.create_user("vendedor", password="x")
+        self.client.force_login(vendedor)
+        respuesta = self.client.post(reverse('devolver_venta', args=[self.venta.pk]))
+        self.assertEqual(respuesta.status_code, 403)
+        self.venta.refresh_from_db()
+        self.assertFalse(self.venta.devolucion)
+
+
+class FiltroFechasTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_superuser=True)
+        self.otro = User.objects.create_user("vendedor", password="x")
+
+    def crear_venta(self, fecha, **kwargs):
+        venta = Venta.objects.create(cliente="Cliente", vendedor=kwargs.pop('vendedor', self.usuario), **kwargs)
+        Venta.objects.filter(pk=venta.pk).update(fecha_creacion=fecha)
+        return venta
+
+    def plan(self, usuario, parametros):
+        return filtrar_ventas(usuario, parametros).explain()
+
+    def test_dia_local_como_rango_semiabierto(self):
+        bogota = ZoneInfo('America/Bogota')
+        dentro = [
+            self.crear_venta(datetime(2025, 3, 10, 0, 0, tzinfo=bogota)),
+            self.crear_venta(datetime(2025, 3, 10, 23, 30, tzinfo=bogota)),
+        ]
+        self.crear_venta(datetime(2025, 3, 9, 23, 59, tzinfo=bogota))
+        self.crear_venta(datetime(2025, 3, 11, 0, 0, tzinfo=bogota))
+        self.crear_venta(datetime(2025, 3, 10, 12, 0, tzinfo=bogota), devolucion=True)
+
+        ventas = filtrar_ventas(self.usuario, {'dia': '2025-03-10'})
+        self.assertEqual(set(ventas), set(dentro))
+        ventas = filtrar_ventas(self.usuario, {'fecha_inicio': '2025-03-10', 'fecha_fin': '2025-03-10'})
+        self.assertEqual(set(ventas), set(dentro))
+        self.assertEqual(filtrar_ventas(self.usuario, {'fecha_inicio': '2025-03-09'}).count(), 4)
+
+    def test_filtros_usan_indices_compuestos(self):
+        casos = [
+            (self.usuario, {'dia': '2025-03-10'}, 'venta_devolucion_fecha'),
+            (self.otro, {'fecha_inicio': '2025-03-01', 'fecha_fin': '2025-03-31'}, 'venta_vendedor_fecha'),
+            (self.usuario, {'dia': '2025-03-10', 'vendedor': str(self.otro.pk)}, 'venta_vendedor_fecha'),
+            (self.usuario, {'dia': '2025-03-10', 'metodo_pago': 'tarjeta'}, 'venta_metodo_pago_fecha'),
+        ]
+        for usuario, parametros, indice in casos:
+            with self.subTest(parametros=parametros):
+                plan = self.plan(usuario, parametros)
+                self.assertIn(f'USING INDEX {indice} (', plan)
+                self.assertIn('fecha_creacion>? AND fecha_creacion<?', plan)
+                self.assertNotIn('SCAN trabajadores_venta', plan)
+
+        plan = self.plan(self.usuario, {'fecha_inicio': '2025-03-01', 'producto': '1'})
+        self.assertIn('USING COVERING INDEX ventaproducto_producto_venta (producto_id=?)', plan)
+
+
+@override_settings(REPORTES_HILOS=0)
+class TicketVentaTests(ReporteJobMixin, VentaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        EmpresaNombre.objects.create(nombre="Mi Tienda", nit=900123)
+        producto = self.crear_productos(1)[0]
+        self.venta = registrar_venta(
+            Venta(cliente="Cliente", vendedor=self.usuario), [(producto, 2)], self.usuario
+        )
+        self.url = reverse('venta_pdf', args=[self.venta.pk])
+
+    def tickets_guardados(self):
+        directorio = os.path.join(self.media, 'tickets', str(self.venta.pk))
+        return sorted(os.listdir(directorio)) if os.path.isdir(directorio) else []
+
+    def test_genera_una_vez_y_responde_304(self):
+        with mock.patch('trabajadores.tickets.escribir_ticket', wraps=tickets.escribir_ticket) as escribir:
+            respuesta = self.client.get(self.url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+            self.assertIn('ticket_venta_', respuesta['Content-Disposition'])
+            etag = respuesta['ETag']
+            self.assertTrue(respuesta.has_header('Last-Modified'))
+
+            respuesta = self.client.get(self.url)
+            b''.join(respuesta.streaming_content)
+            self.assertEqual(respuesta['ETag'], etag)
+            self.assertEqual(escribir.call_count, 1)
+
+        self.assertEqual(len(self.tickets_guardados()), 1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        ultima = respuesta['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=ultima).status_code, 304)
+
+    def test_devolucion_cambia_etag_y_borra_el_ticket(self):
+        respuesta = self.client.get(self.url)
+        b''.join(respuesta.streaming_content)
+        anterior = self.tickets_guardados()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('devolver_venta', args=[self.venta.pk]))
+        self.assertEqual(self.tickets_guardados(), [])
+
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=anterior[0][:-4])
+        self.assertEqual(respuesta.status_code, 200)
+        b''.join(respuesta.streaming_content)
+        self.assertNotEqual(self.tickets_guardados(), anterior)
+
+    def test_editar_linea_o_empresa_cambia_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        linea = self.venta.ventaproducto_set.get()
+        linea.cantidad = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            linea.save()
+        self.assertEqual(self.tickets_guardados(), [])
+        nuevo = self.client.get(self.url)['ETag']
+        self.assertNotEqual(nuevo, etag)
+
+        EmpresaNombre.objects.update(nombre="Otra Tienda")
+        invalidar_empresa()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], nuevo)
+
+    @override_settings(TICKETS_PRERENDER=True)
+    def test_prerender_despues_del_commit(self):
+        producto = self.crear_productos(1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            venta = registrar_venta(Venta(cliente="Otro", vendedor=self.usuario), [(producto, 1)], self.usuario)
+        self.venta = venta
+        self.assertEqual(len(self.tickets_guardados()), 1)
+        with mock.patch('trabajadores.tickets.escribir_ticket') as escribir:
+            respuesta = self.client.get(reverse('venta_pdf', args=[venta.pk]))
+            b''.join(respuesta.streaming_content)
+        escribir.assert_not_called()
+
+
+class TicketEscposTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user("cajero", password="x")
+        self.client.force_login(self.usuario)
+        EmpresaNombre.objects.create(nombre="Mi Tienda", nit=900123)
+        invalidar_empresa()
+        productos = self.crear_productos(2, precio=1500)
+        self.venta = registrar_venta(
+            Venta(cliente="Cliente", vendedor=self.usuario), [(productos[0], 2), (productos[1], 1)], self.usuario
+        )
+
+    def descargar(self, **extra):
+        return self.client.get(reverse('venta_escpos', args=[self.venta.pk]), **extra)
+
+    def test_mismo_contenido_que_el_pdf(self):
+        respuesta = self.descargar()
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.content
+        self.assertTrue(datos.startswith(tickets.ESC_INICIAR))
+        self.assertTrue(datos.endswith(tickets.GS_CORTAR))
+
+        venta = Venta.objects.select_related('vendedor').get(pk=self.venta.pk)
+        renglones = list(tickets.renglones_ticket(venta, list(venta.ventaproducto_set.all()), obtener_empresa()))
+        for renglon in renglones:
+            self.assertIn(renglon.texto.encode('cp850'), datos)
+        self.assertIn(b"TOTAL:".ljust(20) + b"$4,500".rjust(8), datos)
+        self.assertIn(tickets.ESC_NEGRITA + b"Mi Tienda", datos)
+
+        self.assertEqual(self.descargar(HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+        self.assertNotEqual(respuesta['ETag'], self.client.get(reverse('venta_pdf', args=[self.venta.pk]))['ETag'])
+
+    def test_imprime_en_archivo_de_spool(self):
+        spool = tempfile.NamedTemporaryFile(delete=False)
+        spool.close()
+        self.addCleanup(os.remove, spool.name)
+        with override_settings(TICKETS_IMPRESORA=spool.name):
+            respuesta = self.client.post(reverse('venta_imprimir', args=[self.venta.pk]))
+        self.assertRedirects(respuesta, reverse('venta_detail', args=[self.venta.pk]), fetch_redirect_response=False)
+        with open(spool.name, 'rb') as archivo:
+            self.assertEqual(archivo.read(), self.descargar().content)
+
+    def test_imprime_por_socket(self):
+        import socket
+        servidor = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(servidor.close)
+        recibido = bytearray()
+
+        def recibir():
+            conexion, _ = servidor.accept()
+            with conexion:
+                while bloque := conexion.recv(4096):
+                    recibido.extend(bloque)
+
+        hilo = threading.Thread(target=recibir)
+        hilo.start()
+        with override_settings(TICKETS_IMPRESORA=f"tcp://127.0.0.1:{servidor.getsockname()[1]}"):
+            self.client.post(reverse('venta_imprimir', args=[self.venta.pk]))
+        hilo.join(5)
+        self.assertEqual(bytes(recibido), self.descargar().content)
+
+    def test_impresora_de_red_sin_puerto_usa_el_9100(self):
+        with mock.patch('trabajadores.tickets.socket.create_connection') as conectar:
+            tickets.enviar_a_impresora(b"datos", "tcp://impresora")
+        self.assertEqual(conectar.call_args.args[0], ("impresora", 9100))
+
+        with override_settings(TICKETS_IMPRESORA="tcp://impresora:abc"):
+            respuesta = self.client.post(reverse('venta_imprimir', args=[self.venta.pk]))
+        avisos = [str(aviso) for aviso in get_messages(respuesta.wsgi_request)]
+        self.assertEqual(avisos, ["TICKETS_IMPRESORA no es válida: 'tcp://impresora:abc'."])
+
+    def test_sin_impresora_avisa(self):
+        respuesta = self.client.post(reverse('venta_imprimir', args=[self.venta.pk]))
+        avisos = [str(aviso) for aviso in get_messages(respuesta.wsgi_request)]
+        self.assertEqual(avisos, ["TICKETS_IMPRESORA no está configurada."])
+        self.assertEqual(self.client.get(reverse('venta_imprimir', args=[self.venta.pk])).status_code, 405)
+
+
+class TicketLoteTests(ReporteJobMixin, VentaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cajero = User.objects.create_user("cajero", password="x")
+        self.productos = self.crear_productos(3)
+        self.ventas = [
+            registrar_venta(
+                Venta(cliente=f"Cliente {i}", vendedor=self.usuario if i % 2 else self.cajero),
+                [(producto, 1) for producto in self.productos[:i % 3 + 1]], self.usuario,
+            )
+            for i in range(5)
+        ]
+
+    def paginas(self, pdf):
+        return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+    def pedir(self, **datos):
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = self.client.get(reverse('venta_tickets'), datos)
+        contenido = b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content
+        return respuesta, contenido, len(ctx.captured_queries)
+
+    def test_un_pdf_con_un_ticket_por_pagina(self):
+        respuesta, pdf, _ = self.pedir()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(f'tickets_{localdate().isoformat()}.pdf', respuesta['Content-Disposition'])
+        self.assertEqual(self.paginas(pdf), 5)
+
+        ids = ",".join(str(venta.pk) for venta in self.ventas[:2])
+        _, pdf, _ = self.pedir(ids=ids)
+        self.assertEqual(self.paginas(pdf), 2)
+
+    def test_consultas_constantes(self):
+        _, _, pocas = self.pedir(ids=self.ventas[0].pk)
+        _, _, todas = self.pedir(ids=",".join(str(venta.pk) for venta in self.ventas))
+        self.assertEqual(pocas, todas)
+
+    def test_zip_con_un_pdf_por_venta(self):
+        respuesta, contenido, _ = self.pedir(formato='zip', vendedor=self.cajero.pk)
+        self.assertEqual(respuesta['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(contenido)) as comprimido:
+            nombres = comprimido.namelist()
+            self.assertEqual(nombres, [f"ticket_venta_{venta.pk}.pdf" for venta in self.ventas[::2]])
+            primero = comprimido.read(nombres[0])
+        self.assertEqual(self.paginas(primero), 1)
+        # Los PDF del zip son los mismos que sirve venta_pdf
+        respuesta = self.client.get(reverse('venta_pdf', args=[self.ventas[0].pk]))
+        self.assertEqual(b''.join(respuesta.streaming_content), primero)
+
+    def test_alcance_y_errores(self):
+        self.client.force_login(self.cajero)
+        _, pdf, _ = self.pedir(ids=",".join(str(venta.pk) for venta in self.ventas))
+        self.assertEqual(self.paginas(pdf), 3)
+        self.assertEqual(self.pedir(ids=self.ventas[1].pk)[0].status_code, 404)
+        self.assertEqual(self.pedir(formato='docx')[0].status_code, 400)
+        self.assertEqual(self.pedir(fecha_inicio='2025-02-30')[0].status_code, 400)
+
+
+class ImagenCheckoutTests(ReporteJobMixin, VentaTestMixin, TestCase):
+    """Cobrar, devolver o cambiar el stock no vuelve a decodificar la imagen del producto."""
+
+    def setUp(self):
+        super().setUp()
+        self.con_imagen, self.sin_imagen = self.crear_productos(2, cantidad=1000)
+        os.makedirs(os.path.join(self.media, 'productos'))
+        # Imagen grande puesta directamente, como las subidas antes de reducirlas
+        Image.effect_noise((3000, 3000), 64).save(os.path.join(self.media, 'productos', 'grande.png'))
+        Producto.objects.filter(pk=self.con_imagen.pk).update(imagen='productos/grande.png')
+        self.con_imagen.refresh_from_db()
+
+    def cobrar(self, producto, n):
+        """Tiempo de `n` cobros, cada uno seguido de su devolución."""
+        inicio = time.perf_counter()
+        for i in range(n):
+            venta = registrar_venta(Venta(cliente=f"Cliente {i}", vendedor=self.usuario), [(producto, 1)], self.usuario)
+            self.client.post(reverse('devolver_venta', args=[venta.pk]))
+        return time.perf_counter() - inicio
+
+    def test_no_decodifica_la_imagen(self):
+        with mock.patch('PIL.Image.open', wraps=Image.open) as abrir:
+            venta = registrar_venta(Venta(cliente="Cliente", vendedor=self.usuario), [(self.con_imagen, 2)], self.usuario)
+            linea = venta.ventaproducto_set.select_related('producto').get()
+            linea.cantidad = 3
+            linea.save()
+            self.client.post(reverse('devolver_venta', args=[venta.pk]))
+            producto = Producto.objects.get(pk=self.con_imagen.pk)
+            producto.cantidad = 500
+            producto.save()
+        abrir.assert_not_called()
+        self.assertEqual(Producto.objects.get(pk=self.con_imagen.pk).cantidad, 500)
+
+    def test_cambiar_la_imagen_si_la_procesa(self):
+        producto = Producto.objects.get(pk=self.sin_imagen.pk)
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100)).save(buffer, format='PNG')
+        producto.imagen = SimpleUploadedFile("nueva.png", buffer.getvalue())
+        with mock.patch('administracion.models.generar_variantes') as generar:
+            producto.save()
+            producto.save()
+        self.assertEqual(generar.call_count, 1)
+
+    def test_benchmark_cobro_no_depende_de_la_imagen(self):
+        self.cobrar(self.sin_imagen, 3)
+        tiempos = {}
+        for nombre, producto in (('sin_imagen', self.sin_imagen), ('con_imagen', self.con_imagen)):
+            tiempos[nombre] = min(self.cobrar(producto, 10) for _ in range(3))
+        self.assertLess(tiempos['con_imagen'], tiempos['sin_imagen'] * 1.5 + 0.05)
+
+
+
+class EliminarVentasTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(self.usuario)
+        self.p1, self.p2 = self.crear_productos(2, cantidad=50, precio=1000)
+
+    def vender(self, lineas):
+        return registrar_venta(Venta(cliente="Cliente", vendedor=self.usuario), lineas, self.usuario)
+
+    def stock(self):
+        return list(Producto.objects.filter(pk__in=[self.p1.pk, self.p2.pk]).order_by('pk').values_list('cantidad', flat=True))
+
+    def test_devuelve_solo_lo_pendiente(self):
+        venta = self.vender([(self.p1, 3), (self.p2, 2), (self.p1, 1)])
+        otra = self.vender([(self.p2, 4)])
+        devolver_venta(venta.pk, self.usuario, {venta.ventaproducto_set.order_by('id').first().pk: 2})
+        self.assertEqual(self.stock(), [48, 44])
+
+        total, por_modelo = eliminar_ventas(Venta.objects.filter(pk__in=[venta.pk, otra.pk]))
+        self.assertEqual(total, 6)
+        self.assertEqual(por_modelo, {'trabajadores.Venta': 2, 'trabajadores.VentaProducto': 4})
+        self.assertEqual(self.stock(), [50, 50])
+        self.assertFalse(VentaProducto.objects.exists())
+
+    def test_consultas_no_dependen_de_las_lineas(self):
+        pocas = self.vender([(self.p1, 1)])
+        muchas = self.vender([(producto, 1) for producto in self.crear_productos(10, cantidad=5)])
+        with CaptureQueriesContext(connection) as ctx:
+            eliminar_ventas(Venta.objects.filter(pk=pocas.pk))
+        with CaptureQueriesContext(connection) as ctx_muchas:
+            eliminar_ventas(Venta.objects.filter(pk=muchas.pk))
+        self.assertEqual(len(ctx_muchas.captured_queries), len(ctx.captured_queries))
+
+    def test_borrar_venta_no_ajusta_su_total(self):
+        venta = self.vender([(self.p1, 2), (self.p2, 1)])
+        with CaptureQueriesContext(connection) as ctx:
+            venta.delete()
+        self.assertFalse(any(q['sql'].startswith('UPDATE "trabajadores_venta"') for q in ctx.captured_queries))
+        self.assertEqual(self.stock(), [50, 50])
+
+    def test_eliminar_lineas_ajusta_totales(self):
+        venta = self.vender([(self.p1, 3), (self.p2, 2)])
+        l1, l2 = venta.ventaproducto_set.order_by('id')
+        devolver_venta(venta.pk, self.usuario, {l1.pk: 1})
+        eliminar_lineas(VentaProducto.objects.filter(pk=l1.pk))
+        venta.refresh_from_db()
+        self.assertEqual((venta.total, venta.total_devuelto), (Decimal('2000'), Decimal('0')))
+        self.assertEqual(self.stock(), [50, 48])
+
+    def filas(self):
+        return {
+            fila.producto_id: (fila.unidades, fila.ingresos, fila.ventas)
+            for fila in ResumenVentaDiaria.objects.all()
+        }
+
+    def test_borrar_resta_del_resumen(self):
+        queda = self.vender([(self.p1, 1)])
+        venta = self.vender([(self.p1, 3), (self.p2, 2)])
+        devuelta = self.vender([(self.p2, 4)])
+        devolver_venta(devuelta.pk, self.usuario)
+        devolver_venta(venta.pk, self.usuario, {venta.ventaproducto_set.get(producto=self.p1).pk: 1})
+
+        eliminar_ventas(Venta.objects.filter(pk__in=[venta.pk, devuelta.pk]))
+        total = totales(filtrar_resumen(self.usuario))
+        self.assertEqual((total['cantidad'], total['unidades'], total['ingresos']), (1, 1, Decimal('1000')))
+        self.assertEqual(self.filas()[self.p1.pk], (1, Decimal('1000'), 1))
+        self.assertEqual(self.filas()[self.p2.pk], (0, Decimal('0'), 0))
+        self.assertTrue(Venta.objects.filter(pk=queda.pk).exists())
+
+        # Lo mismo al borrar por las señales de cada fila
+        incremental = self.filas()
+        otra = self.vender([(self.p2, 2)])
+        otra.delete()
+        self.assertEqual(self.filas(), incremental)
+
+    def test_borrar_lineas_resta_del_resumen(self):
+        venta = self.vender([(self.p1, 3), (self.p2, 2), (self.p2, 1)])
+        l1, l2, l3 = venta.ventaproducto_set.order_by('id')
+        eliminar_lineas(VentaProducto.objects.filter(pk__in=[l1.pk, l2.pk]))
+        self.assertEqual(self.filas(), {
+            None: (1, Decimal('1000'), 1),
+            self.p1.pk: (0, Decimal('0'), 0),
+            self.p2.pk: (1, Decimal('1000'), 1),
+        })
+        l3.delete()
+        self.assertEqual(self.filas()[self.p2.pk], (0, Decimal('0'), 0))
+        self.assertEqual(self.filas()[None], (0, Decimal('0'), 1))
+
+        # Varias líneas del mismo producto borradas juntas cierran la fila una sola vez
+        otra = self.vender([(self.p1, 1), (self.p1, 2)])
+        otra.ventaproducto_set.all().delete()
+        self.assertEqual(self.filas()[self.p1.pk], (0, Decimal('0'), 0))
+        incremental = {clave: valor for clave, valor in self.filas().items() if valor[2]}
+        reconstruir()
+        self.assertEqual(self.filas(), incremental)
+
+    def test_accion_del_admin(self):
+        ventas = [self.vender([(self.p1, 2)]), self.vender([(self.p2, 3)])]
+        respuesta = self.client.post(reverse('admin:trabajadores_venta_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': [venta.pk for venta in ventas],
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(Venta.objects.exists())
+        self.assertEqual(self.stock(), [50, 50])
+        self.assertEqual(totales(filtrar_resumen(self.usuario))['cantidad'], 0)
+
+
+class ArchivoVentasTests(VentaTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user("cajero", password="x")
+
+    def test_archiva_ventas_viejas_sin_tocar_stock_ni_resumen(self):
+        from administracion.archivo import leer_segmento
+        from administracion.models import SegmentoArchivo
+
+        producto, = self.crear_productos(1, cantidad=10)
+        vieja = registrar_venta(Venta(cliente="Ana", vendedor=self.usuario), [(producto, 2)], self.usuario)
+        reciente = registrar_venta(Venta(cliente="Luis", vendedor=self.usuario), [(producto, 1)], self.usuario)
+        fecha = vieja.fecha_creacion - timedelta(days=400)
+        Venta.objects.filter(pk=vieja.pk).update(fecha_creacion=fecha)
+        reconstruir()
+        resumen = list(ResumenVentaDiaria.objects.values_list('unidades', flat=True).order_by('fecha'))
+
+        salida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archivar', meses=12, ventas=True, stdout=salida)
+        self.assertIn(f"Ventas {localdate(fecha):%Y-%m}: 1 venta(s) archivada(s).", salida.getvalue())
+
+        self.assertEqual(list(Venta.objects.all()), [reciente])
+        self.assertFalse(VentaProducto.objects.filter(venta_id=vieja.pk).exists())
+        producto.refresh_from_db()
+        self.assertEqual(producto.cantidad, 7)
+        self.assertEqual(list(ResumenVentaDiaria.objects.values_list('unidades', flat=True).order_by('fecha')), resumen)
+
+        segmento = SegmentoArchivo.objects.get(tipo=SegmentoArchivo.VENTAS)
+        fila, = leer_segmento(segmento.archivo)
+        self.assertEqual((fila['id'], fila['cliente'], fila['vendedor'], fila['total']), (vieja.pk, "Ana", "cajero", "2000.00"))
+        self.assertEqual(fila['lineas'], [{
+            'producto_id': producto.pk, 'nombre_producto': "Producto 0", 'cantidad': 2,
+            'precio': "1000.00", 'subtotal': "2000.00", 'cantidad_devuelta': 0,
+        }])
+
+    def test_reconstruir_conserva_los_meses_archivados(self):
+        producto, = self.crear_productos(1, cantidad=10)
+        vieja = registrar_venta(Venta(cliente="Ana", vendedor=self.usuario), [(producto, 2)], self.usuario)
+        registrar_venta(Venta(cliente="Luis", vendedor=self.usuario), [(producto, 1)], self.usuario)
+        fecha = vieja.fecha_creacion - timedelta(days=400)
+        Venta.objects.filter(pk=vieja.pk).update(fecha_creacion=fecha)
+        reconstruir()
+        resumen = set(ResumenVentaDiaria.objects.values_list('fecha', 'producto_id', 'unidades', 'ventas'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archivar', meses=12, ventas=True, stdout=StringIO())
+        call_command('reconstruir_resumen', stdout=StringIO())
+        self.assertEqual(set(ResumenVentaDiaria.objects.values_list('fecha', 'producto_id', 'unidades', 'ventas')), resumen)
+
+        # El PDF de un rango archivado lo informa en lugar de salir vacío
+        admin = User.objects.create_user("admin", password="x", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        dia = localdate(fecha).isoformat()
+        respuesta = self.client.get(reverse('venta_export_pdf'), {'fecha_inicio': dia, 'fecha_fin': dia})
+        self.assertContains(respuesta, f"están archivadas ({localdate(fecha):%Y-%m})")
+        # Con parte del rango vivo el PDF lleva solo las ventas que siguen en el sistema
+        respuesta = self.client.get(
+            reverse('venta_export_pdf'), {'fecha_inicio': dia, 'fecha_fin': localdate().isoformat()}
+        )
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+
+
 # Para ejecutar este test desde la línea de comandos:
 if __name__ == "__main__":
     test_generate_pdf()
@@ -0,0 +1,295 @@
+"""
+Tickets de venta en PDF guardados en disco.
+
+Una venta terminada casi nunca cambia, así que el ticket se dibuja una vez y
+se guarda en el storage (TICKETS_DIR/<venta>/<versión>.pdf). La versión
+combina la fecha_actualizacion de la venta y un hash de los datos de la
+empresa que aparecen en el ticket: si cambia cualquiera de los dos el ticket
+se vuelve a generar, y la misma versión sirve de ETag para responder 304.
+Los archivos viejos se borran al devolver o editar la venta (ver signals.py).
+
+El mismo contenido (renglones_ticket) sale también como bytes ESC/POS para
+mandarlo directo a una impresora térmica sin pasar por el PDF, y varios
+tickets pueden salir juntos en un PDF o un zip (generar_tickets).
+"""
+import hashlib
+import logging
+import socket
+import zipfile
+from collections import namedtuple
+from tempfile import SpooledTemporaryFile
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils.timezone import localtime
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from administracion.empresa import obtener_empresa
+from .filtros import filtro_parametros
+from .models import Venta
+from .reportes import format_price
+
+logger = logging.getLogger(__name__)
+
+
+def directorio_tickets(venta_id):
+    return f"{getattr(settings, 'TICKETS_DIR', 'tickets')}/{venta_id}"
+
+
+def version_empresa(empresa):
+    """Hash corto de los datos de la empresa que se imprimen en el ticket."""
+    datos = f"{empresa.nombre}|{empresa.nit or ''}" if empresa else ''
+    return hashlib.sha1(datos.encode()).hexdigest()[:12]
+
+
+def version_ticket(venta, empresa):
+    """Identifica el contenido del ticket; se usa como ETag y nombre de archivo."""
+    marca = int(venta.fecha_actualizacion.timestamp() * 1_000_000)
+    return f"{venta.pk}-{marca}-{version_empresa(empresa)}"
+
+
+def nombre_ticket(venta, empresa):
+    return f"{directorio_tickets(venta.pk)}/{version_ticket(venta, empresa)}.pdf"
+
+
+def linea_ticket(cantidad, nombre_producto, subtotal):
+    """Línea de producto de 32 columnas: cantidad, nombre y subtotal."""
+    producto = (nombre_producto[:12] if nombre_producto else "Producto eliminado").ljust(15)
+    return f"{str(cantidad).rjust(2)}     {producto}{format_price(subtotal).rjust(8)}"
+
+
+# Un renglón del ticket: texto, alineación, estilo (la letra grande solo
+# aplica al PDF) y el espacio en mm que lo separa del siguiente
+Renglon = namedtuple('Renglon', 'texto centrado negrita grande salto')
+
+
+def renglones_ticket(venta, lineas, empresa):
+    """
+    Contenido del ticket, común al PDF y a ESC/POS. `lineas` son los
+    VentaProducto de la venta ya leídos; el total se suma en la misma pasada.
+    """
+    nombre_empresa = (empresa.nombre or "") if empresa else ""
+    nit = f"NIT:{empresa.nit}" if empresa and empresa.nit else "NIT: N/A"
+    separador = "-" * 32
+
+    # Encabezado
+    yield Renglon(nombre_empresa, True, True, True, 5)
+    yield Renglon(nit, True, True, True, 5)
+    yield Renglon(localtime(venta.fecha_creacion).strftime('%Y-%m-%d %H:%M'), True, True, True, 10)
+
+    # Datos cliente/vendedor
+    yield Renglon(f"Cliente: {venta.cliente}", False, False, False, 5)
+    yield Renglon(f"Vendedor: {venta.vendedor.username}", False, False, False, 10)
+    yield Renglon(separador, False, False, False, 5)
+
+    # Encabezado productos
+    yield Renglon("Cant   Producto       Subtotal", False, True, False, 5)
+    yield Renglon(separador, False, True, False, 5)
+
+    # Productos
+    total_venta = 0
+    for item in lineas:
+        yield Renglon(linea_ticket(item.cantidad, item.nombre_producto, item.subtotal), False, False, False, 5)
+        total_venta += item.subtotal
+
+    # Total
+    yield Renglon(separador, False, False, False, 5)
+    yield Renglon("TOTAL:".ljust(20) + format_price(total_venta).rjust(8), False, True, True, 10)
+
+    # Mensaje final
+    yield Renglon(f"Gracias por su compra {venta.cliente}!", True, False, False, 5)
+    yield Renglon(nombre_empresa, True, True, True, 0)
+
+
+def dibujar_ticket(pdf, venta, lineas, empresa):
+    """
+    Dibuja el ticket de `venta` en una página propia de `pdf` (80 mm de
+    ancho y el alto que necesiten sus líneas) y la cierra.
+    """
+    # Cálculo dinámico de altura
+    altura_fija = 85  # Altura base en mm (elementos fijos)
+    altura_por_producto = 5  # Altura por producto en mm
+    sum_deltas = (altura_fija + altura_por_producto * len(lineas)) * mm
+    ticket_height = sum_deltas + 10 * mm  # Margen superior adicional
+    ticket_width = 80 * mm
+
+    pdf.setPageSize((ticket_width, ticket_height))
+    y = ticket_height - 10 * mm  # Margen superior inicial
+
+    for renglon in renglones_ticket(venta, lineas, empresa):
+        pdf.setFont("Courier-Bold" if renglon.negrita else "Courier", 10 if renglon.grande else 9)
+        if renglon.centrado:
+            pdf.drawCentredString(ticket_width / 2, y, renglon.texto)
+        else:
+            pdf.drawString(5 * mm, y, renglon.texto)
+        y -= renglon.salto * mm
+
+    pdf.showPage()
+
+
+def escribir_ticket(destino, venta, lineas, empresa):
+    """Escribe en `destino` el PDF con el ticket de `venta`."""
+    pdf = canvas.Canvas(destino)
+    dibujar_ticket(pdf, venta, lineas, empresa)
+    pdf.save()
+
+
+def filtrar_tickets(usuario, parametros, ids=None):
+    """
+    Ventas para imprimir o archivar sus tickets en bloque, en orden de
+    creación: las de `ids` si se dan y, si no, las del día o rango de
+    fechas de `parametros` (ver reportes.parametros_reporte). Incluye las
+    devueltas. Las líneas se traen con un solo prefetch.
+    """
+    queryset = Venta.objects.all() if usuario.is_superuser else Venta.objects.filter(vendedor=usuario)
+    if ids:
+        queryset = queryset.filter(pk__in=ids)
+    queryset = queryset.filter(filtro_parametros(parametros))
+
+    vendedor_id = parametros.get('vendedor')
+    if vendedor_id:
+        queryset = queryset.filter(vendedor_id=vendedor_id)
+    metodo_pago = parametros.get('metodo_pago')
+    if metodo_pago:
+        queryset = queryset.filter(metodo_pago=metodo_pago)
+
+    return (
+        queryset.select_related('vendedor')
+        .prefetch_related('ventaproducto_set')
+        .order_by('fecha_creacion', 'id')
+    )
+
+
+def generar_tickets(ventas, empresa=None, formato='pdf'):
+    """
+    Tickets de `ventas` en un archivo temporal listo para leer desde el
+    inicio: un solo PDF con un ticket por página (un único canvas) o, con
+    formato 'zip', un PDF por venta tomado de la caché de tickets.
+    """
+    if empresa is None:
+        empresa = obtener_empresa()
+    archivo = SpooledTemporaryFile(
+        max_size=getattr(settings, 'REPORTE_MEMORIA_MAXIMA', 5 * 1024 * 1024), mode='w+b'
+    )
+    try:
+        if formato == 'zip':
+            with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_DEFLATED) as comprimido:
+                for venta in ventas:
+                    with default_storage.open(obtener_ticket(venta, empresa)) as ticket:
+                        comprimido.writestr(f"ticket_venta_{venta.pk}.pdf", ticket.read())
+        else:
+            pdf = canvas.Canvas(archivo, pageCompression=1)
+            for venta in ventas:
+                dibujar_ticket(pdf, venta, list(venta.ventaproducto_set.all()), empresa)
+            pdf.save()
+    except Exception:
+        archivo.close()
+        raise
+    archivo.seek(0)
+    return archivo
+
+
+# Comandos ESC/POS
+ESC_INICIAR = b'\x1b@'
+ESC_CODIGOS_PC850 = b'\x1bt\x02'
+ESC_IZQUIERDA = b'\x1ba\x00'
+ESC_CENTRO = b'\x1ba\x01'
+ESC_NEGRITA = b'\x1bE\x01'
+ESC_NORMAL = b'\x1bE\x00'
+ESC_AVANZAR = b'\x1bd\x04'
+GS_CORTAR = b'\x1dV\x01'
+
+
+def escpos_ticket(venta, lineas, empresa):
+    """
+    Ticket en bytes ESC/POS para enviarlo directo a la impresora térmica:
+    mismo contenido que el PDF, sin reportlab. Los saltos de 10 mm del PDF
+    se convierten en una línea en blanco.
+    """
+    datos = bytearray(ESC_INICIAR + ESC_CODIGOS_PC850)
+    for renglon in renglones_ticket(venta, lineas, empresa):
+        datos += ESC_CENTRO if renglon.centrado else ESC_IZQUIERDA
+        datos += ESC_NEGRITA if renglon.negrita else ESC_NORMAL
+        datos += renglon.texto.encode('cp850', errors='replace') + b'\n'
+        if renglon.salto >= 10:
+            datos += b'\n'
+    datos += ESC_NORMAL + ESC_AVANZAR + GS_CORTAR
+    return bytes(datos)
+
+
+def enviar_a_impresora(datos, destino=None):
+    """
+    Envía `datos` a TICKETS_IMPRESORA: 'tcp://host:puerto' para una
+    impresora de red (normalmente el puerto 9100) o la ruta de un archivo
+    de spool o dispositivo (por ejemplo /dev/usb/lp0). Lanza OSError si la
+    impresora no responde e ImproperlyConfigured si el destino no es válido.
+    """
+    destino = destino or getattr(settings, 'TICKETS_IMPRESORA', '')
+    if not destino:
+        raise ImproperlyConfigured("TICKETS_IMPRESORA no está configurada.")
+    if destino.startswith('tcp://'):
+        partes = urlsplit(destino)
+        try:
+            puerto = partes.port or 9100
+        except ValueError:
+            puerto = None
+        if not partes.hostname or puerto is None:
+            raise ImproperlyConfigured(f"TICKETS_IMPRESORA no es válida: {destino!r}.")
+        timeout = getattr(settings, 'TICKETS_IMPRESORA_TIMEOUT', 5)
+        with socket.create_connection((partes.hostname, puerto), timeout=timeout) as conexion:
+            conexion.sendall(datos)
+    else:
+        with open(destino, 'ab') as archivo:
+            archivo.write(datos)
+
+
+def obtener_ticket(venta, empresa=None):
+    """
+    Nombre en el storage del ticket vigente de `venta`; lo genera si aún no
+    existe. `venta` debe traer el vendedor (select_related) para no consultar
+    de más.
+    """
+    if empresa is None:
+        empresa = obtener_empresa()
+    nombre = nombre_ticket(venta, empresa)
+    if not default_storage.exists(nombre):
+        contenido = BytesIO()
+        escribir_ticket(contenido, venta, list(venta.ventaproducto_set.all()), empresa)
+        guardado = default_storage.save(nombre, ContentFile(contenido.getvalue()))
+        if guardado != nombre:
+            # Otro proceso lo generó al mismo tiempo: se usa ese
+            default_storage.delete(guardado)
+    return nombre
+
+
+def invalidar_ticket(venta_id):
+    """Borra los tickets guardados de la venta."""
+    directorio = directorio_tickets(venta_id)
+    try:
+        _, archivos = default_storage.listdir(directorio)
+    except FileNotFoundError:
+        return 0
+    for archivo in archivos:
+        default_storage.delete(f"{directorio}/{archivo}")
+    return len(archivos)
+
+
+def prerenderizar_ticket(venta_id, cerrar_conexion=True):
+    """Genera el ticket por adelantado; se llama después del commit de la venta."""
+    if cerrar_conexion:
+        close_old_connections()
+    try:
+        venta = Venta.objects.select_related('vendedor').filter(pk=venta_id).first()
+        if venta is not None:
+            obtener_ticket(venta)
+    except Exception:
+        logger.exception("Error generando el ticket de la venta %s", venta_id)
+    finally:
+        if cerrar_conexion:
+            close_old_connections()
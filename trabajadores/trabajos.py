@@ -0,0 +1,156 @@
+"""
+Cola de reportes en segundo plano.
+
+Los reportes pesados se generan en un pool acotado de hilos del mismo
+proceso (REPORTES_HILOS) en lugar de ocupar el worker que atiende la
+petición. El estado vive en ReporteJob, así que cualquier worker puede
+responder el progreso y servir el archivo. Con REPORTES_HILOS = 0 los
+reportes se generan en el momento (útil en pruebas).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import ReporteJob
+from .reportes import filtrar_ventas, generar_reporte_ventas, nombre_reporte, resumen_ventas
+from .tickets import prerenderizar_ticket
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORTES_HILOS', 2), thread_name_prefix='reportes'
+            )
+        return _executor
+
+
+def clave_reporte(usuario, parametros, resumen):
+    """
+    Identifica un reporte: mismos filtros, mismo alcance (todas las ventas
+    para un superusuario, las propias para los demás) y mismos datos.
+    """
+    datos = {
+        'parametros': parametros,
+        'alcance': 'todas' if usuario.is_superuser else usuario.pk,
+        'cantidad': resumen['cantidad'],
+        'modificada': resumen['modificada'].isoformat() if resumen['modificada'] else None,
+    }
+    return hashlib.sha256(json.dumps(datos, sort_keys=True).encode()).hexdigest()
+
+
+def encolar_reporte(usuario, parametros):
+    """
+    Devuelve el trabajo que genera el reporte pedido, o None si no hay
+    ventas. Si ya hay uno igual en curso o terminado (y vigente), se reutiliza.
+    """
+    limpiar_reportes_vencidos()
+    resumen = resumen_ventas(filtrar_ventas(usuario, parametros))
+    if not resumen['cantidad']:
+        return None
+
+    clave = clave_reporte(usuario, parametros, resumen)
+    sin_progreso = timezone.now() - timedelta(seconds=getattr(settings, 'REPORTES_SIN_PROGRESO', 300))
+    existente = (
+        ReporteJob.objects.filter(clave=clave)
+        .exclude(estado=ReporteJob.ERROR)
+        .exclude(estado__in=[ReporteJob.PENDIENTE, ReporteJob.PROCESANDO], fecha_actualizacion__lt=sin_progreso)
+        .order_by('-fecha_creacion')
+        .first()
+    )
+    if existente:
+        return existente
+
+    job = ReporteJob.objects.create(
+        clave=clave,
+        usuario=usuario,
+        parametros=parametros,
+        ventas_totales=resumen['cantidad'],
+        nombre_archivo=nombre_reporte(parametros),
+    )
+    if getattr(settings, 'REPORTES_HILOS', 2):
+        # El hilo usa otra conexión: solo debe empezar cuando el trabajo ya está guardado
+        transaction.on_commit(lambda: executor().submit(ejecutar_reporte, job.pk))
+    else:
+        ejecutar_reporte(job.pk, cerrar_conexion=False)
+        job.refresh_from_db()
+    return job
+
+
+def ejecutar_reporte(job_id, cerrar_conexion=True):
+    """Genera el PDF del trabajo e informa el avance en la base de datos."""
+    if cerrar_conexion:
+        close_old_connections()
+    try:
+        job = ReporteJob.objects.select_related('usuario').get(pk=job_id)
+        ReporteJob.objects.filter(pk=job_id).update(estado=ReporteJob.PROCESANDO, fecha_actualizacion=timezone.now())
+
+        avance = {'ventas': 0, 'paginas': 0, 'aviso': 0.0}
+
+        def progreso(ventas, paginas):
+            avance.update(ventas=ventas, paginas=paginas)
+            # Como mucho una escritura por segundo
+            ahora = time.monotonic()
+            if ahora - avance['aviso'] >= 1:
+                avance['aviso'] = ahora
+                ReporteJob.objects.filter(pk=job_id).update(
+                    ventas_procesadas=ventas, paginas=paginas, fecha_actualizacion=timezone.now()
+                )
+
+        archivo = generar_reporte_ventas(filtrar_ventas(job.usuario, job.parametros), progreso=progreso)
+        if archivo is None:
+            raise ValueError("No hay registros de ventas para este reporte.")
+        with archivo:
+            job.archivo.save(f"reporte_{job.pk}.pdf", File(archivo), save=False)
+        ahora = timezone.now()
+        ReporteJob.objects.filter(pk=job_id).update(
+            estado=ReporteJob.TERMINADO,
+            archivo=job.archivo.name,
+            ventas_procesadas=avance['ventas'],
+            paginas=avance['paginas'],
+            fecha_actualizacion=ahora,
+            fecha_fin=ahora,
+        )
+    except Exception as error:
+        logger.exception("Error generando el reporte %s", job_id)
+        ReporteJob.objects.filter(pk=job_id).update(
+            estado=ReporteJob.ERROR, error=str(error), fecha_actualizacion=timezone.now()
+        )
+    finally:
+        if cerrar_conexion:
+            close_old_connections()
+
+
+def encolar_ticket(venta_id):
+    """Genera el ticket de la venta en el mismo pool que los reportes."""
+    if getattr(settings, 'REPORTES_HILOS', 2):
+        executor().submit(prerenderizar_ticket, venta_id)
+    else:
+        prerenderizar_ticket(venta_id, cerrar_conexion=False)
+
+
+def limpiar_reportes_vencidos(ttl=None):
+    """Elimina los trabajos y archivos con más de REPORTES_TTL segundos."""
+    ttl = getattr(settings, 'REPORTES_TTL', 3600) if ttl is None else ttl
+    limite = timezone.now() - timedelta(seconds=ttl)
+    vencidos = list(ReporteJob.objects.filter(fecha_actualizacion__lt=limite))
+    for job in vencidos:
+        if job.archivo:
+            job.archivo.delete(save=False)
+    ReporteJob.objects.filter(pk__in=[job.pk for job in vencidos]).delete()
+    return len(vencidos)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import DevolverVentaView, VentaListView, VentaDetailView, crear_venta, generar_ticket_venta, ExportVentasPDF,validar_ventas
+from .views import DevolverVentaView, VentaListView, VentaDetailView, crear_venta, generar_ticket_venta, ticket_escpos, imprimir_ticket, tickets_ventas, ExportVentasPDF,validar_ventas, opciones_reporte, estado_reporte, descargar_reporte, resumen_diario
 
 
 
@@ -8,9 +8,16 @@ urlpatterns = [
     path('', VentaListView.as_view(), name='venta_list'),
     path('<int:pk>/', VentaDetailView.as_view(), name='venta_detail'),
     path('<int:pk>/pdf/', generar_ticket_venta, name='venta_pdf'),
+    path('<int:pk>/escpos/', ticket_escpos, name='venta_escpos'),
+    path('<int:pk>/imprimir/', imprimir_ticket, name='venta_imprimir'),
     path('crear/', crear_venta, name='venta_create'),
+    path('tickets/', tickets_ventas, name='venta_tickets'),
     path('export/pdf/', ExportVentasPDF.as_view(), name='venta_export_pdf'),
     path('validar/', validar_ventas, name='validar_ventas'), 
+    path('opciones-reporte/', opciones_reporte, name='opciones_reporte'),
+    path('resumen/', resumen_diario, name='ventas_resumen'),
+    path('reportes/<int:pk>/', estado_reporte, name='reporte_estado'),
+    path('reportes/<int:pk>/descargar/', descargar_reporte, name='reporte_descargar'),
     path('<int:pk>/devolver/', DevolverVentaView.as_view(), name='devolver_venta'),
 ]
 
@@ -7,29 +7,40 @@ from django.views import View
 from django.views.generic import ListView, DetailView
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import Q, Min, Max
-import difflib
-from reportlab.lib.pagesizes import letter
-from django.utils.dateparse import parse_date
-from django.http import HttpResponse, JsonResponse
-from django.utils.timezone import localtime
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.conf import settings
+from django.urls import reverse
+from django.views.decorators.http import condition, require_POST
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from administracion.models import Categoria, EmpresaNombre, HistorialProducto
-from .models import  Venta, VentaProducto, Producto
-from .forms import VentaForm, VentaProductoForm
+from administracion.empresa import obtener_empresa
+from administracion.busqueda import ResultadosPorIds, buscar_productos
+from core.paginacion import PaginacionCursorMixin
+from core.sugerencias import sugerir
+from .models import  ReporteJob, Venta, VentaProducto, Producto
+from .filtros import fecha_parametro
+from .forms import VentaForm, VentaProductoForm, BaseVentaProductoFormSet
+from .resumen import filtrar_resumen, hay_ventas, meses_archivados, meses_entre, por_dia, totales
+from .reportes import CAMPOS_FILTRO, filtrar_ventas, generar_reporte_ventas, nombre_reporte, parametros_reporte, resumen_ventas
+from .tickets import enviar_a_impresora, escpos_ticket, filtrar_tickets, generar_tickets, obtener_ticket, version_ticket
+from .trabajos import encolar_reporte
+from .services import devolver_venta, registrar_venta
+from .stock import StockInsuficiente
 from datetime import date, datetime
 
 
 # Vista para listar ventas
-class VentaListView(LoginRequiredMixin, ListView):
+class VentaListView(LoginRequiredMixin, PaginacionCursorMixin, ListView):
     model = Venta
     template_name = 'trabajadores/venta_lista.html'
     context_object_name = 'ventas'
     paginate_by = 5
     ordering = ['-fecha_creacion']
+    orden_cursor = ('-fecha_creacion', '-id')
 
     def get_queryset(self):
         user = self.request.user
@@ -41,121 +52,147 @@ class VentaListView(LoginRequiredMixin, ListView):
 
             if not queryset.exists():
                 
-                all_terms = list(set(Venta.objects.values_list('cliente', flat=True)))
-                self.similar_terms = difflib.get_close_matches(query, all_terms, n=3, cutoff=0.6)
+                self.similar_terms = sugerir('clientes', query, n=3, corte=0.6)
             else:
                 self.similar_terms = []
 
-        return queryset.order_by('-fecha_creacion')
+        # Vendedor y productos de cada línea en dos consultas para toda la página
+        return queryset.select_related('vendedor').prefetch_related(
+            Prefetch('ventaproducto_set', queryset=VentaProducto.objects.select_related('producto'))
+        ).order_by('-fecha_creacion')
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Diccionario: clave = id de la venta, valor = lista de detalles (productos) de la venta
-        context['ventas_productos'] = {
-            venta.id: list(venta.ventaproducto_set.all()) for venta in context['ventas']
-        }
         context['similar_terms'] = getattr(self, 'similar_terms', [])
-        context['vendedores'] = User.objects.filter(id__in=Venta.objects.values_list('vendedor', flat=True).distinct())
-        context['productos'] = Producto.objects.all()
+        # Los desplegables del reporte se cargan aparte (ver opciones_reporte)
 
         return context
 
 
+@login_required
+def opciones_reporte(request):
+    """Vendedores y productos para los filtros del reporte, se piden al abrir el formulario."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'No autorizado.'}, status=403)
+    vendedores = User.objects.filter(
+        id__in=Venta.objects.order_by().values('vendedor').distinct()
+    ).order_by('username').values('id', 'username')
+    productos = Producto.objects.order_by('nombre').values('id', 'nombre')
+    return JsonResponse({'vendedores': list(vendedores), 'productos': list(productos)})
+
+
 
 # Vista para ver detalles de una venta
 class VentaDetailView(LoginRequiredMixin,DetailView):
     model = Venta
     template_name = 'trabajadores/venta_detalle.html'
     context_object_name = 'venta'
-@login_required   
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Con impresora configurada el ticket se imprime directo; si no, se descarga
+        context['imprimir_ticket'] = bool(getattr(settings, 'TICKETS_IMPRESORA', ''))
+        return context
+
+def venta_ticket(request, pk):
+    """La venta se lee una sola vez por petición para el ETag, Last-Modified y el PDF."""
+    if getattr(request, '_venta_ticket', None) is None:
+        request._venta_ticket = get_object_or_404(Venta.objects.select_related('vendedor'), pk=pk)
+    return request._venta_ticket
+
+
+def etag_ticket(request, pk):
+    return version_ticket(venta_ticket(request, pk), obtener_empresa())
+
+
+def ultima_modificacion_ticket(request, pk):
+    return venta_ticket(request, pk).fecha_actualizacion
+
+
+@login_required
+@condition(etag_func=etag_ticket, last_modified_func=ultima_modificacion_ticket)
 def generar_ticket_venta(request, pk):
-    venta = Venta.objects.get(pk=pk)
-    empresa = EmpresaNombre.objects.first() 
-    num_products = venta.ventaproducto_set.count()
-    def format_price(price):
-        # Convertimos el precio a float para trabajar con él
-        price = float(price)
-        # Si el precio no tiene parte decimal (es entero)
-        if price % 1 == 0:
-            # Lo mostramos como entero con separadores de miles
-            return f"${int(price):,}"
-        else:
-            # Lo mostramos con dos decimales y separadores de miles
-            return f"${price:,.2f}"
-    # Cálculo dinámico de altura
-    altura_fija = 85  # Altura base en mm (elementos fijos)
-    altura_por_producto = 5  # Altura por producto en mm
-    sum_deltas = (altura_fija + altura_por_producto * num_products) * mm
-    ticket_height = sum_deltas + 10 * mm  # Margen superior adicional
-    ticket_width = 80 * mm
-
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="ticket_venta_{venta.id}.pdf"'
-
-    pdf = canvas.Canvas(response, pagesize=(ticket_width, ticket_height))
-    y = ticket_height - 10 * mm  # Margen superior inicial
-
-    # Encabezado
-    pdf.setFont("Courier-Bold", 10)
-    pdf.drawCentredString(ticket_width / 2, y, f"{empresa.nombre}")
-    y -= 5 * mm
-    if empresa.nit:
-        pdf.drawCentredString(ticket_width / 2, y, f"NIT:{empresa.nit}")
+    """Sirve el ticket guardado en disco (ver tickets.py); lo genera si no existe."""
+    nombre = obtener_ticket(venta_ticket(request, pk))
+    return FileResponse(
+        default_storage.open(nombre), as_attachment=True,
+        filename=f"ticket_venta_{pk}.pdf", content_type='application/pdf',
+    )
+
+
+def etag_ticket_escpos(request, pk):
+    return f"{etag_ticket(request, pk)}-escpos"
+
+
+def datos_escpos(request, pk):
+    venta = venta_ticket(request, pk)
+    return escpos_ticket(venta, list(venta.ventaproducto_set.all()), obtener_empresa())
+
+
+@login_required
+@condition(etag_func=etag_ticket_escpos, last_modified_func=ultima_modificacion_ticket)
+def ticket_escpos(request, pk):
+    """El ticket en bytes ESC/POS, para enviarlo tal cual a la impresora térmica."""
+    respuesta = HttpResponse(datos_escpos(request, pk), content_type='application/octet-stream')
+    respuesta['Content-Disposition'] = f'attachment; filename="ticket_venta_{pk}.bin"'
+    return respuesta
+
+
+@login_required
+def tickets_ventas(request):
+    """
+    Tickets de varias ventas en un solo PDF (o un zip con formato=zip),
+    filtradas por `ids` o por día/rango de fechas y vendedor. Sin filtros,
+    los del día.
+    """
+    formato = request.GET.get('formato', 'pdf')
+    if formato not in ('pdf', 'zip'):
+        return JsonResponse({'error': 'Formato no soportado.'}, status=400)
+
+    ids = [int(valor) for valores in request.GET.getlist('ids') for valor in valores.split(',') if valor.strip().isdigit()]
+    parametros = parametros_reporte(request.GET)
+    if ids:
+        parametros.pop('dia', None)
+    # Aquí una fecha inválida no se ignora: se imprimirían los tickets de todo el rango
+    if any(parametros.get(campo) and fecha_parametro(parametros[campo]) is None for campo in ('dia', 'fecha_inicio', 'fecha_fin')):
+        return JsonResponse({'error': 'Parámetros inválidos.'}, status=400)
+    try:
+        ventas = list(filtrar_tickets(request.user, parametros, ids))
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos.'}, status=400)
+    if not ventas:
+        return JsonResponse({'error': 'No hay ventas para los filtros seleccionados.'}, status=404)
+
+    if ids:
+        nombre = "tickets_ventas"
+    elif parametros.get('dia'):
+        nombre = f"tickets_{parametros['dia']}"
     else:
-        pdf.drawCentredString(ticket_width / 2, y, f"NIT: N/A")
-    y -= 5 * mm
-    pdf.drawCentredString(ticket_width / 2, y, localtime(venta.fecha_creacion).strftime('%Y-%m-%d %H:%M'))
-
-    y -= 10 * mm
-
-    # Datos cliente/vendedor
-    pdf.setFont("Courier", 9)
-    pdf.drawString(5 * mm, y, f"Cliente: {venta.cliente}")
-    y -= 5 * mm
-    pdf.drawString(5 * mm, y, f"Vendedor: {venta.vendedor.username}")
-    y -= 10 * mm
-
-    # Separador
-    pdf.drawString(5 * mm, y, "-" * 32)
-    y -= 5 * mm
-
-    # Encabezado productos
-    pdf.setFont("Courier-Bold", 9)
-    pdf.drawString(5 * mm, y, "Cant   Producto       Subtotal")
-    y -= 5 * mm
-    pdf.drawString(5 * mm, y, "-" * 32)
-    y -= 5 * mm
-
-    # Productos
-    pdf.setFont("Courier", 9)
-    for item in venta.ventaproducto_set.all():
-        producto = (item.nombre_producto[:12] if item.nombre_producto else "Producto eliminado").ljust(15)
-        cantidad = str(item.cantidad).rjust(2)
-        subtotal = format_price(item.subtotal).rjust(8)
-        pdf.drawString(5 * mm, y, f"{cantidad}     {producto}{subtotal}")
-        y -= 5 * mm
-
-    # Total
-    total_venta = sum(i.subtotal for i in venta.ventaproducto_set.all())
-
-    pdf.drawString(5 * mm, y, "-" * 32)
-    y -= 5 * mm
-    pdf.setFont("Courier-Bold", 10)
-    pdf.drawString(5 * mm, y, f"TOTAL:".ljust(20) + format_price(total_venta).rjust(8))
-    y -= 10 * mm
-    # Mensaje final
-    pdf.setFont("Courier", 9)
-    pdf.drawCentredString(ticket_width / 2, y, f"Gracias por su compra {venta.cliente}!")
-    y -= 5 * mm
-    pdf.setFont("Courier-Bold", 10)
-    pdf.drawCentredString(ticket_width / 2, y, f"{empresa.nombre}")
-
-    pdf.save()
-    return response
+        nombre = f"tickets_{parametros.get('fecha_inicio', 'inicio')}_a_{parametros.get('fecha_fin', 'hoy')}"
+    return FileResponse(
+        generar_tickets(ventas, formato=formato), as_attachment=True, filename=f"{nombre}.{formato}",
+        content_type='application/zip' if formato == 'zip' else 'application/pdf',
+    )
+
+
+@login_required
+@require_POST
+def imprimir_ticket(request, pk):
+    """Envía el ticket ESC/POS a la impresora configurada en TICKETS_IMPRESORA."""
+    try:
+        enviar_a_impresora(datos_escpos(request, pk))
+    except ImproperlyConfigured as error:
+        messages.error(request, str(error))
+    except OSError as error:
+        messages.error(request, f"No se pudo imprimir el ticket: {error}")
+    else:
+        messages.success(request, f"Ticket de la venta #{pk} enviado a la impresora.")
+    return redirect('venta_detail', pk=pk)
 
 @login_required
 def crear_venta(request):
     VentaProductoFormSet = inlineformset_factory(
-        Venta, VentaProducto, form=VentaProductoForm, extra=0, can_delete=False
+        Venta, VentaProducto, form=VentaProductoForm, formset=BaseVentaProductoFormSet,
+        extra=0, can_delete=False
     )
 
     if request.method == "POST":
@@ -167,36 +204,14 @@ def crear_venta(request):
             venta.vendedor = request.user
             venta.creado_por = request.user
             venta.actualizado_por = request.user
-            venta.save()
-
-            formset.instance = venta
-            formset.save()
-
-            venta.actualizar_total()
-
-            # Historial de productos vendidos
-            for venta_producto in venta.ventaproducto_set.all():
-                producto_vendido = venta_producto.producto
-                if producto_vendido:  # Puede ser None si fue eliminado
-                    detalle = (
-                        f"vendido por {request.user.username}<br>"
-                        f"Vendido a: <strong>{venta.cliente}</strong><br>"
-                        f"Producto: <strong>{producto_vendido.nombre}</strong><br>"
-                        f"Cantidad: <strong>{venta_producto.cantidad}</strong><br>"
-                        f"Precio unitario: <strong>${venta_producto.precio}</strong><br>"
-                        f"Total: <strong>${venta_producto.precio * venta_producto.cantidad}</strong>"
-                    )
-
-                    HistorialProducto.objects.create(
-                        producto=producto_vendido,
-                        nombre_producto=producto_vendido.nombre,
-                        usuario=request.user,
-                        tipo_cambio="Vendido",
-                        detalle_cambio=detalle,
-                        imagen_producto=producto_vendido.imagen if producto_vendido.imagen else None
-                    )
-
-            return redirect('venta_list')
+
+            # Líneas, stock, total e historial en una sola transacción
+            try:
+                registrar_venta(venta, formset.lineas(), request.user)
+            except StockInsuficiente as error:
+                formset.agregar_conflictos(error.conflictos)
+            else:
+                return redirect('venta_list')
     else:
         venta_form = VentaForm()
         formset = VentaProductoFormSet()
@@ -205,23 +220,17 @@ def crear_venta(request):
     query = request.GET.get('q', '')
     from_suggestion = request.GET.get('from_suggestion')
     if query:
-        productos_list = Producto.objects.filter(
-            Q(nombre__icontains=query) |
-            Q(descripcion__icontains=query) |
-            Q(categoria__nombre__icontains=query) |
-            Q(precio__icontains=query)
-        )
+        productos_list = ResultadosPorIds(buscar_productos(query), Producto.objects.all())
         if from_suggestion:
             similar_terms = []
         else:
             if not productos_list.exists():
-                all_terms = list(Producto.objects.values_list('nombre', flat=True)) + \
-                            list(Categoria.objects.values_list('nombre', flat=True))
-                similar_terms = difflib.get_close_matches(query, all_terms, n=3, cutoff=0.6)
+                similar_terms = sugerir(['productos', 'categorias'], query, n=3, corte=0.6)
             else:
                 similar_terms = []
     else:
-        productos_list = Producto.objects.all()
+        # Orden estable para que el Paginator no repita ni salte productos
+        productos_list = Producto.objects.order_by('-fecha_creacion', '-id')
         similar_terms = []
 
     paginator = Paginator(productos_list, 5)
@@ -248,223 +257,111 @@ class ExportVentasPDF(UserPassesTestMixin, View):
 
     def get_queryset(self):
         """Obtiene y filtra el queryset según los parámetros."""
-        user = self.request.user
-        queryset = Venta.objects.filter(devolucion=False) if user.is_superuser else Venta.objects.filter(vendedor=user, devolucion=False)
-        
-        # Si es el formulario de "Ventas del Día"
-        if not self.request.GET.get('fecha_inicio') and not self.request.GET.get('fecha_fin'):
-            today = date.today()
-            queryset = queryset.filter(fecha_creacion__date=today)
-        else:
-            # Si es el formulario de "Ventas por Rango de Fechas"
-            fecha_inicio = self.request.GET.get('fecha_inicio')
-            fecha_fin = self.request.GET.get('fecha_fin')
-            if fecha_inicio:
-                fecha_inicio = parse_date(fecha_inicio)
-                if fecha_inicio:
-                    queryset = queryset.filter(fecha_creacion__date__gte=fecha_inicio)
-            if fecha_fin:
-                fecha_fin = parse_date(fecha_fin)
-                if fecha_fin:
-                    queryset = queryset.filter(fecha_creacion__date__lte=fecha_fin)
-        
-        # Filtrado por vendedor
-        vendedor_id = self.request.GET.get('vendedor')
-        if vendedor_id:
-            queryset = queryset.filter(vendedor_id=vendedor_id)
-        
-        # Filtrado por producto (a través de la relación VentaProducto)
-        producto_id = self.request.GET.get('producto')
-        if producto_id:
-            queryset = queryset.filter(ventaproducto_set__producto_id=producto_id).distinct()
-        
-        # Filtrado por método de pago
-        metodo_pago = self.request.GET.get('metodo_pago')
-        if metodo_pago:
-            queryset = queryset.filter(metodo_pago=metodo_pago)
-        
-        return queryset.select_related('vendedor')
-    def generate_pdf(self, queryset):
-        """Genera un PDF con la lista de ventas filtradas"""
-        
-        # Configuración inicial del PDF
-        response = HttpResponse(content_type='application/pdf')
-        today = date.today()
-        if not self.request.GET.get('fecha_inicio') and not self.request.GET.get('fecha_fin'):
-                response['Content-Disposition'] = f'attachment; filename="ventas_{today}.pdf"'
-        else:
-            fecha_inicio = self.request.GET.get('fecha_inicio', today.strftime('%Y-%m-%d'))
-            fecha_fin = self.request.GET.get('fecha_fin', today.strftime('%Y-%m-%d'))
-            response['Content-Disposition'] = f'attachment; filename="ventas_{fecha_inicio}_a_{fecha_fin}.pdf"'        
-
-        pdf = canvas.Canvas(response, pagesize=letter)
-        width, height = letter
-        page_number = 1
-
-        # Configuración de dimensiones
-        row_height = 25
-        margin_bottom = 80
-        line_height = 15
-
-        # Estilos centralizados
-        styles = {
-            'title': {'font': 'Helvetica-Bold', 'size': 18, 'color': (0.2, 0.4, 0.6)},
-            'header': {'font': 'Helvetica-Bold', 'size': 12, 'color': (1, 1, 1)},
-            'body': {'font': 'Helvetica', 'size': 10, 'color': (0.2, 0.2, 0.2)},
-            'accent': {'color': (0.2, 0.4, 0.6)},
-            'row_color': (0.95, 0.95, 0.95),
-            'footer_font': {'font': 'Helvetica', 'size': 8, 'color': (0.4, 0.4, 0.4)}
+        return filtrar_ventas(self.request.user, parametros_reporte(self.request.GET))
+
+    def nombre_archivo(self):
+        return nombre_reporte(parametros_reporte(self.request.GET))
+
+    def generate_pdf(self, queryset, resumen=None):
+        """Genera el PDF por lotes en un archivo temporal y lo envía por bloques."""
+        archivo = generar_reporte_ventas(queryset, resumen)
+        if archivo is None:
+            return None
+        return FileResponse(
+            archivo, as_attachment=True, filename=self.nombre_archivo(), content_type='application/pdf'
+        )
+
+    def error(self, mensaje):
+        # Crear contexto manualmente para el error
+        context = {
+            'error_message': mensaje,
+            'vendedores': User.objects.filter(groups__name='Trabajadores')
         }
+        return render(self.request, "trabajadores/venta_lista.html", context)
 
-        # Obtener el rango de fechas del queryset
-        min_date = queryset.aggregate(min_date=Min('fecha_creacion'))['min_date']
-        max_date = queryset.aggregate(max_date=Max('fecha_creacion'))['max_date']
-        date_range = (min_date.strftime("%d/%m/%Y") if min_date.date() == max_date.date() 
-                    else f"{min_date.strftime('%d/%m/%Y')} al {max_date.strftime('%d/%m/%Y')}")
-
-        # Funciones auxiliares
-        def truncate_text(text, max_length):
-            """Trunca el texto si excede la longitud máxima, añadiendo '...'."""
-            return text[:max_length - 3] + '...' if len(text) > max_length else text
-        
-        def format_price(price):
-            price = float(price)
-            if price % 1 == 0:
-                return f"${int(price):,}"
-            else:
-                return f"${price:,.2f}"
-        
-        def draw_header():
-            """Dibuja el encabezado del PDF."""
-            y = height - 50
-            pdf.setFont(styles['title']['font'], styles['title']['size'])
-            pdf.setFillColorRGB(*styles['title']['color'])
-            pdf.drawString(40, y, f"Reporte de Ventas Detallado para {date_range}")
-            y -= 20
-            pdf.setFont(styles['body']['font'], styles['body']['size'])
-            pdf.setFillColorRGB(*styles['body']['color'])
-            pdf.drawString(40, y, f"Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
-            y -= 10
-            pdf.line(40, y, width - 40, y)
-            return y - 15
-
-        def draw_footer():
-            empresa = EmpresaNombre.objects.first()
-            """Dibuja el pie de página del PDF."""
-            pdf.setFont(styles['footer_font']['font'], styles['footer_font']['size'])
-            pdf.setFillColorRGB(*styles['footer_font']['color'])
-            if empresa.nombre:
-                pdf.drawCentredString(width / 2, 30, f"Página {page_number} - Sistema de Inventario {empresa.nombre}")
-            else:
-                pdf.drawCentredString(width / 2, 30, f"Página {page_number} - Sistema de Inventario ")
-            pdf.line(40, 40, width - 40, 40)
-
-        def draw_table_header(y):
-            """Dibuja el encabezado de la tabla."""
-            pdf.setFillColorRGB(*styles['accent']['color'])
-            pdf.rect(40, y - row_height, width - 80, row_height, fill=1)
-            pdf.setFont(styles['header']['font'], styles['header']['size'])
-            pdf.setFillColorRGB(*styles['header']['color'])
-            headers = ["ID", "Cliente", "Vendedor", "Productos", "Pago", "Total", "Fecha"]
-            x_positions = [50, 100, 170, 250, 350, 425, 510]
-            for i, header in enumerate(headers):
-                pdf.drawString(x_positions[i], y - (row_height / 1.5), header)
-            return y - row_height
-
-        # Inicio del contenido
-        y_position = draw_table_header(draw_header())
-        total_ventas = 0
-
-        # Optimizar la consulta con prefetch_related
-        for venta in queryset.prefetch_related('ventaproducto_set__producto'):
-            productos_vendidos = venta.ventaproducto_set.all()
-            productos_lista = [
-                    f"{vp.cantidad}x {vp.nombre_producto if vp.nombre_producto else 'Producto eliminado'}"
-                    for vp in productos_vendidos]
-
-            num_productos = len(productos_lista)
-            row_height_adjusted = row_height + (num_productos - 1) * line_height
-
-            # Verificar espacio suficiente o iniciar nueva página
-            if y_position < margin_bottom + row_height_adjusted:
-                draw_footer()
-                pdf.showPage()
-                page_number += 1
-                y_position = draw_table_header(draw_header())
-
-            # Dibujar fila de la venta
-            pdf.setFillColorRGB(*styles['row_color'])
-            pdf.rect(40, y_position - row_height_adjusted, width - 80, row_height_adjusted, fill=1)
-            pdf.setFont(styles['body']['font'], styles['body']['size'])
-            pdf.setFillColorRGB(*styles['body']['color'])
-
-            pdf.drawString(50, y_position - 15, str(venta.id))
-            pdf.drawString(100, y_position - 15, truncate_text(str(venta.cliente), 18))
-            pdf.drawString(170, y_position - 15, truncate_text(venta.vendedor.username, 10))
-            pdf.drawString(350, y_position - 15, truncate_text(str(venta.metodo_pago), 10))
-            pdf.drawRightString(460, y_position - 15, format_price(venta.total))
-            
-            pdf.drawString(490, y_position - 15, localtime(venta.fecha_creacion).strftime("%d/%m/%Y %H:%M"))
-
-            # Dibujar lista de productos
-            for i, product in enumerate(productos_lista):
-                pdf.drawString(250, y_position - 13 - i * line_height, truncate_text(product, 16))
-
-            total_ventas += venta.total
-            pdf.line(40, y_position - row_height_adjusted, width - 40, y_position - row_height_adjusted)
-            y_position -= row_height_adjusted
-
-        # Asegurar espacio para el total general
-        if y_position < margin_bottom + 40:
-            draw_footer()
-            pdf.showPage()
-            page_number += 1
-            y_position = draw_table_header(draw_header())
-
-        # Dibujar total general
-        pdf.setFont(styles['header']['font'], 14)
-        total_text = f"TOTAL GENERAL: {format_price(total_ventas)}"
-        text_width = pdf.stringWidth(total_text, styles['header']['font'], 14)
-        y_position -= 40
-        pdf.setFillColorRGB(*styles['accent']['color'])
-        pdf.rect(width - 40 - (text_width + 20), y_position, text_width + 20, 30, fill=1)
-        pdf.setFillColorRGB(1, 1, 1)
-        pdf.drawRightString(width - 40 - 10, y_position + 8, total_text)
-
-        # Finalizar el PDF
-        draw_footer()
-        pdf.save()
-        return response
-        
-    
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        # Existencia de registros y rango de fechas desde el resumen diario
+        resumen = totales(filtrar_resumen(request.user, parametros_reporte(request.GET)))
          
         # Validar si hay registros en el rango de fechas
-        if not queryset.exists():
-            # Crear contexto manualmente para el error
-            context = {
-                'error_message': "No hay registros de ventas en el rango de fechas seleccionado.",
-                'vendedores': User.objects.filter(groups__name='Trabajadores')  
-            }
-            return render(request, "trabajadores/venta_lista.html", context)
+        if not resumen['cantidad']:
+            return self.error("No hay registros de ventas en el rango de fechas seleccionado.")
+
+        # Las ventas de los meses archivados solo quedan en el resumen: el PDF
+        # las listaría vacías
+        archivados = set(meses_archivados())
+        meses = set(meses_entre(resumen['primera'], resumen['ultima']))
+        if archivados & meses:
+            respuesta = None if meses <= archivados else self.generate_pdf(self.get_queryset())
+            if respuesta is None:
+                return self.error(
+                    "Las ventas del rango seleccionado están archivadas ("
+                    + ", ".join(f"{mes:%Y-%m}" for mes in sorted(archivados & meses))
+                    + "); el reporte solo incluye ventas que siguen en el sistema."
+                )
+            return respuesta
+
+        return self.generate_pdf(self.get_queryset(), resumen)
+
+    def post(self, request, *args, **kwargs):
+        """Encola el reporte en segundo plano y devuelve el id del trabajo."""
+        job = encolar_reporte(request.user, parametros_reporte(request.POST))
+        if job is None:
+            return JsonResponse(
+                {'error': "No hay registros de ventas en el rango de fechas seleccionado."}, status=404
+            )
+        return JsonResponse(datos_reporte(job), status=202)
+
+
+def datos_reporte(job):
+    datos = {
+        'id': job.pk,
+        'estado': job.estado,
+        'ventas_totales': job.ventas_totales,
+        'ventas_procesadas': job.ventas_procesadas,
+        'paginas': job.paginas,
+        'estado_url': reverse('reporte_estado', args=[job.pk]),
+    }
+    if job.estado == ReporteJob.TERMINADO:
+        datos['descarga_url'] = reverse('reporte_descargar', args=[job.pk])
+    if job.estado == ReporteJob.ERROR:
+        datos['error'] = job.error
+    return datos
+
 
-        return self.generate_pdf(queryset)
+def obtener_reporte(request, pk):
+    """El trabajo solo lo ven el superusuario y quien lo pidió."""
+    if not request.user.is_staff:
+        raise PermissionDenied
+    job = get_object_or_404(ReporteJob, pk=pk)
+    if not request.user.is_superuser and job.usuario_id != request.user.pk:
+        raise Http404
+    return job
 
 
+@login_required
+def estado_reporte(request, pk):
+    return JsonResponse(datos_reporte(obtener_reporte(request, pk)))
+
+
+@login_required
+def descargar_reporte(request, pk):
+    job = obtener_reporte(request, pk)
+    if job.estado != ReporteJob.TERMINADO or not job.archivo:
+        raise Http404("El reporte todavía no está listo.")
+    return FileResponse(
+        job.archivo.open('rb'), as_attachment=True, filename=job.nombre_archivo, content_type='application/pdf'
+    )
+
 
+
+@login_required
 def validar_ventas(request):
     """ Valida ventas según fechas, vendedor o producto. """
 
     # 📌 Obtener parámetros
     fecha_inicio_str = request.GET.get('fecha_inicio')
     fecha_fin_str = request.GET.get('fecha_fin')
-    vendedor_id = request.GET.get('vendedor')
-    producto_id = request.GET.get('producto')
-    metodo_pago = request.GET.get('metodo_pago') 
-
-
-    queryset = Venta.objects.all()
 
     #  Validación de fechas
     try:
@@ -476,65 +373,70 @@ def validar_ventas(request):
     if fecha_inicio and fecha_fin and fecha_inicio > fecha_fin:
         return JsonResponse({'error': 'La fecha de inicio no puede ser posterior a la fecha fin.'}, status=400)
 
-    if fecha_inicio:
-        queryset = queryset.filter(fecha_creacion__date__gte=fecha_inicio)
-    if fecha_fin:
-        queryset = queryset.filter(fecha_creacion__date__lte=fecha_fin)
+    parametros = {campo: request.GET.get(campo) for campo in CAMPOS_FILTRO if request.GET.get(campo)}
+    for campo in ('vendedor', 'producto'):
+        if campo in parametros and not parametros[campo].isdigit():
+            del parametros[campo]
 
+    # Se consulta el resumen diario (una fila por día) en lugar de las
+    # ventas, con los mismos filtros que usa el reporte
+    existe = hay_ventas(filtrar_resumen(request.user, parametros))
+    return JsonResponse({'existe': existe})
 
-    if vendedor_id and vendedor_id.isdigit():
-        queryset = queryset.filter(vendedor_id=vendedor_id)
-
-    # Validación del producto (Usar la relación correcta con VentaProducto)
-    if producto_id and producto_id.isdigit():
-        queryset = queryset.filter(ventaproducto_set__producto_id=producto_id) 
-    if metodo_pago:
-        queryset = queryset.filter(metodo_pago=metodo_pago)
-    existe = queryset.exists()
 
-    return JsonResponse({'existe': existe})
+@login_required
+def resumen_diario(request):
+    """Ventas, unidades e ingresos por día, leídos del resumen diario."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'No autorizado.'}, status=403)
+    filas = filtrar_resumen(request.user, parametros_reporte(request.GET))
+    dias = [
+        {'fecha': fila['fecha'].isoformat(), 'ventas': fila['ventas'],
+         'unidades': fila['unidades'], 'ingresos': f"{fila['ingresos']:.2f}"}
+        for fila in por_dia(filas)
+    ]
+    total = totales(filas)
+    return JsonResponse({
+        'dias': dias,
+        'ventas': total['cantidad'],
+        'unidades': total['unidades'],
+        'ingresos': f"{total['ingresos'] or 0:.2f}",
+    })
+
+class DevolverVentaView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Devuelve la venta completa o, si el formulario trae `devolver_<línea>`,
+    solo esas unidades de cada línea (ver services.devolver_venta).
+    """
 
-class DevolverVentaView(View, UserPassesTestMixin):
     def test_func(self):
         return self.request.user.is_staff
 
+    def cantidades(self):
+        cantidades = {}
+        for clave, valor in self.request.POST.items():
+            if clave.startswith('devolver_'):
+                try:
+                    cantidades[int(clave[len('devolver_'):])] = int(valor or 0)
+                except ValueError:
+                    continue
+        return cantidades or None
+
     def post(self, request, pk):
-        venta = get_object_or_404(Venta, pk=pk)
-        
-        if not venta.devolucion:
-            # Registrar en el historial y actualizar stock
-            for item in venta.ventaproducto_set.all():
-                if item.producto:
-                    # Actualizar stock
-                    item.producto.cantidad += item.cantidad
-                    item.producto.save()
-                    
-                    # Registrar en el historial
-                    detalle = (
-                        f"DEVOLUCIÓN realizada por {request.user.username}<br>"
-                        f"Venta original ID: <strong>{venta.id}</strong><br>"
-                        f"Cliente: <strong>{venta.cliente}</strong><br>"
-                        f"Producto: <strong>{item.producto.nombre}</strong><br>"
-                        f"Cantidad devuelta: <strong>{item.cantidad}</strong><br>"
-                        f"Precio unitario: <strong>${item.precio}</strong><br>"
-                        f"Total devuelto: <strong>${item.precio * item.cantidad}</strong>"
-                    )
-                    
-                    HistorialProducto.objects.create(
-                        producto=item.producto,
-                        nombre_producto=item.producto.nombre,
-                        usuario=request.user,
-                        tipo_cambio="Devolución",
-                        detalle_cambio=detalle,
-                        imagen_producto=item.producto.imagen if item.producto.imagen else None
-                    )
-            
-            # Marcar la venta como devuelta
-            venta.devolucion = True
-            venta.save(update_fields=['devolucion'])
-            
+        cantidades = self.cantidades()
+        try:
+            venta, devueltas = devolver_venta(pk, request.user, cantidades)
+        except Venta.DoesNotExist:
+            raise Http404("La venta no existe.")
+
+        if not devueltas:
+            messages.warning(request, f'La venta #{venta.id} no tiene unidades por devolver.')
+        elif venta.devolucion:
             messages.success(request, f'Venta #{venta.id} marcada como devuelta. Stock actualizado e historial registrado.')
         else:
-            messages.warning(request, f'La venta #{venta.id} ya estaba marcada como devuelta.')
-        
+            unidades = sum(cantidad for _, cantidad in devueltas)
+            messages.success(request, f'Se devolvieron {unidades} unidad(es) de la venta #{venta.id}. Stock actualizado e historial registrado.')
+
+        if cantidades is not None:
+            return redirect('venta_detail', pk=venta.pk)
         return redirect('venta_list')
\ No newline at end of file